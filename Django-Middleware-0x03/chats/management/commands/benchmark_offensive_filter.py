@@ -0,0 +1,69 @@
+import json
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from chats.wordfilter import WordMatcher
+
+
+def naive_contains(words, data):
+    """
+    The original per-word substring scan, kept for comparison
+    """
+    if isinstance(data, dict):
+        return any(naive_contains(words, value) for value in data.values())
+    if isinstance(data, list):
+        return any(naive_contains(words, item) for item in data)
+    if isinstance(data, str):
+        return any(word.lower() in data.lower() for word in words)
+    return False
+
+
+class Command(BaseCommand):
+    help = "Benchmark the offensive language matcher against the naive scan on large JSON bodies"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--words', type=int, default=10000, help='Number of terms in the word list')
+        parser.add_argument('--messages', type=int, default=2000, help='Messages per JSON body')
+        parser.add_argument('--length', type=int, default=200, help='Words per message')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-naive', action='store_true', help='Only time the compiled matcher')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        def random_word():
+            return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+
+        words = [random_word() + 'x' for _ in range(options['words'])]
+        # Clean text is the worst case: every token has to be checked
+        term_set = set(words)
+        vocabulary = [word for word in (random_word() for _ in range(5000)) if word not in term_set]
+        body = json.dumps({
+            'messages': [
+                {'message_body': ' '.join(rng.choices(vocabulary, k=options['length']))}
+                for _ in range(options['messages'])
+            ]
+        })
+        self.stdout.write(f"Body size: {len(body) / 1024 / 1024:.2f} MB, word list: {len(words)} terms")
+
+        start = time.perf_counter()
+        matcher = WordMatcher(words)
+        self.stdout.write(f"Matcher build: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        timings = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            matcher.contains(json.loads(body))
+            timings.append(time.perf_counter() - start)
+        self.stdout.write(f"Compiled matcher: best {min(timings) * 1000:.1f} ms per body")
+
+        if not options['skip_naive']:
+            # The naive scan is O(words x values x length); one run is plenty
+            start = time.perf_counter()
+            naive_contains(words, json.loads(body))
+            naive = time.perf_counter() - start
+            self.stdout.write(f"Naive scan: {naive * 1000:.1f} ms per body ({naive / min(timings):.0f}x slower)")
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from unittest import mock
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+
+from chats.middleware import AsyncCapableMiddleware
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = ("Drive the full middleware stack in-process under ASGI and report latency "
+            "with the chats middleware running sync (the default) and natively async (CHATS_ASYNC_MIDDLEWARE)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--path', default='/api/conversations/')
+        parser.add_argument('--method', default='GET')
+
+    def handle(self, *args, **options):
+        for label, native in (('sync (default)', False), ('native async', True)):
+            with mock.patch.object(AsyncCapableMiddleware, 'async_capable', native):
+                # The middleware chain is adapted once, when the handler is built
+                handler = ASGIHandler()
+            latencies, statuses, elapsed = asyncio.run(self.run_load(handler, options))
+            latencies.sort()
+            self.stdout.write(
+                f"{label:22} {len(latencies) / elapsed:8.0f} req/s  "
+                f"p50 {percentile(latencies, 50) * 1000:6.2f} ms  "
+                f"p99 {percentile(latencies, 99) * 1000:6.2f} ms  "
+                f"statuses {sorted(statuses)}"
+            )
+
+    async def run_load(self, handler, options):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': options['method'].upper(),
+            'scheme': 'http',
+            'path': options['path'],
+            'root_path': '',
+            'query_string': b'',
+            'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 50000),
+            'server': ('localhost', 80),
+        }
+        latencies = []
+        statuses = set()
+        queue = asyncio.Queue()
+        for _ in range(options['requests']):
+            queue.put_nowait(None)
+
+        async def one_request():
+            delivered = False
+            never = asyncio.Event()
+
+            async def receive():
+                nonlocal delivered
+                if not delivered:
+                    delivered = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # Keep the connection open; the client never disconnects
+                await never.wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.add(message['status'])
+
+            start = time.perf_counter()
+            await handler(dict(scope), receive, send)
+            latencies.append(time.perf_counter() - start)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                await one_request()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        return latencies, statuses, time.perf_counter() - start
@@ -1,65 +1,204 @@
 import datetime
 import logging
-from django.http import HttpResponseForbidden, JsonResponse
-from django.core.cache import cache
+import random
 import time
-import json
-from django.contrib.auth.models import User
+from django.http import HttpResponseForbidden, JsonResponse
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.utils.functional import classproperty
+from .wordfilter import DEFAULT_OFFENSIVE_WORDS, ReloadingWordMatcher
+from .ratelimit import RateLimiter, get_client_ip, rate_limit_headers
+from .roles import aget_user_groups, get_user_groups
+from .preprocessing import get_json_body, get_route, is_json_body_too_large
+from .request_logging import (
+    QueryCounter,
+    get_request_log_config,
+    get_request_logger,
+    install_on_open_connections,
+    query_counter,
+)
+
+# Debug output for the other middlewares; silent unless configured
+logger = logging.getLogger(__name__)
+
 
-# Set up logging configuration
-logger = logging.getLogger('request_logger')
-logger.setLevel(logging.INFO)
+async def aget_user(request):
+    """
+    Resolve request.user without a sync DB hit from async code
+    """
+    if hasattr(request, 'auser'):
+        return await request.auser()
+    return getattr(request, 'user', AnonymousUser())
 
-# Create file handler that will write to requests.log
-file_handler = logging.FileHandler('requests.log')
-file_handler.setLevel(logging.INFO)
 
-# Create formatter to specify the log message format
-formatter = logging.Formatter('%(asctime)s - %(message)s')
-file_handler.setFormatter(formatter)
+def get_body_too_large_response():
+    return JsonResponse({'error': 'Request body is too large.'}, status=413)
 
-# Add the handler to the logger
-logger.addHandler(file_handler)
 
+class AsyncCapableMiddleware:
+    """
+    Base for middleware that runs natively in both modes. Django passes an
+    async get_response under ASGI; in that case __call__ hands off to
+    __acall__ so no sync_to_async thread hop is needed.
+
+    The async mode is only offered with CHATS_ASYNC_MIDDLEWARE. Once these
+    middleware run async, Django keeps every middleware above them async
+    too, and its own MiddlewareMixin classes then hop to a thread for both
+    process_request and process_response. Below them a sync chain, entered
+    with a single hop, has the lower latency (see loadtest_asgi).
+    """
+    sync_capable = True
+
+    @classproperty
+    def async_capable(cls):
+        return getattr(settings, 'CHATS_ASYNC_MIDDLEWARE', False)
 
-class RequestLoggingMiddleware:
     def __init__(self, get_response):
         """
         Initialize the middleware.
         get_response is the next middleware in the chain or the view
         """
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+class RequestPreprocessingMiddleware(AsyncCapableMiddleware):
+    """
+    Runs before the other chats middleware: classifies the route once,
+    enforces CHATS_MAX_JSON_BODY and parses chat JSON bodies a single time.
+    The results are cached on the request for the middleware below and for
+    DRF (through chats.parsers.CachedJSONParser).
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        rejected = self.preprocess(request)
+        if rejected is not None:
+            return rejected
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        rejected = self.preprocess(request)
+        if rejected is not None:
+            return rejected
+        return await self.get_response(request)
+
+    def preprocess(self, request):
+        route = get_route(request)
+        if route.is_chat_api and request.method in ('POST', 'PUT', 'PATCH'):
+            if is_json_body_too_large(request):
+                return get_body_too_large_response()
+            get_json_body(request)
+        return None
+
+
+class RequestLoggingMiddleware(AsyncCapableMiddleware):
+    """
+    Logs one JSON line per request through a queue, so the request thread
+    never waits on file I/O. See REQUEST_LOG in settings.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.request_logger = get_request_logger()
+        self.sample_rate = get_request_log_config()['sample_rate']
+        if self.async_mode:
+            # Avoid a sync_to_async hop when Django calls process_view
+            self.process_view = self.aprocess_view
 
     def __call__(self, request):
         """
         This method is called for every request
         """
-        # Get user information - handle both authenticated and anonymous users
-        user = "Anonymous"
-        if hasattr(request, 'user') and request.user.is_authenticated:
-            user = request.user.username
-        
-        # Log the request information
-        log_message = f"User: {user} - Path: {request.path}"
-        logger.info(log_message)
-        
-        # Process the request and get response
-        response = self.get_response(request)
+        if self.async_mode:
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        install_on_open_connections()
+        counter = QueryCounter()
+        token = query_counter.set(counter)
+        try:
+            # Process the request and get response
+            response = self.get_response(request)
+        finally:
+            query_counter.reset(token)
         
+        self.log_request(request, getattr(request, 'user', None), response, started, counter)
         return response
-    
-class RestrictAccessByTimeMiddleware:
-    def __init__(self, get_response):
-        """
-        Initialize the middleware
-        """
-        self.get_response = get_response
 
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        install_on_open_connections()
+        counter = QueryCounter()
+        token = query_counter.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            query_counter.reset(token)
+        self.log_request(request, await aget_user(request), response, started, counter)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._view_started = time.perf_counter()
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        request._view_started = time.perf_counter()
+        return None
+
+    def log_request(self, request, user, response, started, counter):
+        # Errors are always logged; everything else is sampled
+        if response.status_code < 500 and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+
+        finished = time.perf_counter()
+        view_started = getattr(request, '_view_started', None)
+        username = "Anonymous"
+        if user is not None and user.is_authenticated:
+            username = user.username
+
+        self.request_logger.info('request', extra={'request_data': {
+            'user': username,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round((finished - started) * 1000, 3),
+            'view_ms': round((finished - view_started) * 1000, 3) if view_started is not None else None,
+            'db_queries': counter.count,
+        }})
+    
+class RestrictAccessByTimeMiddleware(AsyncCapableMiddleware):
     def __call__(self, request):
         """
         Check if current time is between 6 PM (18:00) and 9 PM (21:00)
         If yes, block access to chat-related paths
         """
+        if self.async_mode:
+            return self.__acall__(request)
+
+        blocked = self.check_access(request)
+        if blocked is not None:
+            return blocked
+        
+        # If not restricted time or not chat path, process normally
+        response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        blocked = self.check_access(request)
+        if blocked is not None:
+            return blocked
+        return await self.get_response(request)
+
+    def check_access(self, request):
+        """
+        Return a 403 response during restricted hours, otherwise None
+        """
         # Get current time
         current_time = datetime.datetime.now().time()
         start_time = datetime.time(18, 0)  # 6 PM
@@ -68,34 +207,57 @@ class RestrictAccessByTimeMiddleware:
         # Check if current time is between 6 PM and 9 PM
         if start_time <= current_time <= end_time:
             # Check if the request is for conversation/message paths (your actual API structure)
-            restricted_paths = ['/api/conversations', '/api/messages']
-            if any(request.path.startswith(path) for path in restricted_paths):
+            if get_route(request).is_chat_api:
                 return HttpResponseForbidden(
                     "Chat access is restricted between 6 PM and 9 PM. Please try again later."
                 )
-        
-        # If not restricted time or not chat path, process normally
-        response = self.get_response(request)
-        return response
+        return None
 
-class OffensiveLanguageMiddleware:
+class OffensiveLanguageMiddleware(AsyncCapableMiddleware):
     def __init__(self, get_response):
         """
         Initialize the middleware
         """
-        self.get_response = get_response
-        # Define offensive words (you can expand this list)
-        self.offensive_words = [
-            'badword', 'offensive', 'inappropriate', 'hate', 
-            'violence', 'spam', 'stupid', 'idiot'  # Add more as needed
-        ]
+        super().__init__(get_response)
+        # Build the matcher once; the word file (if configured) is re-read
+        # automatically when it changes on disk
+        self.matcher = ReloadingWordMatcher(
+            path=getattr(settings, 'OFFENSIVE_WORDS_FILE', None),
+            default_words=getattr(settings, 'OFFENSIVE_WORDS', DEFAULT_OFFENSIVE_WORDS),
+            check_interval=getattr(settings, 'OFFENSIVE_WORDS_RELOAD_INTERVAL', 5.0),
+        )
 
     def __call__(self, request):
         """
         Check for offensive language in POST requests
         """
+        if self.async_mode:
+            return self.__acall__(request)
+
+        blocked = self.check_request(request)
+        if blocked is not None:
+            return blocked
+        
+        response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        # The body is already buffered in memory under ASGI, so the scan is
+        # pure CPU work and runs inline
+        blocked = self.check_request(request)
+        if blocked is not None:
+            return blocked
+        return await self.get_response(request)
+
+    def check_request(self, request):
+        """
+        Return a 400 response if the request carries offensive language
+        """
         # Only check POST requests for messages/conversations
-        if request.method == 'POST' and any(path in request.path for path in ['/api/conversations', '/api/messages']):
+        if request.method == 'POST' and get_route(request).is_chat_api:
+            if is_json_body_too_large(request):
+                return get_body_too_large_response()
+
             # Check for offensive language in request data
             offensive_found = self.check_offensive_language(request)
             
@@ -103,177 +265,124 @@ class OffensiveLanguageMiddleware:
                 return JsonResponse({
                     'error': 'Your message contains inappropriate language and cannot be sent.'
                 }, status=400)
-        
-        response = self.get_response(request)
-        return response
+        return None
 
     def check_offensive_language(self, request):
         """
         Check request data for offensive language
         """
+        matcher = self.matcher.matcher
+
         # Check POST data
         if request.POST:
-            for key, value in request.POST.items():
-                if isinstance(value, str):
-                    for word in self.offensive_words:
-                        if word.lower() in value.lower():
-                            return True
+            for key, values in request.POST.lists():
+                if matcher.contains(values):
+                    return True
         
-        # Also check JSON data for API requests
-        if request.content_type == 'application/json' and request.body:
-            try:
-                data = json.loads(request.body)
-                # Recursively check all values in JSON data
-                return self._check_dict_for_offensive_words(data)
-            except json.JSONDecodeError:
-                pass
+        # Also check JSON data for API requests (parsed once per request)
+        data = get_json_body(request)
+        if data is not None:
+            # Recursively check all values in JSON data
+            return matcher.contains(data)
         
         return False
 
-    def _check_dict_for_offensive_words(self, data):
-        """
-        Recursively check dictionary for offensive words
-        """
-        if isinstance(data, dict):
-            for value in data.values():
-                if self._check_dict_for_offensive_words(value):
-                    return True
-        elif isinstance(data, list):
-            for item in data:
-                if self._check_dict_for_offensive_words(item):
-                    return True
-        elif isinstance(data, str):
-            for word in self.offensive_words:
-                if word.lower() in data.lower():
-                    return True
-        return False
-
 
-class RateLimitMiddleware:
+class RateLimitMiddleware(AsyncCapableMiddleware):
     def __init__(self, get_response):
-        self.get_response = get_response
-        self.rate_limit = 5  # 5 POST messages per minute
-        self.window_size = 60  # 1 minute in seconds
+        super().__init__(get_response)
+        # Rules, algorithm and storage come from RATE_LIMIT_* settings;
+        # the default is 5 POST messages per minute per IP
+        self.limiter = RateLimiter.from_settings()
 
     def __call__(self, request):
         """
-        Count the number of POST requests (messages) from each IP address
+        Count requests against the first matching rate limit rule
         """
-        # Only count POST requests to messages/conversations endpoints
-        if request.method == 'POST' and any(path in request.path for path in ['/api/messages', '/api/conversations']):
-            # Get client IP address
-            ip_address = self.get_client_ip(request)
-            print(f"Counting POST request from IP: {ip_address} to {request.path}")  # Debug
-            
-            # Create a unique key for this IP for POST requests
-            cache_key = f"post_rate_limit_{ip_address}"
-            
-            # Get current POST request count and timestamp
-            request_data = cache.get(cache_key, {'post_count': 0, 'first_post_request': time.time()})
-            print(f"Current POST count: {request_data['post_count']}")  # Debug
-            
-            # Check if window has expired
-            current_time = time.time()
-            if current_time - request_data['first_post_request'] > self.window_size:
-                # Reset counter - new time window
-                request_data = {'post_count': 1, 'first_post_request': current_time}
-                print("Reset POST counter - new window")  # Debug
-            else:
-                # Increment POST counter
-                request_data['post_count'] += 1
-                print(f"Incremented POST counter to: {request_data['post_count']}")  # Debug
-            
-            # Check if rate limit exceeded for POST requests
-            if request_data['post_count'] > self.rate_limit:
-                print(f"POST RATE LIMIT EXCEEDED! IP: {ip_address} made {request_data['post_count']} POST requests")  # Debug
-                return JsonResponse({
-                    'error': f'Rate limit exceeded. Maximum {self.rate_limit} messages per minute.'
-                }, status=429)
-            
-            # Update cache
-            cache.set(cache_key, request_data, self.window_size)
-            print(f"POST cache updated. Count: {request_data['post_count']}")  # Debug
-        
-        response = self.get_response(request)
+        if self.async_mode:
+            return self.__acall__(request)
+
+        rule, result = self.limiter.hit(request)
+        if result is None:
+            return self.get_response(request)
+
+        if not result.allowed:
+            response = self.get_rate_limited_response(rule)
+        else:
+            response = self.get_response(request)
+        return self.add_headers(response, result)
+
+    async def __acall__(self, request):
+        rule, result = await self.limiter.ahit(request)
+        if result is None:
+            return await self.get_response(request)
+
+        if not result.allowed:
+            response = self.get_rate_limited_response(rule)
+        else:
+            response = await self.get_response(request)
+        return self.add_headers(response, result)
+
+    def get_rate_limited_response(self, rule):
+        return JsonResponse({
+            'error': f'Rate limit exceeded. Maximum {rule.limit} requests per {rule.period} seconds.'
+        }, status=429)
+
+    def add_headers(self, response, result):
+        for header, value in rate_limit_headers(result).items():
+            response[header] = value
         return response
 
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
+        return get_client_ip(request)
     
-class RolepermissionMiddleware:
+class RolepermissionMiddleware(AsyncCapableMiddleware):
     def __init__(self, get_response):
         """
         Initialize the middleware
         """
-        self.get_response = get_response
-        
-        # Define admin-only actions and paths
-        self.admin_actions = ['delete', 'ban', 'moderate', 'clear', 'remove']
-        self.admin_paths = ['/admin/', '/api/admin', '/delete/']  # Added /delete/
-        
-        # Define moderator actions and paths  
-        self.moderator_actions = ['edit', 'warn', 'hide', 'lock']
-        self.moderator_paths = ['/moderate/', '/api/moderate']
+        # Admin/moderator actions and paths live in chats.roles, compiled
+        # once into DEFAULT_ROUTE_RULES and matched by the preprocessing
+        # stage (see get_required_role)
+        super().__init__(get_response)
 
     def __call__(self, request):
         """
         Check user's role before allowing access to specific actions
         """
-        # Debug: print request info
-        print(f"RolePermissionMiddleware: Path={request.path}, Method={request.method}, User={getattr(request.user, 'username', 'Anonymous')}")
-        
+        if self.async_mode:
+            return self.__acall__(request)
+
         # Check if the request requires special permissions
         required_role = self.get_required_role(request)
         
         if required_role:
-            print(f"Required role: {required_role}")
+            logger.debug("%s %s requires %s role", request.method, request.path, required_role)
             
             if not request.user.is_authenticated:
-                print("User not authenticated - blocking access")
+                logger.debug("User not authenticated - blocking access")
                 return self.get_permission_denied_response(request, required_role)
                 
             if not self.has_required_role(request.user, required_role):
-                print(f"User {request.user.username} lacks {required_role} role - blocking access")
+                logger.debug("User %s lacks %s role - blocking access", request.user.username, required_role)
                 return self.get_permission_denied_response(request, required_role)
-            else:
-                print(f"User {request.user.username} has required {required_role} role - allowing access")
         
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        required_role = self.get_required_role(request)
+        if required_role:
+            user = await aget_user(request)
+            if not user.is_authenticated or not await self.ahas_required_role(user, required_role):
+                return self.get_permission_denied_response(request, required_role)
+        return await self.get_response(request)
+
     def get_required_role(self, request):
         """
         Determine what role is required for this request
         """
-        # Check path-based permissions
-        for admin_path in self.admin_paths:
-            if admin_path in request.path:
-                return 'admin'
-                
-        for moderator_path in self.moderator_paths:
-            if moderator_path in request.path:
-                return 'moderator'
-        
-        # Check specific test endpoints
-        if '/admin-action' in request.path:
-            return 'admin'
-        if '/moderator-action' in request.path:
-            return 'moderator'
-        
-        # Check action-based permissions for POST, PUT, DELETE methods
-        if request.method in ['POST', 'PUT', 'DELETE']:
-            # Check URL path for actions
-            path_lower = request.path.lower()
-            for action in self.admin_actions:
-                if action in path_lower:
-                    return 'admin'
-        
-        return None
+        return get_route(request).required_role
 
     def has_required_role(self, user, required_role):
         """
@@ -283,10 +392,21 @@ class RolepermissionMiddleware:
             return user.is_superuser or user.is_staff
         elif required_role == 'moderator':
             # Check if user is in moderators group or is staff/admin
-            return user.is_staff or user.is_superuser or user.groups.filter(name='moderators').exists()
+            # (group names are cached per user and invalidated on change)
+            return user.is_staff or user.is_superuser or 'moderators' in get_user_groups(user)
         
         return False
 
+    async def ahas_required_role(self, user, required_role):
+        """
+        Async variant of has_required_role
+        """
+        if required_role == 'admin':
+            return user.is_superuser or user.is_staff
+        elif required_role == 'moderator':
+            return user.is_staff or user.is_superuser or 'moderators' in await aget_user_groups(user)
+        return False
+
     def get_permission_denied_response(self, request, required_role):
         """
         Return appropriate permission denied response
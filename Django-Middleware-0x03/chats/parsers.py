@@ -0,0 +1,15 @@
+from rest_framework.parsers import JSONParser
+
+
+class CachedJSONParser(JSONParser):
+    """
+    JSONParser that reuses the body already parsed by the chats middleware
+    (see chats.preprocessing.get_json_body) instead of decoding it again
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        django_request = getattr(request, '_request', None)
+        if django_request is not None and hasattr(django_request, '_chats_json'):
+            return django_request._chats_json
+        return super().parse(stream, media_type, parser_context)
@@ -0,0 +1,84 @@
+import json
+from collections import namedtuple
+
+from django.conf import settings
+
+from .roles import DEFAULT_ROUTE_RULES
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+
+CHAT_API_PREFIXES = ('/api/conversations', '/api/messages')
+
+DEFAULT_MAX_JSON_BODY = 1024 * 1024
+
+ChatRoute = namedtuple('ChatRoute', ['is_chat_api', 'required_role'])
+
+
+def loads(data):
+    """
+    Parse JSON with orjson when installed, falling back to the stdlib
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def get_route(request):
+    """
+    Classify the request path once and cache it on the request for every
+    chats middleware downstream
+    """
+    route = getattr(request, 'chat_route', None)
+    if route is None:
+        route = ChatRoute(
+            is_chat_api=request.path.startswith(CHAT_API_PREFIXES),
+            required_role=DEFAULT_ROUTE_RULES.resolve(request.method, request.path),
+        )
+        request.chat_route = route
+    return route
+
+
+def max_json_body():
+    return getattr(settings, 'CHATS_MAX_JSON_BODY', DEFAULT_MAX_JSON_BODY)
+
+
+def is_json_body_too_large(request):
+    if request.content_type != 'application/json':
+        return False
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return False
+    return length > max_json_body()
+
+
+def get_json_body(request):
+    """
+    Parse a JSON request body at most once per request.
+
+    Returns None for non-JSON, empty, oversized or invalid bodies. Successful
+    parses are stored on the request so CachedJSONParser can hand the same
+    object to DRF instead of decoding the body again.
+    """
+    if hasattr(request, '_chats_json'):
+        return request._chats_json
+    if getattr(request, '_chats_json_failed', False):
+        return None
+    if request.content_type != 'application/json' or is_json_body_too_large(request):
+        return None
+
+    body = request.body
+    if not body:
+        return None
+    try:
+        data = loads(body)
+    except ValueError:
+        # Leave invalid JSON to DRF so clients still get its ParseError
+        request._chats_json_failed = True
+        return None
+    request._chats_json = data
+    return data
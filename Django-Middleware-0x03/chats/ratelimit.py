@@ -0,0 +1,389 @@
+import math
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'limit', 'remaining', 'reset', 'retry_after'])
+
+UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+DEFAULT_RATE_LIMIT_RULES = [
+    {
+        'name': 'chat-posts',
+        'paths': ['/api/messages', '/api/conversations'],
+        'methods': ['POST'],
+        'rate': '5/m',
+        'algorithm': 'sliding_window',
+        'key': 'ip',
+    },
+]
+
+
+def parse_rate(rate):
+    """
+    Parse '5/m', '100/h' or '10/30s' into (limit, period_in_seconds)
+    """
+    count, _, period = rate.partition('/')
+    unit = period[-1:].lower()
+    if unit not in UNIT_SECONDS:
+        raise ValueError(f"Invalid rate {rate!r}: unit must be one of s, m, h, d")
+    multiplier = int(period[:-1]) if period[:-1] else 1
+    return int(count), multiplier * UNIT_SECONDS[unit]
+
+
+def get_client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+# -----------------------------
+# Storage backends
+# -----------------------------
+class LocalStorage:
+    """
+    In-process storage split into shards, each with its own lock and dict.
+    Atomic across threads of a single worker only; use CacheStorage with a
+    shared cache for multi-worker deployments.
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, shards=64):
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self._writes = [0] * shards
+
+    def _shard(self, key):
+        return zlib.crc32(key.encode()) % len(self._shards)
+
+    def _write(self, index, data, key, value, expires, now):
+        data[key] = (value, expires)
+        self._writes[index] += 1
+        if self._writes[index] % self.PURGE_EVERY == 0:
+            for stale in [k for k, (_, exp) in data.items() if exp <= now]:
+                del data[stale]
+
+    def get(self, key):
+        lock, data = self._shards[self._shard(key)]
+        with lock:
+            entry = data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def incr(self, key, ttl, delta=1):
+        index = self._shard(key)
+        lock, data = self._shards[index]
+        with lock:
+            now = time.monotonic()
+            entry = data.get(key)
+            if entry is None or entry[1] <= now:
+                entry = (0, now + ttl)
+            value = entry[0] + delta
+            self._write(index, data, key, value, entry[1], now)
+            return value
+
+    def consume_token(self, key, capacity, refill_rate, now, ttl):
+        index = self._shard(key)
+        lock, data = self._shards[index]
+        with lock:
+            current = time.monotonic()
+            entry = data.get(key)
+            state = entry[0] if entry is not None and entry[1] > current else None
+            allowed, tokens = _refill_and_take(state, capacity, refill_rate, now)
+            self._write(index, data, key, (tokens, now), current + ttl, current)
+            return allowed, tokens
+
+    # Pure in-memory work: the async API runs inline without a thread hop
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aincr(self, key, ttl, delta=1):
+        return self.incr(key, ttl, delta)
+
+    async def aconsume_token(self, key, capacity, refill_rate, now, ttl):
+        return self.consume_token(key, capacity, refill_rate, now, ttl)
+
+
+class CacheStorage:
+    """
+    Storage on a Django cache alias. Counters use cache.add + cache.incr,
+    which are atomic on Redis and Memcached (and per process on LocMemCache).
+    Token buckets run as a Lua script on Redis and fall back to a sharded
+    in-process lock around get/set on other backends.
+    """
+
+    TOKEN_BUCKET_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, alias='default', shards=64):
+        self.cache = caches[alias]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._script = None
+
+    def _redis_client(self, key):
+        backend = getattr(self.cache, '_cache', None)
+        get_client = getattr(backend, 'get_client', None)
+        if get_client is None or not hasattr(self.cache, 'make_and_validate_key'):
+            return None
+        return get_client(key, write=True)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def incr(self, key, ttl, delta=1):
+        # add() only succeeds for the first caller of the window
+        if self.cache.add(key, delta, ttl):
+            return delta
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            # Expired between add() and incr(); start a fresh counter
+            self.cache.add(key, 0, ttl)
+            return self.cache.incr(key, delta)
+
+    def consume_token(self, key, capacity, refill_rate, now, ttl):
+        client = self._redis_client(key)
+        if client is not None:
+            if self._script is None:
+                self._script = client.register_script(self.TOKEN_BUCKET_SCRIPT)
+            allowed, tokens = self._script(
+                keys=[self.cache.make_and_validate_key(key)],
+                args=[capacity, refill_rate, now, ttl],
+                client=client,
+            )
+            return bool(int(allowed)), float(tokens)
+
+        with self._locks[zlib.crc32(key.encode()) % len(self._locks)]:
+            allowed, tokens = _refill_and_take(self.cache.get(key), capacity, refill_rate, now)
+            self.cache.set(key, (tokens, now), ttl)
+            return allowed, tokens
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aincr(self, key, ttl, delta=1):
+        if await self.cache.aadd(key, delta, ttl):
+            return delta
+        try:
+            return await self.cache.aincr(key, delta)
+        except ValueError:
+            await self.cache.aadd(key, 0, ttl)
+            return await self.cache.aincr(key, delta)
+
+    async def aconsume_token(self, key, capacity, refill_rate, now, ttl):
+        # Needs a Lua script or a thread lock, neither of which is awaitable
+        return await sync_to_async(self.consume_token)(key, capacity, refill_rate, now, ttl)
+
+
+def _refill_and_take(state, capacity, refill_rate, now):
+    if state is None:
+        tokens = float(capacity)
+    else:
+        tokens, last = state
+        tokens = min(float(capacity), tokens + max(0.0, now - last) * refill_rate)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+# -----------------------------
+# Algorithms
+# -----------------------------
+class SlidingWindowCounter:
+    """
+    Approximates a sliding window by weighting the previous fixed window's
+    count by how much of it still overlaps the sliding window. Avoids the 2x
+    burst a plain fixed window allows at window edges while needing only
+    atomic increments.
+    """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+
+    def _keys(self, key, now):
+        window = int(now // self.period)
+        return f"{key}:{window}", f"{key}:{window - 1}"
+
+    def _evaluate(self, count, previous, now):
+        elapsed = now % self.period
+        weight = (self.period - elapsed) / self.period
+        estimated = previous * weight + count
+        reset = math.ceil(self.period - elapsed)
+
+        if estimated > self.limit:
+            if previous:
+                # Time until enough of the previous window slides out
+                overflow = estimated - self.limit
+                retry_after = min(reset, math.ceil(overflow / previous * self.period))
+            else:
+                retry_after = reset
+            return RateLimitResult(False, self.limit, 0, reset, max(1, retry_after))
+
+        remaining = max(0, int(self.limit - estimated))
+        return RateLimitResult(True, self.limit, remaining, reset, 0)
+
+    def hit(self, storage, key, now):
+        current_key, previous_key = self._keys(key, now)
+        count = storage.incr(current_key, self.period * 2)
+        previous = storage.get(previous_key) or 0
+        result = self._evaluate(count, previous, now)
+        if not result.allowed:
+            # Denied requests do not consume quota
+            storage.incr(current_key, self.period * 2, -1)
+        return result
+
+    async def ahit(self, storage, key, now):
+        current_key, previous_key = self._keys(key, now)
+        count = await storage.aincr(current_key, self.period * 2)
+        previous = await storage.aget(previous_key) or 0
+        result = self._evaluate(count, previous, now)
+        if not result.allowed:
+            await storage.aincr(current_key, self.period * 2, -1)
+        return result
+
+
+class TokenBucket:
+    """
+    Bucket of `limit` tokens refilled continuously at limit/period per second
+    """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.refill_rate = limit / period
+
+    def _result(self, allowed, tokens):
+        reset = math.ceil((self.limit - tokens) / self.refill_rate)
+        if allowed:
+            return RateLimitResult(True, self.limit, int(tokens), reset, 0)
+        retry_after = max(1, math.ceil((1 - tokens) / self.refill_rate))
+        return RateLimitResult(False, self.limit, 0, reset, retry_after)
+
+    def hit(self, storage, key, now):
+        return self._result(*storage.consume_token(key, self.limit, self.refill_rate, now, self.period * 2))
+
+    async def ahit(self, storage, key, now):
+        return self._result(*await storage.aconsume_token(key, self.limit, self.refill_rate, now, self.period * 2))
+
+
+ALGORITHMS = {
+    'sliding_window': SlidingWindowCounter,
+    'token_bucket': TokenBucket,
+}
+
+
+# -----------------------------
+# Rules and limiter
+# -----------------------------
+class RateLimitRule:
+    def __init__(self, name, rate, paths=None, methods=None, algorithm='sliding_window', key='ip'):
+        if key not in ('ip', 'user'):
+            raise ValueError(f"Invalid rate limit key {key!r}: expected 'ip' or 'user'")
+        self.name = name
+        self.limit, self.period = parse_rate(rate)
+        self.paths = tuple(paths or ())
+        self.methods = frozenset(method.upper() for method in methods) if methods else None
+        self.key = key
+        self.algorithm = ALGORITHMS[algorithm](self.limit, self.period)
+
+    def matches(self, request):
+        if self.methods is not None and request.method not in self.methods:
+            return False
+        return not self.paths or request.path.startswith(self.paths)
+
+    def cache_key(self, request, user=None):
+        """
+        Per-user rules key on the user id and fall back to the client IP for
+        anonymous requests
+        """
+        if self.key == 'user' and user is not None and user.is_authenticated:
+            return f"ratelimit:{self.name}:user:{user.pk}"
+        return f"ratelimit:{self.name}:ip:{get_client_ip(request)}"
+
+
+class RateLimiter:
+    def __init__(self, rules, storage, clock=time.time):
+        self.rules = rules
+        self.storage = storage
+        self.clock = clock
+
+    @classmethod
+    def from_settings(cls):
+        backend = getattr(settings, 'RATE_LIMIT_BACKEND', 'cache')
+        if backend == 'local':
+            storage = LocalStorage()
+        elif backend == 'cache':
+            storage = CacheStorage(getattr(settings, 'RATE_LIMIT_CACHE_ALIAS', 'default'))
+        else:
+            raise ValueError(f"Invalid RATE_LIMIT_BACKEND {backend!r}: expected 'cache' or 'local'")
+        rules = [RateLimitRule(**rule) for rule in getattr(settings, 'RATE_LIMIT_RULES', DEFAULT_RATE_LIMIT_RULES)]
+        return cls(rules, storage)
+
+    def match(self, request):
+        """
+        Return the first rule that applies to the request, like URL routing
+        """
+        for rule in self.rules:
+            if rule.matches(request):
+                return rule
+        return None
+
+    def hit(self, request):
+        """
+        Count the request against its rule. Returns (rule, result), or
+        (None, None) when no rule applies.
+        """
+        rule = self.match(request)
+        if rule is None:
+            return None, None
+        user = getattr(request, 'user', None) if rule.key == 'user' else None
+        key = rule.cache_key(request, user)
+        return rule, rule.algorithm.hit(self.storage, key, self.clock())
+
+    async def ahit(self, request):
+        """
+        Async variant of hit() that never blocks the event loop on cache I/O
+        """
+        rule = self.match(request)
+        if rule is None:
+            return None, None
+        user = None
+        if rule.key == 'user':
+            user = await request.auser() if hasattr(request, 'auser') else getattr(request, 'user', None)
+        key = rule.cache_key(request, user)
+        return rule, await rule.algorithm.ahit(self.storage, key, self.clock())
+
+
+def rate_limit_headers(result):
+    headers = {
+        'RateLimit-Limit': str(result.limit),
+        'RateLimit-Remaining': str(result.remaining),
+        'RateLimit-Reset': str(result.reset),
+    }
+    if not result.allowed:
+        headers['Retry-After'] = str(result.retry_after)
+    return headers
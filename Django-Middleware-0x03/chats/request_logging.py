@@ -0,0 +1,212 @@
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+DEFAULT_REQUEST_LOG = {
+    # None: requests.log under BASE_DIR, never relative to the working directory
+    'path': None,
+    'max_bytes': 10 * 1024 * 1024,
+    'backup_count': 5,
+    'queue_size': 10000,
+    'batch_size': 100,
+    'sample_rate': 1.0,
+}
+
+
+# -----------------------------
+# DB query counting
+# -----------------------------
+# A mutable counter is stored in a context variable so queries run from
+# sync_to_async threads (which copy the context) count towards the request.
+query_counter = contextvars.ContextVar('request_query_counter', default=None)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+
+def count_queries(execute, sql, params, many, context):
+    counter = query_counter.get()
+    if counter is not None:
+        counter.count += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+connection_created.connect(install_query_counter, dispatch_uid='chats_request_query_counter')
+
+
+def install_on_open_connections():
+    """
+    Cover connections opened before this module was imported
+    """
+    for connection in connections.all(initialized_only=True):
+        install_query_counter(None, connection)
+
+
+# -----------------------------
+# Queue pipeline
+# -----------------------------
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue without blocking. When the queue is full
+    the record is dropped and counted instead of stalling the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not in the request path
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat()}
+        entry.update(getattr(record, 'request_data', None) or {'message': record.getMessage()})
+        return json.dumps(entry, separators=(',', ':'))
+
+
+class BatchingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Buffers formatted lines and writes them in one call per batch, rotating
+    by size before a batch would push the file past max_bytes.
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, batch_size=100):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+            if len(self.buffer) >= self.batch_size:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if not self.buffer:
+                return
+            data = ''.join(self.buffer)
+            self.buffer = []
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self.stream.tell() + len(data) > self.maxBytes and self.stream.tell() > 0:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(data)
+            self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    Flushes handlers whenever the queue drains, so lines are written in
+    batches under load and promptly when idle.
+    """
+
+    def __init__(self, log_queue, *handlers, queue_handler=None):
+        super().__init__(log_queue, *handlers)
+        self.queue_handler = queue_handler
+        self.reported_drops = 0
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            self.report_drops()
+            for handler in self.handlers:
+                handler.flush()
+
+    def report_drops(self):
+        if self.queue_handler is None:
+            return
+        dropped = self.queue_handler.dropped
+        if dropped != self.reported_drops:
+            record = logging.makeLogRecord({
+                'request_data': {'event': 'dropped', 'count': dropped - self.reported_drops},
+            })
+            self.reported_drops = dropped
+            for handler in self.handlers:
+                handler.handle(record)
+
+
+_pipeline_lock = threading.Lock()
+_pipeline = None
+
+
+def get_request_log_config():
+    config = dict(DEFAULT_REQUEST_LOG)
+    config.update(getattr(settings, 'REQUEST_LOG', {}))
+    if config['path'] is None:
+        config['path'] = os.path.join(settings.BASE_DIR, 'requests.log')
+    return config
+
+
+def get_request_logger():
+    """
+    Return the 'request_logger' logger, starting its queue listener on first
+    use. Safe to call from every middleware instance.
+    """
+    global _pipeline
+    logger = logging.getLogger('request_logger')
+    with _pipeline_lock:
+        if _pipeline is None:
+            existing = [h for h in logger.handlers if getattr(h, 'is_request_log_queue', False)]
+            if existing:
+                # Already started under another import path of this module
+                _pipeline = (existing[0], None)
+                return logger
+            config = get_request_log_config()
+            log_queue = queue.Queue(maxsize=config['queue_size'])
+            queue_handler = DroppingQueueHandler(log_queue)
+            queue_handler.is_request_log_queue = True
+            file_handler = BatchingRotatingFileHandler(
+                os.fspath(config['path']),
+                max_bytes=config['max_bytes'],
+                backup_count=config['backup_count'],
+                batch_size=config['batch_size'],
+            )
+            file_handler.setFormatter(JsonLineFormatter())
+            listener = BatchingQueueListener(log_queue, file_handler, queue_handler=queue_handler)
+            listener.start()
+            atexit.register(listener.stop)
+
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(queue_handler)
+            _pipeline = (queue_handler, listener)
+    return logger
@@ -0,0 +1,86 @@
+import re
+from functools import lru_cache
+
+from django.core.cache import cache
+
+
+ROLE_CACHE_TIMEOUT = 300
+
+WRITE_METHODS = frozenset(['POST', 'PUT', 'DELETE'])
+
+
+def _literal_pattern(fragments, flags=0):
+    # Longest first so a shorter fragment never shadows a longer one
+    ordered = sorted(set(fragments), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(fragment) for fragment in ordered), flags)
+
+
+class RouteRules:
+    """
+    Path -> required role dispatcher. Each tier of substring rules is
+    compiled into a single regex and tiers are tried in priority order, so
+    resolving a path is a handful of linear regex scans regardless of how
+    many fragments each tier holds. Results are memoised per (method, path).
+    """
+
+    def __init__(self, admin_paths, moderator_paths, admin_actions, cache_size=4096):
+        self.tiers = [
+            (_literal_pattern(admin_paths), 'admin', None),
+            (_literal_pattern(moderator_paths), 'moderator', None),
+            (_literal_pattern(['/admin-action']), 'admin', None),
+            (_literal_pattern(['/moderator-action']), 'moderator', None),
+            # Action words match case-insensitively on write requests only
+            (_literal_pattern(admin_actions, re.IGNORECASE), 'admin', WRITE_METHODS),
+        ]
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, method, path):
+        for pattern, role, methods in self.tiers:
+            if methods is not None and method not in methods:
+                continue
+            if pattern.search(path):
+                return role
+        return None
+
+
+# Admin-only actions and paths
+ADMIN_ACTIONS = ['delete', 'ban', 'moderate', 'clear', 'remove']
+ADMIN_PATHS = ['/admin/', '/api/admin', '/delete/']
+
+# Moderator actions and paths
+MODERATOR_ACTIONS = ['edit', 'warn', 'hide', 'lock']
+MODERATOR_PATHS = ['/moderate/', '/api/moderate']
+
+DEFAULT_ROUTE_RULES = RouteRules(ADMIN_PATHS, MODERATOR_PATHS, ADMIN_ACTIONS)
+
+
+# -----------------------------
+# Cached group membership
+# -----------------------------
+def role_cache_key(user_pk):
+    return f"chats:user_groups:{user_pk}"
+
+
+def get_user_groups(user):
+    """
+    Return the set of group names for user, cached until membership changes
+    """
+    key = role_cache_key(user.pk)
+    groups = cache.get(key)
+    if groups is None:
+        groups = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(key, groups, ROLE_CACHE_TIMEOUT)
+    return groups
+
+
+async def aget_user_groups(user):
+    key = role_cache_key(user.pk)
+    groups = await cache.aget(key)
+    if groups is None:
+        groups = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+        await cache.aset(key, groups, ROLE_CACHE_TIMEOUT)
+    return groups
+
+
+def invalidate_user_groups(user_pks):
+    cache.delete_many([role_cache_key(pk) for pk in user_pks])
@@ -0,0 +1,42 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import User
+from .roles import invalidate_user_groups
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_roles_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drop cached group names when users are added to or removed from groups,
+    from either side of the relation (user.groups or group.user_set)
+    """
+    if action == 'pre_clear' and reverse:
+        # pk_set is not provided for clear(); capture members before they go
+        instance._cleared_user_pks = list(instance.user_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_user_groups([instance.pk])
+    elif action == 'post_clear':
+        invalidate_user_groups(getattr(instance, '_cleared_user_pks', []))
+    else:
+        invalidate_user_groups(pk_set or [])
+
+
+@receiver(post_save, sender=Group)
+def invalidate_roles_on_group_rename(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user_groups(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def capture_group_members(sender, instance, **kwargs):
+    instance._deleted_user_pks = list(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def invalidate_roles_on_group_delete(sender, instance, **kwargs):
+    invalidate_user_groups(getattr(instance, '_deleted_user_pks', []))
@@ -1,3 +1,415 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, modify_settings, override_settings
+from rest_framework.parsers import JSONParser
+
+from . import preprocessing
+from .middleware import (
+    OffensiveLanguageMiddleware,
+    RateLimitMiddleware,
+    RequestLoggingMiddleware,
+    RestrictAccessByTimeMiddleware,
+    RolepermissionMiddleware,
+)
+from .preprocessing import get_json_body, get_route
+from .ratelimit import CacheStorage, LocalStorage, RateLimiter, RateLimitRule, parse_rate
+from .request_logging import (
+    BatchingRotatingFileHandler,
+    DroppingQueueHandler,
+    JsonLineFormatter,
+    get_request_log_config,
+)
+from .roles import get_user_groups
+from .wordfilter import ReloadingWordMatcher, WordMatcher
+
+# Client-based tests start the global request log pipeline; keep its file
+# out of the project
+_log_settings = None
+
+
+def setUpModule():
+    global _log_settings
+    directory = tempfile.mkdtemp()
+    _log_settings = override_settings(REQUEST_LOG={'path': os.path.join(directory, 'requests.log')})
+    _log_settings.enable()
+    _log_settings.directory = directory
+
+
+def tearDownModule():
+    _log_settings.disable()
+    shutil.rmtree(_log_settings.directory, ignore_errors=True)
+
+
+class WordMatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.matcher = WordMatcher(['hate', 'Idiot', 'shut up'])
+
+    def test_matches_whole_words_case_insensitively(self):
+        """Terms match on token boundaries regardless of case"""
+        self.assertEqual(self.matcher.search("I HATE mondays"), 'hate')
+        self.assertEqual(self.matcher.search("what an idiot."), 'idiot')
+
+    def test_ignores_substrings_of_longer_words(self):
+        """Words containing a term are not flagged"""
+        self.assertIsNone(self.matcher.search("whatever, chatelaine"))
+
+    def test_matches_multi_word_phrases(self):
+        """Phrases match across whitespace and punctuation"""
+        self.assertEqual(self.matcher.search("please Shut,  up now"), 'shut up')
+        self.assertIsNone(self.matcher.search("shut the door"))
+
+    def test_contains_walks_nested_json(self):
+        """Nested dicts and lists are searched"""
+        data = {'a': [1, {'b': ['fine', 'you idiot']}], 'c': None}
+        self.assertTrue(self.matcher.contains(data))
+        self.assertFalse(self.matcher.contains({'a': ['all good', 3]}))
+
+
+class ReloadingWordMatcherTests(SimpleTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(handle, 'w') as f:
+            f.write("# comment\nfirstword\n\n")
+        self.addCleanup(os.remove, self.path)
+
+    def test_loads_words_from_file(self):
+        """Terms come from the file instead of the defaults"""
+        matcher = ReloadingWordMatcher(self.path, default_words=['hate'])
+        self.assertTrue(matcher.search("firstword here"))
+        self.assertIsNone(matcher.search("hate"))
+
+    def test_hot_reloads_when_file_changes(self):
+        """A changed file is picked up without recreating the matcher"""
+        matcher = ReloadingWordMatcher(self.path, check_interval=0)
+        with open(self.path, 'w') as f:
+            f.write("secondword\n")
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertTrue(matcher.search("secondword"))
+        self.assertIsNone(matcher.search("firstword"))
+
+
+class OffensiveLanguageMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = OffensiveLanguageMiddleware(lambda request: HttpResponse('ok'))
+
+    def test_blocks_offensive_json_body(self):
+        request = self.factory.post(
+            '/api/messages/',
+            data=json.dumps({'message_body': 'You are an IDIOT'}),
+            content_type='application/json',
+        )
+        self.assertEqual(self.middleware(request).status_code, 400)
+
+    def test_blocks_offensive_form_body(self):
+        request = self.factory.post('/api/messages/', data={'message_body': 'spam spam'})
+        self.assertEqual(self.middleware(request).status_code, 400)
+
+    def test_allows_clean_body(self):
+        request = self.factory.post(
+            '/api/messages/',
+            data=json.dumps({'message_body': 'Hello there, whatever'}),
+            content_type='application/json',
+        )
+        self.assertEqual(self.middleware(request).status_code, 200)
+
+    @override_settings(OFFENSIVE_WORDS=['rude'])
+    def test_word_list_is_configurable(self):
+        middleware = OffensiveLanguageMiddleware(lambda request: HttpResponse('ok'))
+        request = self.factory.post('/api/messages/', data={'message_body': 'so rude'})
+        self.assertEqual(middleware(request).status_code, 400)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.now = 1000.0 * 60
+
+    def make_limiter(self, rate, algorithm='sliding_window', storage=None, key='ip'):
+        rule = RateLimitRule('test', rate, paths=['/api/messages'], methods=['POST'], algorithm=algorithm, key=key)
+        return RateLimiter([rule], storage or LocalStorage(), clock=lambda: self.now)
+
+    def hammer(self, limiter, requests=200, threads=8):
+        """Fire requests from several threads and return how many were allowed"""
+        request = self.factory.post('/api/messages/')
+        allowed = []
+        barrier = threading.Barrier(threads)
+
+        def worker():
+            barrier.wait()
+            for _ in range(requests // threads):
+                allowed.append(limiter.hit(request)[1].allowed)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return sum(allowed)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('5/m'), (5, 60))
+        self.assertEqual(parse_rate('10/30s'), (10, 30))
+        with self.assertRaises(ValueError):
+            parse_rate('5/week')
+
+    def test_concurrent_hits_lose_no_updates(self):
+        """Every concurrent hit is counted exactly once, on both storages"""
+        for storage in (LocalStorage(), CacheStorage()):
+            limiter = self.make_limiter('1000/m', storage=storage)
+            self.assertEqual(self.hammer(limiter), 200)
+            window = int(self.now // 60)
+            self.assertEqual(storage.get(f"ratelimit:test:ip:127.0.0.1:{window}"), 200)
+
+    def test_concurrent_hits_never_exceed_limit(self):
+        for algorithm in ('sliding_window', 'token_bucket'):
+            for storage in (LocalStorage(), CacheStorage()):
+                cache.clear()
+                limiter = self.make_limiter('5/m', algorithm=algorithm, storage=storage)
+                self.assertEqual(self.hammer(limiter), 5, (algorithm, type(storage).__name__))
+
+    def test_sliding_window_prevents_edge_burst(self):
+        """A full window just before the boundary still counts just after it"""
+        limiter = self.make_limiter('5/m')
+        request = self.factory.post('/api/messages/')
+        self.now += 59
+        self.assertTrue(all(limiter.hit(request)[1].allowed for _ in range(5)))
+        self.now += 2
+        result = limiter.hit(request)[1]
+        self.assertFalse(result.allowed)
+        self.assertGreater(result.retry_after, 0)
+
+    def test_token_bucket_refills(self):
+        limiter = self.make_limiter('2/m', algorithm='token_bucket')
+        request = self.factory.post('/api/messages/')
+        self.assertTrue(limiter.hit(request)[1].allowed)
+        self.assertTrue(limiter.hit(request)[1].allowed)
+        self.assertFalse(limiter.hit(request)[1].allowed)
+        self.now += 30
+        self.assertTrue(limiter.hit(request)[1].allowed)
+
+    def test_unmatched_requests_are_not_limited(self):
+        limiter = self.make_limiter('1/m')
+        self.assertEqual(limiter.hit(self.factory.get('/api/messages/')), (None, None))
+
+
+@override_settings(RATE_LIMIT_BACKEND='local', RATE_LIMIT_RULES=[
+    {'name': 'posts', 'paths': ['/api/messages'], 'methods': ['POST'], 'rate': '2/m'},
+])
+class RateLimitMiddlewareTests(SimpleTestCase):
+    def test_sets_headers_and_blocks_over_limit(self):
+        middleware = RateLimitMiddleware(lambda request: HttpResponse('ok'))
+        factory = RequestFactory()
+        first = middleware(factory.post('/api/messages/'))
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['RateLimit-Limit'], '2')
+        self.assertEqual(first['RateLimit-Remaining'], '1')
+        middleware(factory.post('/api/messages/'))
+        blocked = middleware(factory.post('/api/messages/'))
+        self.assertEqual(blocked.status_code, 429)
+        self.assertEqual(blocked['RateLimit-Remaining'], '0')
+        self.assertIn('Retry-After', blocked)
+
+
+class AsyncMiddlewareTests(SimpleTestCase):
+    async def get_response(self, request):
+        return HttpResponse('ok')
+
+    def test_all_middleware_switch_to_async_mode(self):
+        """An async get_response makes each middleware a coroutine function"""
+        for middleware_class in (
+            RequestLoggingMiddleware, RestrictAccessByTimeMiddleware, OffensiveLanguageMiddleware,
+            RateLimitMiddleware, RolepermissionMiddleware,
+        ):
+            self.assertFalse(middleware_class.async_capable)
+            with self.settings(CHATS_ASYNC_MIDDLEWARE=True):
+                self.assertTrue(middleware_class.async_capable)
+            self.assertTrue(middleware_class.sync_capable)
+            self.assertTrue(middleware_class(self.get_response).async_mode)
+            self.assertFalse(middleware_class(lambda request: HttpResponse('ok')).async_mode)
+
+    async def test_async_offensive_language_check(self):
+        middleware = OffensiveLanguageMiddleware(self.get_response)
+        request = RequestFactory().post(
+            '/api/messages/', data=json.dumps({'message_body': 'idiot'}), content_type='application/json',
+        )
+        self.assertEqual((await middleware(request)).status_code, 400)
+
+    @override_settings(RATE_LIMIT_BACKEND='cache', RATE_LIMIT_RULES=[
+        {'name': 'async-posts', 'paths': ['/api/messages'], 'methods': ['POST'], 'rate': '1/m'},
+    ])
+    async def test_async_rate_limit(self):
+        await cache.aclear()
+        middleware = RateLimitMiddleware(self.get_response)
+        factory = RequestFactory()
+        self.assertEqual((await middleware(factory.post('/api/messages/'))).status_code, 200)
+        self.assertEqual((await middleware(factory.post('/api/messages/'))).status_code, 429)
+
+    async def test_async_role_check_blocks_anonymous(self):
+        middleware = RolepermissionMiddleware(self.get_response)
+        request = RequestFactory().get('/api/admin-action/')
+        request.user = AnonymousUser()
+        self.assertEqual((await middleware(request)).status_code, 403)
+
+
+class RequestLoggingTests(TestCase):
+    def test_logs_timing_and_query_count(self):
+        def view(request):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.execute("SELECT 2")
+            return HttpResponse('ok')
+
+        middleware = RequestLoggingMiddleware(view)
+        request = RequestFactory().get('/api/messages/')
+        request.user = AnonymousUser()
+        with self.assertLogs('request_logger', level='INFO') as logs:
+            middleware(request)
+        data = logs.records[0].request_data
+        self.assertEqual(data['user'], 'Anonymous')
+        self.assertEqual(data['status'], 200)
+        self.assertEqual(data['db_queries'], 2)
+        self.assertGreaterEqual(data['duration_ms'], 0)
+
+    def test_default_path_is_absolute(self):
+        with self.settings(REQUEST_LOG={}):
+            path = get_request_log_config()['path']
+        self.assertTrue(os.path.isabs(path))
+        self.assertEqual(os.path.basename(path), 'requests.log')
+
+    def test_queue_handler_drops_when_full(self):
+        handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+        record = logging.makeLogRecord({'msg': 'x'})
+        handler.handle(record)
+        handler.handle(record)
+        self.assertEqual(handler.dropped, 1)
+
+    def test_file_handler_batches_and_rotates(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'requests.log')
+        handler = BatchingRotatingFileHandler(path, max_bytes=200, backup_count=1, batch_size=3)
+        handler.setFormatter(JsonLineFormatter())
+        self.addCleanup(handler.close)
+        for i in range(2):
+            handler.handle(logging.makeLogRecord({'request_data': {'path': f'/api/{i}/'}}))
+        self.assertFalse(os.path.exists(path))
+        handler.handle(logging.makeLogRecord({'request_data': {'path': '/api/2/'}}))
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['path'] for line in lines], ['/api/0/', '/api/1/', '/api/2/'])
+        for i in range(3):
+            handler.handle(logging.makeLogRecord({'request_data': {'path': f'/api/{i}/'}}))
+        self.assertTrue(os.path.exists(path + '.1'))
+
+
+class RolepermissionMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.middleware = RolepermissionMiddleware(lambda request: HttpResponse('ok'))
+        self.factory = RequestFactory()
+        self.user = get_user_model().objects.create_user(username='mod', email='mod@example.com', password='pass12345')
+        self.moderators = Group.objects.create(name='moderators')
+
+    def test_required_role_rules(self):
+        cases = [
+            ('GET', '/admin/', 'admin'),
+            ('GET', '/api/conversations/1/delete/', 'admin'),
+            ('GET', '/api/moderate/queue', 'moderator'),
+            ('GET', '/api/admin-action/', 'admin'),
+            ('GET', '/api/moderator-action/', 'moderator'),
+            ('POST', '/api/messages/BAN-user', 'admin'),
+            ('GET', '/api/messages/ban-user', None),
+            ('POST', '/api/messages/', None),
+        ]
+        for method, path, role in cases:
+            request = self.factory.generic(method, path)
+            self.assertEqual(self.middleware.get_required_role(request), role, (method, path))
+
+    def request_as(self, user, path='/api/moderator-action/'):
+        request = self.factory.get(path)
+        request.user = user
+        return self.middleware(request)
+
+    def test_moderator_check_is_cached(self):
+        self.user.groups.add(self.moderators)
+        self.assertEqual(self.request_as(self.user).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.request_as(self.user).status_code, 200)
+
+    def test_membership_changes_invalidate_cache(self):
+        self.assertEqual(self.request_as(self.user).status_code, 403)
+        self.user.groups.add(self.moderators)
+        self.assertEqual(self.request_as(self.user).status_code, 200)
+        self.moderators.user_set.remove(self.user)
+        self.assertEqual(self.request_as(self.user).status_code, 403)
+        self.moderators.user_set.add(self.user)
+        self.assertIn('moderators', get_user_groups(self.user))
+        self.moderators.user_set.clear()
+        self.assertEqual(self.request_as(self.user).status_code, 403)
+
+    def test_group_rename_invalidates_cache(self):
+        self.user.groups.add(self.moderators)
+        self.assertEqual(self.request_as(self.user).status_code, 200)
+        self.moderators.name = 'retired'
+        self.moderators.save()
+        self.assertEqual(self.request_as(self.user).status_code, 403)
+
+
+@modify_settings(MIDDLEWARE={'remove': ['chats.middleware.RestrictAccessByTimeMiddleware']})
+class RequestPreprocessingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def test_route_is_classified_once(self):
+        request = self.factory.post('/api/messages/')
+        route = get_route(request)
+        self.assertTrue(route.is_chat_api)
+        self.assertIsNone(route.required_role)
+        self.assertIs(get_route(request), route)
+
+    def test_json_body_is_parsed_once(self):
+        request = self.factory.post('/api/messages/', data='{"a": [1]}', content_type='application/json')
+        with mock.patch.object(preprocessing, 'loads', wraps=preprocessing.loads) as loads:
+            self.assertEqual(get_json_body(request), {'a': [1]})
+            self.assertEqual(get_json_body(request), {'a': [1]})
+        self.assertEqual(loads.call_count, 1)
+
+    @override_settings(CHATS_MAX_JSON_BODY=10)
+    def test_oversized_json_body_is_rejected(self):
+        response = self.client.post(
+            '/api/messages/', data=json.dumps({'message_body': 'x' * 20}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 413)
+
+    def test_body_parsed_once_through_middleware_and_drf(self):
+        """The whole stack, DRF parser included, decodes the body a single time"""
+        Conversation = apps.get_model('chats', 'Conversation')
+        user = get_user_model().objects.create_user(username='alice', email='a@example.com', password='pass12345')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(user)
+        self.client.force_login(user)
+        payload = {'conversation': str(conversation.pk), 'message_body': 'Hello there'}
+        # The middleware stack imports this app as the top-level 'chats' package
+        with mock.patch('chats.preprocessing.loads', side_effect=json.loads) as loads, \
+                mock.patch.object(JSONParser, 'parse') as drf_parse:
+            response = self.client.post('/api/messages/', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(loads.call_count, 1)
+        drf_parse.assert_not_called()
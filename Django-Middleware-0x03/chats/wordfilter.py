@@ -0,0 +1,140 @@
+import os
+import re
+import threading
+import time
+
+
+# Words and short phrases are matched on whole tokens, so "class" never
+# matches "ass" and "hateful" is not the same word as "hate".
+TOKEN_RE = re.compile(r"\w+(?:'\w+)*")
+
+DEFAULT_OFFENSIVE_WORDS = [
+    'badword', 'offensive', 'inappropriate', 'hate',
+    'violence', 'spam', 'stupid', 'idiot',
+]
+
+
+class WordMatcher:
+    """
+    Immutable matcher built once from a word list.
+
+    Terms are normalised to tuples of casefolded tokens and stored in a set,
+    so a scan is a single tokenising pass over the text plus one set lookup
+    per token (and per n-gram for multi-word phrases). Cost is O(text length)
+    regardless of how many terms are loaded.
+    """
+
+    def __init__(self, words):
+        terms = set()
+        for word in words:
+            tokens = tuple(token.casefold() for token in TOKEN_RE.findall(word))
+            if tokens:
+                terms.add(tokens)
+        self.terms = frozenset(terms)
+        self.max_ngram = max((len(term) for term in self.terms), default=0)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def search(self, text):
+        """
+        Return the first offensive term found in text, or None
+        """
+        if not self.terms or not text:
+            return None
+        tokens = [token.casefold() for token in TOKEN_RE.findall(text)]
+        terms = self.terms
+        if self.max_ngram == 1:
+            for token in tokens:
+                if (token,) in terms:
+                    return token
+            return None
+        for start in range(len(tokens)):
+            for size in range(1, self.max_ngram + 1):
+                candidate = tuple(tokens[start:start + size])
+                if len(candidate) < size:
+                    break
+                if candidate in terms:
+                    return ' '.join(candidate)
+        return None
+
+    def contains(self, data):
+        """
+        Recursively check strings inside dicts/lists for offensive terms
+        """
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                if self.search(item) is not None:
+                    return True
+            elif isinstance(item, dict):
+                stack.extend(item.values())
+            elif isinstance(item, (list, tuple)):
+                stack.extend(item)
+        return False
+
+
+def load_words(path):
+    """
+    Read one term per line, ignoring blank lines and # comments
+    """
+    with open(path, encoding='utf-8') as handle:
+        return [
+            line.strip() for line in handle
+            if line.strip() and not line.lstrip().startswith('#')
+        ]
+
+
+class ReloadingWordMatcher:
+    """
+    Wraps a WordMatcher loaded from a file and swaps in a fresh one when the
+    file's mtime changes. The mtime is checked at most once per
+    check_interval seconds, and the swap is a single reference assignment so
+    readers never see a half-built matcher.
+    """
+
+    def __init__(self, path=None, default_words=None, check_interval=5.0):
+        self.path = path
+        self.default_words = DEFAULT_OFFENSIVE_WORDS if default_words is None else default_words
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._matcher = WordMatcher(self.default_words)
+        self.reload()
+
+    @property
+    def matcher(self):
+        if self.path and time.monotonic() >= self._next_check:
+            self.reload()
+        return self._matcher
+
+    def reload(self, force=False):
+        """
+        Rebuild the matcher if the word file changed. Returns True on reload.
+        """
+        if not self.path:
+            return False
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                # Keep serving the last good list if the file disappears
+                return False
+            if not force and mtime == self._mtime:
+                return False
+            try:
+                words = load_words(self.path)
+            except (OSError, UnicodeDecodeError):
+                return False
+            self._matcher = WordMatcher(words)
+            self._mtime = mtime
+            return True
+
+    def search(self, text):
+        return self.matcher.search(text)
+
+    def contains(self, data):
+        return self.matcher.contains(data)
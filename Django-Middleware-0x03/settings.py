@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import os
 from datetime import timedelta # NEW: Required for SIMPLE_JWT
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'chats.middleware.RequestLoggingMiddleware',
+    'chats.middleware.RequestPreprocessingMiddleware',
     'chats.middleware.RestrictAccessByTimeMiddleware',
     'chats.middleware.OffensiveLanguageMiddleware',
     'chats.middleware.RateLimitMiddleware',
@@ -73,6 +75,12 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
+    # Reuses JSON bodies already parsed by RequestPreprocessingMiddleware
+    'DEFAULT_PARSER_CLASSES': (
+        'chats.parsers.CachedJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 ROOT_URLCONF = 'urls'
@@ -168,4 +176,55 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
     }
-}
\ No newline at end of file
+}
+
+# Offensive language filter
+# OFFENSIVE_WORDS_FILE: optional path to a word list (one term per line).
+# The file is re-read automatically when it changes, checked at most every
+# OFFENSIVE_WORDS_RELOAD_INTERVAL seconds.
+OFFENSIVE_WORDS_FILE = os.environ.get('OFFENSIVE_WORDS_FILE')
+OFFENSIVE_WORDS_RELOAD_INTERVAL = 5.0
+
+# Rate limiting
+# RATE_LIMIT_BACKEND: 'cache' uses atomic increments on RATE_LIMIT_CACHE_ALIAS
+# (shared across workers when that cache is Redis/Memcached); 'local' keeps
+# counters in-process behind sharded locks.
+# Each rule: name, rate ('5/m', '100/h', '10/30s'), optional paths (prefixes)
+# and methods, algorithm ('sliding_window' or 'token_bucket') and key
+# ('ip' or 'user'). The first matching rule applies.
+RATE_LIMIT_BACKEND = 'cache'
+RATE_LIMIT_CACHE_ALIAS = 'default'
+RATE_LIMIT_RULES = [
+    {
+        'name': 'chat-posts',
+        'paths': ['/api/messages', '/api/conversations'],
+        'methods': ['POST'],
+        'rate': '5/m',
+        'algorithm': 'sliding_window',
+        'key': 'ip',
+    },
+]
+
+# Request logging
+# Requests are logged as JSON lines through a bounded queue drained by a
+# background thread; records are dropped (and counted) rather than blocking
+# when the queue is full. sample_rate < 1 logs only that fraction of
+# non-5xx requests.
+REQUEST_LOG = {
+    'path': BASE_DIR / 'requests.log',
+    'max_bytes': 10 * 1024 * 1024,
+    'backup_count': 5,
+    'queue_size': 10000,
+    'batch_size': 100,
+    'sample_rate': 1.0,
+}
+
+# Run the chats middleware natively async under ASGI. They sit below
+# Django's own middleware, which then hop to a thread twice each instead of
+# once for the whole sync chain, so this only pays off once the middleware
+# above them is async-native too. Compare with manage.py loadtest_asgi.
+CHATS_ASYNC_MIDDLEWARE = False
+
+# Largest JSON body (bytes) the chats middleware will parse; larger chat
+# API bodies are rejected with 413. Install orjson for faster parsing.
+CHATS_MAX_JSON_BODY = 1024 * 1024
@@ -0,0 +1,43 @@
+"""
+Work collected during a transaction and carried out once when it commits.
+
+A batch registers itself with transaction.on_commit() the first time it is
+needed in a transaction (or savepoint) and collects everything queued there
+until then. The registry only holds weak references: the on_commit hook is
+the batch's one strong reference, so a batch whose transaction rolls back is
+freed with its hook and the next call starts a new one. No commit or
+rollback hook is needed to reset the state.
+"""
+import threading
+import weakref
+
+from django.db import transaction
+
+_local = threading.local()
+
+
+class CommitBatch:
+    """Base class: subclasses collect work and carry it out in run()"""
+
+    def __init__(self, using):
+        self.using = using
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        self.run()
+
+    def run(self):
+        raise NotImplementedError
+
+    @classmethod
+    def pending(cls, using):
+        """The batch of this class for the current transaction or savepoint on using"""
+        savepoints = tuple(transaction.get_connection(using).savepoint_ids)
+        batches = _local.__dict__.setdefault('batches', weakref.WeakValueDictionary())
+        key = (cls, using, savepoints)
+        batch = batches.get(key)
+        if batch is None or batch.done:
+            batch = batches[key] = cls(using)
+            transaction.on_commit(batch, using=using)
+        return batch
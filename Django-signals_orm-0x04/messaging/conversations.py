@@ -0,0 +1,80 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Prefetch, Q, prefetch_related_objects
+
+from .models import Message
+from .summary import limited_union
+
+CONVERSATION_PAGE_SIZE = 20
+LATEST_REPLIES = 3
+
+
+class ConversationPage:
+    """One page of a user's conversations and the cursor of the next page"""
+
+    def __init__(self, conversations, next_cursor):
+        self.conversations = conversations
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.conversations)
+
+    def __len__(self):
+        return len(self.conversations)
+
+
+def encode_cursor(message):
+    value = f"{message.last_activity_at.isoformat()}|{message.pk}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(last_activity_at, id) from a cursor; ValueError if it is malformed"""
+    try:
+        last_activity, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(last_activity), int(pk)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def get_user_conversations(user, cursor=None, page_size=CONVERSATION_PAGE_SIZE, latest_replies=LATEST_REPLIES):
+    """
+    A page of the threads the user started or received, most recently
+    active first.
+
+    Threads are ordered by (last_activity_at, id), kept on each root, and
+    paged with a keyset cursor, so every page reads page_size + 1 rows from
+    the (user, parent_message, -last_activity_at, -id) indexes however many
+    threads the user has. Each conversation carries its latest_replies
+    newest replies, fetched for the whole page by one query using a window
+    function.
+    """
+    sides = [
+        Message.objects.filter(sender=user, parent_message__isnull=True),
+        Message.objects.filter(receiver=user, parent_message__isnull=True).exclude(sender=user),
+    ]
+    if cursor is not None:
+        last_activity, pk = decode_cursor(cursor)
+        # The redundant <= gives the database an index range to start from
+        after = Q(last_activity_at__lt=last_activity) | Q(last_activity_at=last_activity, pk__lt=pk)
+        sides = [side.filter(after, last_activity_at__lte=last_activity) for side in sides]
+    conversations = limited_union(
+        sides,
+        ['-last_activity_at', '-id'],
+        page_size + 1,
+        lambda side: side.select_related('sender', 'receiver'),
+    )
+    next_cursor = None
+    if len(conversations) > page_size:
+        conversations = conversations[:page_size]
+        next_cursor = encode_cursor(conversations[-1])
+    if latest_replies:
+        prefetch_related_objects(conversations, Prefetch(
+            'thread_messages',
+            queryset=Message.objects.filter(parent_message__isnull=False).select_related('sender').order_by(
+                '-timestamp', '-id'
+            )[:latest_replies],
+            to_attr='latest_replies',
+        ))
+    return ConversationPage(conversations, next_cursor)
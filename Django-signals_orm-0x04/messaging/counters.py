@@ -0,0 +1,85 @@
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Message, UnreadCounter
+
+RECONCILE_BATCH_SIZE = 1000
+
+
+def count_unread(user_id):
+    return Message.objects.filter(receiver_id=user_id, read=False).count()
+
+
+def _create_counter(user_id):
+    """Start a user's counter from a recount; None if someone else just did"""
+    try:
+        with transaction.atomic():
+            return UnreadCounter.objects.create(user_id=user_id, count=count_unread(user_id))
+    except IntegrityError:
+        return None
+
+
+def adjust_unread_counts(deltas):
+    """
+    Apply {user_id: delta} to the unread counters, after the messages
+    themselves have changed. A user without a counter gets one started from
+    a recount, which already includes the change.
+    """
+    for user_id, delta in deltas.items():
+        if user_id is None or not delta:
+            continue
+        if UnreadCounter.objects.filter(user_id=user_id).update(count=F('count') + delta):
+            continue
+        if _create_counter(user_id) is None:
+            UnreadCounter.objects.filter(user_id=user_id).update(count=F('count') + delta)
+
+
+def get_unread_count(user_id):
+    """O(1) read of a user's unread count"""
+    count = UnreadCounter.objects.filter(user_id=user_id).values_list('count', flat=True).first()
+    if count is not None:
+        return count
+    counter = _create_counter(user_id)
+    return counter.count if counter is not None else get_unread_count(user_id)
+
+
+def reconcile_unread_counts(user_ids=None, batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Recount unread messages and correct counters that drifted, for the given
+    users or everyone, in batches of users. Returns the number of counters
+    created or corrected.
+    """
+    users = User.objects.order_by('pk').values_list('pk', flat=True)
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    corrected = 0
+    last_pk = None
+    while True:
+        batch = users.filter(pk__gt=last_pk) if last_pk is not None else users
+        batch = list(batch[:batch_size])
+        if not batch:
+            return corrected
+        last_pk = batch[-1]
+        with transaction.atomic():
+            # Lock the counters so increments made meanwhile are not overwritten
+            counters = UnreadCounter.objects.select_for_update().in_bulk(batch)
+            actual = dict(
+                Message.objects.filter(receiver_id__in=batch, read=False)
+                .values('receiver_id').annotate(unread=Count('id')).values_list('receiver_id', 'unread')
+            )
+            now = timezone.now()
+            missing, drifted = [], []
+            for user_id in batch:
+                unread = actual.get(user_id, 0)
+                counter = counters.get(user_id)
+                if counter is None:
+                    missing.append(UnreadCounter(user_id=user_id, count=unread, reconciled_at=now))
+                    continue
+                if counter.count != unread:
+                    drifted.append(counter)
+                counter.count, counter.reconciled_at = unread, now
+            UnreadCounter.objects.bulk_create(missing, ignore_conflicts=True)
+            UnreadCounter.objects.bulk_update(counters.values(), ['count', 'reconciled_at'])
+        corrected += len(missing) + len(drifted)
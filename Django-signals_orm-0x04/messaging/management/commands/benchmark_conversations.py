@@ -0,0 +1,110 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, Max, Prefetch, Q, When
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from messaging.conversations import encode_cursor, get_user_conversations
+from messaging.models import Message, thread_path
+
+
+class Rollback(Exception):
+    pass
+
+
+def legacy_conversations(user, page_size):
+    """The first page of the old get_user_conversations: aggregates over every thread"""
+    return list(Message.objects.filter(
+        Q(sender=user) | Q(receiver=user),
+        parent_message__isnull=True
+    ).select_related('sender', 'receiver').prefetch_related(
+        Prefetch('replies', queryset=Message.objects.select_related('sender', 'receiver'))
+    ).annotate(
+        reply_count=Count('replies'),
+        last_activity=Max(
+            Case(
+                When(replies__isnull=False, then=models.F('replies__timestamp')),
+                default=models.F('timestamp'),
+                output_field=models.DateTimeField()
+            )
+        )
+    ).order_by('-last_activity')[:page_size])
+
+
+class Command(BaseCommand):
+    help = "Queries and latency of a user's conversation list: the old aggregate query against keyset pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=100000, help="Threads of the benchmarked user")
+        parser.add_argument('--replies', type=int, default=2, help="Replies per thread")
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--legacy-repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, user, others, options, rng):
+        now = timezone.now()
+        for offset in range(0, options['threads'], 5000):
+            roots = []
+            for i in range(offset, min(offset + 5000, options['threads'])):
+                other = rng.choice(others)
+                sender, receiver = (user, other) if rng.random() < 0.5 else (other, user)
+                timestamp = now - timezone.timedelta(seconds=rng.randrange(86400 * 365))
+                roots.append(Message(sender=sender, receiver=receiver, content=f'Thread {i}', timestamp=timestamp))
+            roots = Message.objects.bulk_create(roots)
+            replies = []
+            for root in roots:
+                latest = root.timestamp
+                for r in range(options['replies']):
+                    latest += timezone.timedelta(seconds=rng.randrange(1, 86400))
+                    replies.append(Message(
+                        sender=root.receiver, receiver=root.sender, content=f'Reply {r}', timestamp=latest,
+                        parent_message=root, thread_root_id=root.pk, depth=1,
+                    ))
+                root.thread_root_id, root.path = root.pk, thread_path('', root.pk)
+                root.thread_reply_count, root.last_activity_at = options['replies'], latest
+            Message.objects.bulk_update(roots, ['thread_root', 'path', 'thread_reply_count', 'last_activity_at'])
+            Message.objects.bulk_create(replies)
+
+    def time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def run(self, options):
+        rng = random.Random(1)
+        users = User.objects.bulk_create([User(username=f'conversation-bench-{i}') for i in range(50)])
+        self.seed(users[0], users[1:], options, rng)
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        user, page_size = users[0], options['page_size']
+        self.stdout.write(f"{options['threads']} threads, {options['replies']} replies each")
+        deep = Message.objects.filter(
+            Q(sender=user) | Q(receiver=user), parent_message__isnull=True
+        ).order_by('-last_activity_at', '-id')[options['threads'] // 2]
+        cases = [
+            ('legacy', lambda: legacy_conversations(user, page_size), options['legacy_repeat']),
+            ('first page', lambda: get_user_conversations(user, page_size=page_size), options['repeat']),
+            ('middle page', lambda: get_user_conversations(user, encode_cursor(deep), page_size), options['repeat']),
+        ]
+        for name, func, repeat in cases:
+            with CaptureQueriesContext(connection) as queries:
+                func()
+            self.stdout.write(f"  {name:<12} {len(queries):2d} queries  median {self.time(func, repeat):9.2f} ms")
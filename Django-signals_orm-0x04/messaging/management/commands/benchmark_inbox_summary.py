@@ -0,0 +1,90 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from messaging.counters import reconcile_unread_counts
+from messaging.models import Message
+from messaging.summary import inbox_summary
+
+
+class Rollback(Exception):
+    pass
+
+
+def legacy_inbox_summary(user):
+    """The four queries inbox_summary used to run, OR condition included"""
+    either = Q(sender=user) | Q(receiver=user)
+    return {
+        'unread_messages': list(Message.unread.unread_for_user(user).select_related('sender').only(
+            'id', 'content', 'timestamp', 'sender__username'
+        ).order_by('-timestamp')[:5]),
+        'recent_messages': list(Message.objects.filter(either).select_related('sender', 'receiver').only(
+            'id', 'content', 'timestamp', 'sender__username', 'receiver__username', 'read'
+        ).order_by('-timestamp')[:10]),
+        'unread_count': Message.objects.filter(receiver=user, read=False).count(),
+        'total_count': Message.objects.filter(either).count(),
+    }
+
+
+class Command(BaseCommand):
+    help = "Queries and latency of the inbox summary: the old four-query version against messaging.summary"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000, help='Messages in the table')
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        rng = random.Random(1)
+        users = User.objects.bulk_create([
+            User(username=f'summary-bench-{i}') for i in range(options['users'])
+        ])
+        now = timezone.now()
+        # Skewed traffic: the first user takes part in a large share of messages
+        batch = []
+        for i in range(options['messages']):
+            sender, receiver = rng.choice(users[:5] if rng.random() < 0.3 else users), rng.choice(users)
+            batch.append(Message(
+                sender=sender, receiver=receiver, content=f'Benchmark message {i}', read=rng.random() < 0.7,
+                timestamp=now - timezone.timedelta(seconds=rng.randrange(86400 * 365)),
+            ))
+            if len(batch) == 5000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+        reconcile_unread_counts([user.pk for user in users])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        for label, user in (('busy user', users[0]), ('typical user', users[-1])):
+            either = Q(sender=user) | Q(receiver=user)
+            self.stdout.write(f"{label}: {Message.objects.filter(either).count()} messages")
+            for name, func in (('legacy', legacy_inbox_summary), ('summary', inbox_summary)):
+                with CaptureQueriesContext(connection) as queries:
+                    result = func(user)
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    func(user)
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f"  {name:<8} {len(queries):2d} queries  median {statistics.median(timings):7.2f} ms  "
+                    f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:7.2f} ms  "
+                    f"(total {result['total_count']}, unread {result['unread_count']})"
+                )
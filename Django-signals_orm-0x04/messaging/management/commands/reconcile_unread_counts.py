@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from messaging.counters import RECONCILE_BATCH_SIZE, reconcile_unread_counts
+
+
+class Command(BaseCommand):
+    help = "Recount unread messages and fix per-user unread counters that drifted (run periodically, e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='Only this user id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        corrected = reconcile_unread_counts(options['user_ids'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Corrected {corrected} unread counters"))
@@ -1,14 +1,125 @@
-﻿from django.db import models
+﻿from collections import Counter
+from django.db import models, transaction
+from django.utils import timezone
+from .user_cache import invalidate_users
+
+class MessageQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """bulk_create, starting the thread activity of messages that have none at their timestamp"""
+        objs = list(objs)
+        for message in objs:
+            if message.last_activity_at is None:
+                message.last_activity_at = message.timestamp
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def send_many(self, messages, batch_size=None):
+        """
+        Create messages with bulk_create, fill in their thread position and
+        queue their notifications for one bulk INSERT after commit. Replies
+        must point at messages that are already saved.
+        """
+        from .models import PATH_MAX_LENGTH, record_replies, thread_path
+        from .counters import adjust_unread_counts
+        from .notifications import queue_notifications
+
+        with transaction.atomic(using=self.db):
+            created = self.bulk_create(messages, batch_size=batch_size)
+            # bulk_create skips save(), which maintains the thread fields
+            parents = self.model.objects.using(self.db).only('thread_root', 'depth', 'path').in_bulk(
+                {message.parent_message_id for message in created if message.parent_message_id}
+            )
+            for message in created:
+                parent = parents.get(message.parent_message_id)
+                if parent is None:
+                    message.thread_root_id, message.depth = message.pk, 0
+                    message.path = thread_path('', message.pk)
+                else:
+                    message.thread_root_id, message.depth = parent.thread_root_id, parent.depth + 1
+                    message.path = thread_path(parent.path, message.pk)
+                if len(message.path) > PATH_MAX_LENGTH:
+                    raise ValueError(f"Message {message.pk} would make its thread too deep")
+                message._loaded_content = message.content
+            self.model.objects.using(self.db).bulk_update(created, ['thread_root', 'depth', 'path'], batch_size=batch_size)
+            replies = {}
+            for message in created:
+                if message.parent_message_id is not None:
+                    count, latest = replies.get(message.thread_root_id, (0, message.timestamp))
+                    replies[message.thread_root_id] = (count + 1, max(latest, message.timestamp))
+            record_replies(replies, using=self.db)
+            queue_notifications(created, using=self.db)
+            adjust_unread_counts(Counter(message.unread_receiver_id for message in created))
+        invalidate_users(
+            *(user_id for message in created for user_id in (message.sender_id, message.receiver_id)), using=self.db
+        )
+        return created
+    
+    def edit(self, content, edited_by=None):
+        """
+        Set content on every message in the queryset with one UPDATE,
+        recording the old content of the messages that actually change with
+        one bulk INSERT. edited_by defaults to each message's sender, like
+        edits through save(). Returns the number of messages changed.
+        """
+        from .models import MessageHistory
+
+        with transaction.atomic(using=self.db):
+            changed = list(
+                self.exclude(content=content).select_for_update().values_list('id', 'content', 'sender_id', 'receiver_id')
+            )
+            if not changed:
+                return 0
+            now = timezone.now()
+            MessageHistory.objects.using(self.db).bulk_create([
+                MessageHistory(
+                    message_id=message_id,
+                    old_content=old_content,
+                    edited_by_id=edited_by.pk if edited_by is not None else sender_id,
+                    edited_at=now,
+                )
+                for message_id, old_content, sender_id, receiver_id in changed
+            ])
+            updated = self.model.objects.using(self.db).filter(id__in=[row[0] for row in changed]).update(
+                content=content, edited=True, last_edited=now
+            )
+        invalidate_users(*(user_id for row in changed for user_id in row[2:]), using=self.db)
+        return updated
 
 class UnreadMessagesManager(models.Manager):
     def unread_for_user(self, user):
         return self.filter(receiver=user, read=False)
     
     def unread_count_for_user(self, user):
-        return self.filter(receiver=user, read=False).count()
+        """Read from the user's unread counter instead of counting messages"""
+        from .counters import get_unread_count
+        return get_unread_count(user.pk)
     
     def mark_as_read(self, user, message_ids=None):
+        """
+        Mark the user's unread messages (or those of message_ids) as read and
+        return how many were marked.
+        """
+        from .counters import adjust_unread_counts
+
         queryset = self.filter(receiver=user, read=False)
         if message_ids:
             queryset = queryset.filter(id__in=message_ids)
-        return queryset.update(read=True)
\ No newline at end of file
+        with transaction.atomic(using=self.db):
+            # Senders see read state in their summaries, so their caches expire too
+            sender_ids = set(queryset.values_list('sender_id', flat=True).distinct())
+            count = queryset.update(read=True)
+            if count:
+                # The UPDATE's row count is the exact decrement: no recount needed
+                adjust_unread_counts({user.pk: -count})
+                invalidate_users(user.pk, *sender_ids, using=self.db)
+        return count
+
+    def mark_as_read_and_count(self, user, message_ids=None):
+        """
+        Like mark_as_read(), but return the user's unread count afterwards,
+        read back from the counter row in the same transaction.
+        """
+        from .counters import get_unread_count
+
+        with transaction.atomic(using=self.db):
+            self.mark_as_read(user, message_ids)
+            return get_unread_count(user.pk)
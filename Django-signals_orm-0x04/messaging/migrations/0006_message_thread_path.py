@@ -0,0 +1,104 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+PATH_SEGMENT_LENGTH = 10
+
+
+def backfill_thread_paths(apps, schema_editor):
+    """
+    Fill thread_root, depth and path: roots first, then replies, both in
+    id-ordered batches walked by primary key. A reply normally has a larger
+    id than its parent, so its parent is done by the time it is reached;
+    the few that are not get a final level-by-level pass.
+    """
+    Message = apps.get_model('messaging', 'Message')
+    db = schema_editor.connection.alias
+    messages = Message.objects.using(db)
+
+    last_id = 0
+    while True:
+        roots = list(
+            messages.filter(parent_message__isnull=True, id__gt=last_id).order_by('id').only('id')[:BATCH_SIZE]
+        )
+        if not roots:
+            break
+        for message in roots:
+            message.thread_root_id = message.id
+            message.depth = 0
+            message.path = str(message.id).zfill(PATH_SEGMENT_LENGTH)
+        messages.bulk_update(roots, ['thread_root', 'depth', 'path'])
+        last_id = roots[-1].id
+
+    last_id = 0
+    while True:
+        replies = list(
+            messages.filter(parent_message__isnull=False, id__gt=last_id).order_by('id').only('id', 'parent_message')[:BATCH_SIZE]
+        )
+        if not replies:
+            break
+        last_id = replies[-1].id
+        batch = {message.id: message for message in replies}
+        parents = messages.only('id', 'thread_root', 'depth', 'path').in_bulk(
+            {message.parent_message_id for message in replies} - batch.keys()
+        )
+        done = []
+        for message in replies:
+            # Parents in the same batch come first in id order
+            parent = batch.get(message.parent_message_id) or parents.get(message.parent_message_id)
+            if parent is None or not parent.path:
+                continue
+            message.thread_root_id = parent.thread_root_id
+            message.depth = parent.depth + 1
+            message.path = parent.path + str(message.id).zfill(PATH_SEGMENT_LENGTH)
+            done.append(message)
+        messages.bulk_update(done, ['thread_root', 'depth', 'path'])
+
+    while True:
+        replies = list(
+            messages.filter(path='', parent_message__path__gt='').select_related('parent_message').only(
+                'id', 'parent_message', 'parent_message__thread_root', 'parent_message__depth', 'parent_message__path'
+            ).order_by('id')[:BATCH_SIZE]
+        )
+        if not replies:
+            break
+        for message in replies:
+            parent = message.parent_message
+            message.thread_root_id = parent.thread_root_id
+            message.depth = parent.depth + 1
+            message.path = parent.path + str(message.id).zfill(PATH_SEGMENT_LENGTH)
+        messages.bulk_update(replies, ['thread_root', 'depth', 'path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0005_message_messaging_m_receive_6da6d1_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thread_root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_messages', to='messaging.message'),
+        ),
+        migrations.RunPython(backfill_thread_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thread_root', 'path'], name='message_thread_path_idx'),
+        ),
+    ]
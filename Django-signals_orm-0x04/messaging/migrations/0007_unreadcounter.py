@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('messaging', '0006_message_thread_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('count', models.IntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0007_unreadcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', '-timestamp'], name='message_sender_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', '-timestamp'], name='message_receiver_recent_idx'),
+        ),
+    ]
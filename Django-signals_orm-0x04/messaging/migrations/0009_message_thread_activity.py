@@ -0,0 +1,66 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+BATCH_SIZE = 1000
+
+
+def backfill_thread_activity(apps, schema_editor):
+    """
+    Fill thread_reply_count and last_activity_at on every root, counting the
+    replies of one id-ordered batch of roots with one grouped query
+    """
+    Message = apps.get_model('messaging', 'Message')
+    db = schema_editor.connection.alias
+    messages = Message.objects.using(db)
+
+    last_id = 0
+    while True:
+        roots = list(
+            messages.filter(parent_message__isnull=True, id__gt=last_id).order_by('id').only('id', 'timestamp')[:BATCH_SIZE]
+        )
+        if not roots:
+            break
+        activity = {
+            row['thread_root']: row
+            for row in messages.filter(thread_root__in=roots, parent_message__isnull=False)
+            .values('thread_root').annotate(replies=Count('id'), latest=Max('timestamp')).order_by()
+        }
+        for root in roots:
+            row = activity.get(root.id)
+            root.thread_reply_count = row['replies'] if row else 0
+            root.last_activity_at = max(row['latest'], root.timestamp) if row else root.timestamp
+        messages.bulk_update(roots, ['thread_reply_count', 'last_activity_at'])
+        last_id = roots[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0008_message_recent_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thread_reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_thread_activity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'parent_message', '-last_activity_at', '-id'], name='message_sender_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', 'parent_message', '-last_activity_at', '-id'], name='message_receiver_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:40
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+BATCH_SIZE = 1000
+
+
+def fill_last_activity_at(apps, schema_editor):
+    """
+    Start the activity of messages that have none (replies, and roots created
+    by bulk_create since 0009) at their timestamp, one id range at a time
+    """
+    Message = apps.get_model('messaging', 'Message')
+    messages = Message.objects.using(schema_editor.connection.alias)
+    max_id = messages.aggregate(max_id=Max('id'))['max_id'] or 0
+    for start in range(0, max_id, BATCH_SIZE):
+        messages.filter(id__gt=start, id__lte=start + BATCH_SIZE, last_activity_at__isnull=True).update(
+            last_activity_at=F('timestamp'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0009_message_thread_activity'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_last_activity_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='message',
+            name='last_activity_at',
+            field=models.DateTimeField(editable=False),
+        ),
+    ]
@@ -1,7 +1,21 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Count, F, Max, Value
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
 from django.utils import timezone
-from .managers import UnreadMessagesManager
+from .managers import MessageQuerySet, UnreadMessagesManager
+
+# Fixed-width ids, so sorting paths as strings walks the tree depth-first
+PATH_SEGMENT_LENGTH = 10
+PATH_MAX_LENGTH = 1000
+
+
+# Fields whose loaded values Message keeps to detect changes on save
+SNAPSHOT_FIELDS = ('content', 'read', 'receiver_id')
+
+
+def thread_path(parent_path, message_id):
+    return parent_path + str(message_id).zfill(PATH_SEGMENT_LENGTH)
 
 class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='sent_messages')
@@ -21,8 +35,27 @@ class Message(models.Model):
         related_name='replies'
     )
     
+    # Denormalized thread position, set once when the message is created:
+    # the thread's root (the root points at itself), the number of
+    # ancestors and the ids from the root down to this message
+    thread_root = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='thread_messages'
+    )
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    path = models.CharField(max_length=PATH_MAX_LENGTH, blank=True, default='', editable=False)
+    
+    # Activity of the whole thread, kept on its root message
+    thread_reply_count = models.PositiveIntegerField(default=0, editable=False)
+    # Replies carry their own timestamp here; only roots' values are used
+    last_activity_at = models.DateTimeField(editable=False)
+    
     # Managers
-    objects = models.Manager()
+    objects = MessageQuerySet.as_manager()
     unread = UnreadMessagesManager()
     
     class Meta:
@@ -31,6 +64,17 @@ class Message(models.Model):
             models.Index(fields=['parent_message', 'timestamp']),
             models.Index(fields=['sender', 'receiver', 'timestamp']),
             models.Index(fields=['receiver', 'read']),
+            models.Index(fields=['thread_root', 'path'], name='message_thread_path_idx'),
+            # Newest-first per side, for the inbox summary's recent list
+            models.Index(fields=['sender', '-timestamp'], name='message_sender_recent_idx'),
+            models.Index(fields=['receiver', '-timestamp'], name='message_receiver_recent_idx'),
+            # Conversation list: a user's root messages by thread activity
+            models.Index(
+                fields=['sender', 'parent_message', '-last_activity_at', '-id'], name='message_sender_activity_idx'
+            ),
+            models.Index(
+                fields=['receiver', 'parent_message', '-last_activity_at', '-id'], name='message_receiver_activity_idx'
+            ),
         ]
     
     def __str__(self):
@@ -38,18 +82,105 @@ class Message(models.Model):
         receiver_name = self.receiver.username if self.receiver else '[deleted user]'
         return f"From {sender_name} to {receiver_name}: {self.content[:50]}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._take_snapshot(field_names)
+        return instance
+    
+    def _take_snapshot(self, field_names):
+        # Stored values, so edits and read-state changes are detected without a query
+        if 'content' in field_names:
+            self._loaded_content = self.content
+        if 'read' in field_names and 'receiver_id' in field_names:
+            self._loaded_unread_receiver_id = self.unread_receiver_id
+    
+    @property
+    def unread_receiver_id(self):
+        """The user whose unread count includes this message, if any"""
+        return None if self.read else self.receiver_id
+    
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        fields = kwargs.get('fields', args[1] if len(args) > 1 else None)
+        self._take_snapshot(SNAPSHOT_FIELDS if fields is None else [
+            self._meta.get_field(name).attname for name in fields
+        ])
+    
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        parent = self.parent_message if creating and self.parent_message_id else None
+        if parent is not None:
+            if len(parent.path) + PATH_SEGMENT_LENGTH > PATH_MAX_LENGTH:
+                raise ValueError(f"Threads cannot be deeper than {PATH_MAX_LENGTH // PATH_SEGMENT_LENGTH} messages")
+            self.thread_root_id = parent.thread_root_id
+            self.depth = parent.depth + 1
+        if creating and self.last_activity_at is None:
+            self.last_activity_at = self.timestamp
+        if creating:
+            # The insert and the thread fields written right after it (see
+            # _save_table) are committed together or not at all. No
+            # savepoint: a failure rolls back the enclosing transaction, and
+            # on_commit batches stay per transaction.
+            using = kwargs.get('using') or router.db_for_write(Message, instance=self)
+            with transaction.atomic(using=using, savepoint=False):
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        self._take_snapshot(SNAPSHOT_FIELDS if update_fields is None else [
+            self._meta.get_field(name).attname for name in update_fields
+        ])
+    
+    def _save_table(self, raw=False, cls=None, force_insert=False, force_update=False, using=None, update_fields=None):
+        updated = super()._save_table(raw, cls, force_insert, force_update, using, update_fields)
+        if not updated and not raw:
+            # The path ends with our own id, only known after the insert. It
+            # is written here, before post_save, so receivers see a complete row.
+            parent = self.parent_message if self.parent_message_id else None
+            self.path = thread_path(parent.path if parent is not None else '', self.pk)
+            if self.thread_root_id is None:
+                self.thread_root_id = self.pk
+            Message.objects.using(using).filter(pk=self.pk).update(thread_root_id=self.thread_root_id, path=self.path)
+            if parent is not None:
+                record_replies({self.thread_root_id: (1, self.timestamp)}, using=using)
+        return updated
+    
     def get_thread_depth(self):
-        depth = 0
-        current = self
-        while current.parent_message:
-            depth += 1
-            current = current.parent_message
-        return depth
+        return self.depth
+    
+    def get_thread(self):
+        """Every message in this thread, in depth-first tree order"""
+        return Message.objects.filter(thread_root_id=self.thread_root_id).order_by('path')
     
     @property
     def is_reply(self):
         return self.parent_message is not None
 
+def record_replies(replies_by_root, using=None):
+    """Add {root_id: (new replies, latest timestamp)} to the roots' thread activity"""
+    for root_id, (count, latest) in replies_by_root.items():
+        Message.objects.db_manager(using).filter(pk=root_id).update(
+            thread_reply_count=F('thread_reply_count') + count,
+            last_activity_at=Greatest(
+                'last_activity_at', Value(latest, output_field=models.DateTimeField())
+            ),
+        )
+
+def refresh_thread_activity(root_ids):
+    """Recount the thread activity of the given roots, e.g. after replies were deleted"""
+    activity = {
+        row['thread_root']: row
+        for row in Message.objects.filter(thread_root__in=root_ids, parent_message__isnull=False)
+        .values('thread_root').annotate(replies=Count('id'), latest=Max('timestamp')).order_by()
+    }
+    roots = list(Message.objects.filter(pk__in=root_ids).only('id', 'timestamp'))
+    for root in roots:
+        row = activity.get(root.pk)
+        root.thread_reply_count = row['replies'] if row else 0
+        root.last_activity_at = max(row['latest'], root.timestamp) if row else root.timestamp
+    Message.objects.bulk_update(roots, ['thread_reply_count', 'last_activity_at'])
+
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     message = models.ForeignKey('Message', on_delete=models.CASCADE)
@@ -76,4 +207,13 @@ class MessageHistory(models.Model):
     
     def __str__(self):
         editor_name = self.edited_by.username if self.edited_by else '[deleted user]'
-        return f"History for Message {self.message.id} - {self.edited_at}"
\ No newline at end of file
+        return f"History for Message {self.message.id} - {self.edited_at}"
+
+class UnreadCounter(models.Model):
+    """Number of unread messages received by a user, maintained incrementally"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter')
+    count = models.IntegerField(default=0)
+    reconciled_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.user.username}: {self.count} unread"
@@ -0,0 +1,64 @@
+import logging
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .commit_batches import CommitBatch
+from .models import Notification
+from .tasks import enqueue
+from .user_cache import invalidate_users
+
+NOTIFICATION_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+class _Batch(CommitBatch):
+    """
+    Notifications waiting for one transaction (or savepoint) to commit. Work
+    rolled back is dropped together with its notifications.
+    """
+
+    def __init__(self, using):
+        super().__init__(using)
+        self.notifications = []
+
+    def run(self):
+        deliver_notifications(self.notifications, self.using)
+
+
+def build_notification(message):
+    return Notification(user_id=message.receiver_id, message_id=message.pk, notification_type='new_message')
+
+
+def queue_notifications(messages, using=DEFAULT_DB_ALIAS):
+    """
+    Create new-message notifications for messages once the current
+    transaction commits, all with one bulk INSERT. Outside a transaction they
+    are written straight away.
+    """
+    notifications = [build_notification(message) for message in messages if message.receiver_id is not None]
+    if not notifications:
+        return
+    if not transaction.get_connection(using).in_atomic_block:
+        deliver_notifications(notifications, using)
+        return
+    _Batch.pending(using).notifications.extend(notifications)
+
+
+def write_notifications(notifications, using=DEFAULT_DB_ALIAS):
+    Notification.objects.using(using).bulk_create(notifications, batch_size=NOTIFICATION_BATCH_SIZE)
+    invalidate_users(*(notification.user_id for notification in notifications), using=using)
+    logger.debug("%d notifications created", len(notifications))
+
+
+def deliver_notifications(notifications, using=DEFAULT_DB_ALIAS):
+    """
+    Write notifications now, or hand them to the background worker when
+    MESSAGING_NOTIFICATIONS_IN_BACKGROUND is set
+    """
+    if not notifications:
+        return
+    if getattr(settings, 'MESSAGING_NOTIFICATIONS_IN_BACKGROUND', False):
+        enqueue(write_notifications, notifications, using)
+    else:
+        write_notifications(notifications, using)
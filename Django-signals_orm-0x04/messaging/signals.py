@@ -1,74 +1,228 @@
-﻿from django.db.models.signals import post_save, pre_save, post_delete
+﻿import logging
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils import timezone
-from .models import Message, Notification, MessageHistory
+from collections import Counter
+from . import user_cache
+from .counters import adjust_unread_counts
+from .models import Message, Notification, MessageHistory, refresh_thread_activity
+from .notifications import queue_notifications
+from .tasks import enqueue
+
+CLEANUP_CHUNK_SIZE = 500
+# Saves that write none of these leave the unread counters alone
+UNREAD_STATE_FIELDS = frozenset({'read', 'receiver', 'receiver_id'})
+
+logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=Message)
 def create_notification_on_new_message(sender, instance, created, **kwargs):
     """
     Signal receiver that creates a notification when a new message is created.
-    Only triggers when a new message is created (not on updates).
+    Only triggers when a new message is created (not on updates). Notifications
+    are buffered until the transaction commits and written with one bulk INSERT.
     """
     if created:
-        Notification.objects.create(
-            user=instance.receiver,
-            message=instance,
-            notification_type='new_message'
-        )
-        print(f"✅ Notification created for {instance.receiver.username}")
+        queue_notifications([instance], using=kwargs.get('using') or DEFAULT_DB_ALIAS)
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_message_caches(sender, instance, **kwargs):
+    """
+    Signal receiver that expires the cached inbox data of both users of a
+    message whenever it is created, changed or deleted.
+    """
+    user_cache.invalidate_users(instance.sender_id, instance.receiver_id, using=kwargs.get('using') or DEFAULT_DB_ALIAS)
+
+@receiver(post_save, sender=Notification)
+def invalidate_notification_caches(sender, instance, **kwargs):
+    """Signal receiver that expires the cached inbox data of a notified user."""
+    user_cache.invalidate_users(instance.user_id, using=kwargs.get('using') or DEFAULT_DB_ALIAS)
+
+def writes_unread_state(update_fields):
+    """Whether a save with these update_fields writes read or receiver"""
+    return update_fields is None or not UNREAD_STATE_FIELDS.isdisjoint(update_fields)
+
+@receiver(pre_save, sender=Message)
+def load_unread_state(sender, instance, update_fields=None, **kwargs):
+    """
+    Signal receiver that looks up whose unread count an existing message was
+    in, for instances saved without a loaded snapshot (rare).
+    """
+    if not writes_unread_state(update_fields):
+        return
+    if instance._state.adding or instance.pk is None or '_loaded_unread_receiver_id' in instance.__dict__:
+        return
+    row = Message.objects.filter(pk=instance.pk).values_list('read', 'receiver_id').first()
+    instance._loaded_unread_receiver_id = None if row is None or row[0] else row[1]
+
+@receiver(post_save, sender=Message)
+def update_unread_count_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """Signal receiver that moves a message in or out of the unread counters."""
+    # Unsaved changes to read or receiver stay out of the counters until written
+    if not writes_unread_state(update_fields):
+        return
+    before = None if created else instance.__dict__.get('_loaded_unread_receiver_id')
+    after = instance.unread_receiver_id
+    if before != after:
+        deltas = Counter()
+        deltas[before] -= 1
+        deltas[after] += 1
+        adjust_unread_counts(deltas)
+
+@receiver(post_delete, sender=Message)
+def update_unread_count_on_delete(sender, instance, **kwargs):
+    """Signal receiver that drops a deleted unread message from its counter."""
+    if instance.unread_receiver_id is not None:
+        adjust_unread_counts({instance.unread_receiver_id: -1})
+
+@receiver(post_delete, sender=Message)
+def update_thread_activity_on_delete(sender, instance, **kwargs):
+    """Signal receiver that recounts a thread's activity when one of its replies is deleted."""
+    if instance.parent_message_id is not None and instance.thread_root_id is not None:
+        refresh_thread_activity([instance.thread_root_id])
 
 @receiver(pre_save, sender=Message)
-def log_message_edit_history(sender, instance, **kwargs):
+def log_message_edit_history(sender, instance, update_fields=None, **kwargs):
     """
     Signal receiver that logs message edit history before saving changes.
     Only triggers when an existing message is being updated and content changed.
+    The old content comes from the snapshot taken when the message was
+    loaded; only instances without one fall back to a query.
+    """
+    if instance.pk is None:
+        return
+    if update_fields is not None and 'content' not in update_fields:
+        return
+    if '_loaded_content' in instance.__dict__:
+        old_content = instance._loaded_content
+    else:
+        old_content = Message.objects.filter(pk=instance.pk).values_list('content', flat=True).first()
+    if old_content is None or old_content == instance.content:
+        return
+    MessageHistory.objects.create(
+        message=instance,
+        old_content=old_content,
+        edited_by_id=instance.sender_id  # Assuming sender is editing
+    )
+    # Update edit tracking fields
+    instance.edited = True
+    instance.last_edited = timezone.now()
+    logger.debug("Message edit history logged for message %s", instance.id)
+
+def delete_in_chunks(model, ids, chunk_size):
+    """Delete rows by primary key, one short transaction per chunk"""
+    deleted = 0
+    for offset in range(0, len(ids), chunk_size):
+        with transaction.atomic():
+            deleted += model.objects.filter(pk__in=ids[offset:offset + chunk_size]).delete()[1].get(
+                model._meta.label, 0
+            )
+    return deleted
+
+def delete_message_rows(ids_by_depth):
+    """
+    DELETE messages by id with plain SQL, deepest thread level first so no
+    row goes before the replies that reference it. Unlike QuerySet.delete()
+    this sends no post_delete signals; returns the number of rows deleted.
+    """
+    table = connection.ops.quote_name(Message._meta.db_table)
+    pk = connection.ops.quote_name(Message._meta.pk.column)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for depth in sorted(ids_by_depth, reverse=True):
+            ids = ids_by_depth[depth]
+            for offset in range(0, len(ids), CLEANUP_CHUNK_SIZE):
+                batch = ids[offset:offset + CLEANUP_CHUNK_SIZE]
+                cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({', '.join(['%s'] * len(batch))})", batch)
+                deleted += cursor.rowcount
+    return deleted
+
+def delete_messages(ids):
+    """
+    Delete messages and the replies below them with set-based DELETEs.
+    Those skip the per-row post_delete receivers, so what the receivers
+    would have done is applied here once for all rows: the unread counters
+    (update_unread_count_on_delete), the inbox caches
+    (invalidate_message_caches) and the activity of the threads that lost
+    replies (update_thread_activity_on_delete). Returns the number of
+    messages deleted.
     """
-    if instance.pk:  # Only for existing instances (updates)
-        try:
-            old_message = Message.objects.get(pk=instance.pk)
-            if old_message.content != instance.content:  # Content changed
-                # Log the old content to history
-                MessageHistory.objects.create(
-                    message=old_message,
-                    old_content=old_message.content,
-                    edited_by=instance.sender  # Assuming sender is editing
-                )
-                # Update edit tracking fields
-                instance.edited = True
-                instance.last_edited = timezone.now()
-                print(f"📝 Message edit history logged for message {instance.id}")
-        except Message.DoesNotExist:
-            pass  # Message doesn't exist yet (shouldn't happen in pre_save)
+    fields = ('id', 'sender_id', 'receiver_id', 'read', 'parent_message_id', 'thread_root_id', 'depth')
+    rows = {row[0]: row for row in Message.objects.filter(pk__in=ids).values_list(*fields)}
+    frontier = list(rows)
+    while frontier:
+        # Replies cascade with their parent, one level per query
+        replies = [
+            row for row in Message.objects.filter(parent_message_id__in=frontier).values_list(*fields)
+            if row[0] not in rows
+        ]
+        rows.update((row[0], row) for row in replies)
+        frontier = [row[0] for row in replies]
+    if not rows:
+        return 0
+    Notification.objects.filter(message_id__in=rows).delete()
+    MessageHistory.objects.filter(message_id__in=rows).delete()
+    ids_by_depth = {}
+    for row in rows.values():
+        ids_by_depth.setdefault(row[6], []).append(row[0])
+    deleted = delete_message_rows(ids_by_depth)
+    unread = Counter(receiver_id for _, _, receiver_id, read, _, _, _ in rows.values() if not read)
+    adjust_unread_counts({user_id: -count for user_id, count in unread.items()})
+    user_cache.invalidate_users(*(user_id for row in rows.values() for user_id in row[1:3]))
+    roots = {
+        thread_root_id for _, _, _, _, parent_id, thread_root_id, _ in rows.values()
+        if parent_id is not None and thread_root_id is not None and thread_root_id not in rows
+    }
+    if roots:
+        refresh_thread_activity(roots)
+    return deleted
+
+def delete_user_data(username, message_ids, history_ids, chunk_size=CLEANUP_CHUNK_SIZE):
+    """
+    Delete the messages a deleted user sent or received and the history
+    entries they edited, given the ids captured before the user went away.
+    """
+    history_count = delete_in_chunks(MessageHistory, history_ids, chunk_size)
+    message_count = 0
+    for offset in range(0, len(message_ids), chunk_size):
+        with transaction.atomic():
+            message_count += delete_messages(message_ids[offset:offset + chunk_size])
+    logger.info("Deleted %d messages and %d history entries of user %s", message_count, history_count, username)
+
+@receiver(pre_delete, sender=User)
+def capture_user_data(sender, instance, **kwargs):
+    """
+    Signal receiver that records which rows belong to a user about to be
+    deleted, before SET_NULL makes them indistinguishable from other
+    deleted users' rows. Each lookup is a single indexed query.
+    """
+    message_ids = set(Message.objects.filter(sender=instance).values_list('id', flat=True))
+    message_ids.update(Message.objects.filter(receiver=instance).values_list('id', flat=True))
+    history_ids = list(MessageHistory.objects.filter(edited_by=instance).values_list('id', flat=True))
+    instance._messaging_cleanup = (sorted(message_ids), history_ids)
 
 @receiver(post_delete, sender=User)
 def cleanup_user_data(sender, instance, **kwargs):
     """
-    Signal receiver that cleans up all user-related data when a user is deleted.
-    Since we use SET_NULL for some foreign keys, we need to clean up the orphaned data.
-    """
-    user_id = instance.id
-    username = instance.username
-    
-    print(f"🧹 Cleaning up data for deleted user: {username} (ID: {user_id})")
-    
-    # Clean up messages where sender or receiver is now NULL (due to SET_NULL)
-    # These are messages where the user was either sender or receiver
-    null_sender_messages = Message.objects.filter(sender__isnull=True)
-    null_receiver_messages = Message.objects.filter(receiver__isnull=True)
-    
-    # Combine and delete orphaned messages
-    orphaned_messages = null_sender_messages | null_receiver_messages
-    message_count = orphaned_messages.count()
-    orphaned_messages.delete()
-    print(f"   Deleted {message_count} orphaned messages")
-    
-    # Notifications are automatically deleted via CASCADE, so we don't need to handle them
-    
-    # Clean up message history where edited_by is now NULL
-    null_editor_history = MessageHistory.objects.filter(edited_by__isnull=True)
-    history_count = null_editor_history.count()
-    null_editor_history.delete()
-    print(f"   Deleted {history_count} orphaned message history entries")
-    
-    print(f"✅ Cleanup completed for user: {username}")
\ No newline at end of file
+    Signal receiver that deletes the deleted user's messages and message
+    history once the user deletion has committed, in chunks so no single
+    transaction holds the message table for long. With
+    MESSAGING_CLEANUP_IN_BACKGROUND the chunks run on the background worker.
+    """
+    captured = getattr(instance, '_messaging_cleanup', None)
+    if captured is None:
+        return
+    del instance._messaging_cleanup
+    message_ids, history_ids = captured
+    if not message_ids and not history_ids:
+        return
+    chunk_size = getattr(settings, 'MESSAGING_CLEANUP_CHUNK_SIZE', CLEANUP_CHUNK_SIZE)
+    args = (instance.username, message_ids, history_ids, chunk_size)
+    if getattr(settings, 'MESSAGING_CLEANUP_IN_BACKGROUND', False):
+        transaction.on_commit(lambda: enqueue(delete_user_data, *args))
+    else:
+        transaction.on_commit(lambda: delete_user_data(*args))
@@ -0,0 +1,86 @@
+from django.db import connections
+from django.db.models import Subquery
+
+from .models import Message, UnreadCounter
+
+UNREAD_LIMIT = 5
+RECENT_LIMIT = 10
+
+
+def _counts_sql(connection):
+    qn = connection.ops.quote_name
+    message, counter = qn(Message._meta.db_table), qn(UnreadCounter._meta.db_table)
+    sender, receiver, read = qn('sender_id'), qn('receiver_id'), qn('read')
+    return f"""
+        SELECT
+            (SELECT COUNT(*) FROM {message} WHERE {sender} = %(user)s),
+            (SELECT COUNT(*) FROM {message} WHERE {receiver} = %(user)s),
+            (SELECT COUNT(*) FROM {message} WHERE {sender} = %(user)s AND {receiver} = %(user)s),
+            COALESCE(
+                (SELECT {qn('count')} FROM {counter} WHERE {qn('user_id')} = %(user)s),
+                (SELECT COUNT(*) FROM {message} WHERE {receiver} = %(user)s AND {read} = %(false)s)
+            )
+    """
+
+
+def message_counts(user):
+    """
+    Total and unread message counts in one query. Each part is a separate
+    subquery answered from one index, unlike a single scan filtered on
+    sender OR receiver. The unread count comes from the user's counter,
+    falling back to counting. Written as SQL because building the same
+    statement from nested ORM subqueries costs more than running it.
+    """
+    connection = connections[Message.objects.db]
+    with connection.cursor() as cursor:
+        cursor.execute(_counts_sql(connection), {'user': user.pk, 'false': False})
+        sent, received, to_self, unread = cursor.fetchone()
+    return {'total_count': sent + received - to_self, 'unread_count': unread}
+
+
+def limited_union(sides, ordering, limit, prepare=None):
+    """
+    The first limit rows of a UNION ALL of querysets, ordered by ordering.
+    Each side reads at most limit rows from its index, through a limited IN
+    subquery where the database cannot limit parts of a UNION (SQLite).
+    prepare(queryset), if given, adds select_related() and the like to each
+    side.
+    """
+    sides = [side.order_by(*ordering) for side in sides]
+    if connections[sides[0].db].features.supports_slicing_ordering_in_compound:
+        sides = [side[:limit] for side in sides]
+    else:
+        sides = [side.model.objects.filter(pk__in=Subquery(side.values('pk')[:limit])).order_by() for side in sides]
+    if prepare is not None:
+        sides = [prepare(side) for side in sides]
+    return list(sides[0].union(*sides[1:], all=True).order_by(*ordering)[:limit])
+
+
+def recent_messages(user, limit=RECENT_LIMIT):
+    """
+    The user's latest sent or received messages: a UNION ALL of the sender
+    side and the receiver side, each answered from its (user, -timestamp)
+    index.
+    """
+    return limited_union(
+        [Message.objects.filter(sender=user), Message.objects.filter(receiver=user).exclude(sender=user)],
+        ['-timestamp'],
+        limit,
+        lambda side: side.select_related('sender', 'receiver').only(
+            'id', 'content', 'timestamp', 'read', 'sender__username', 'receiver__username'
+        ),
+    )
+
+
+def unread_messages(user, limit=UNREAD_LIMIT):
+    return list(Message.unread.unread_for_user(user).select_related('sender').only(
+        'id', 'content', 'timestamp', 'sender__username'
+    ).order_by('-timestamp')[:limit])
+
+
+def inbox_summary(user, unread_limit=UNREAD_LIMIT, recent_limit=RECENT_LIMIT):
+    """Everything the inbox summary shows, in three indexed queries"""
+    summary = message_counts(user)
+    summary['unread_messages'] = unread_messages(user, unread_limit)
+    summary['recent_messages'] = recent_messages(user, recent_limit)
+    return summary
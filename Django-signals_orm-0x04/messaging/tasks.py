@@ -0,0 +1,39 @@
+import logging
+import queue
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_tasks = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _run():
+    while True:
+        func, args, kwargs = _tasks.get()
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Background task %s failed", getattr(func, '__name__', func))
+        finally:
+            # The worker thread has its own connection; don't let it go stale
+            close_old_connections()
+            _tasks.task_done()
+
+
+def enqueue(func, *args, **kwargs):
+    """Run func(*args, **kwargs) on the in-process background worker thread"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='messaging-tasks', daemon=True)
+            _worker.start()
+    _tasks.put((func, args, kwargs))
+
+
+def wait_for_tasks():
+    """Block until every queued task has run"""
+    _tasks.join()
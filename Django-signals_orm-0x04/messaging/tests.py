@@ -1,11 +1,26 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
-from .models import Message, Notification, MessageHistory
+from .models import Message, Notification, MessageHistory, UnreadCounter, refresh_thread_activity, thread_path
+from .counters import adjust_unread_counts, reconcile_unread_counts
+from io import StringIO
+from django.core.management import call_command
+from .threads import load_thread
+from .conversations import encode_cursor, get_user_conversations
+from .tasks import enqueue, wait_for_tasks
+import weakref
+from importlib import import_module
+from types import SimpleNamespace
+from unittest.mock import patch
+from django.apps import apps
+from django.db import connection, transaction
 from django.utils import timezone
+from django.db.models.signals import post_save
 from django.urls import reverse
 from django.db import models
-from django.db.models import Q
-from django.core.cache import cache
+from django.db.models import F, Q
+from django.core.cache import cache, caches
+from django.test.utils import CaptureQueriesContext
+from . import notifications, summary, user_cache
 from django.test import TestCase, override_settings
 
 
@@ -29,12 +44,13 @@ class SignalTests(TestCase):
         # Count initial notifications
         initial_notification_count = Notification.objects.count()
         
-        # Create a new message
-        message = Message.objects.create(
-            sender=self.sender,
-            receiver=self.receiver,
-            content="Hello, this is a test message!"
-        )
+        # Create a new message; its notification is written on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(
+                sender=self.sender,
+                receiver=self.receiver,
+                content="Hello, this is a test message!"
+            )
         
         # Check that a notification was created
         final_notification_count = Notification.objects.count()
@@ -50,19 +66,22 @@ class SignalTests(TestCase):
     def test_no_notification_on_message_update(self):
         """Test that no notification is created when an existing message is updated"""
         # Create a message
-        message = Message.objects.create(
-            sender=self.sender,
-            receiver=self.receiver,
-            content="Initial message"
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(
+                sender=self.sender,
+                receiver=self.receiver,
+                content="Initial message"
+            )
         
         # Count notifications after creation
         notification_count_after_creation = Notification.objects.count()
+        self.assertEqual(notification_count_after_creation, 1)
         
         # Update the message
-        message.content = "Updated message"
-        message.read = True
-        message.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            message.content = "Updated message"
+            message.read = True
+            message.save()
         
         # Verify no new notification was created
         notification_count_after_update = Notification.objects.count()
@@ -145,6 +164,118 @@ class SignalTests(TestCase):
         self.assertEqual(history_entries[0].old_content, "Second version")
         self.assertEqual(history_entries[1].old_content, "First version")
 
+    def test_saving_loaded_message_needs_no_extra_select(self):
+        """Edit detection uses the snapshot taken when the message was loaded"""
+        Message.objects.create(sender=self.sender, receiver=self.receiver, content="Original")
+        message = Message.objects.get()
+        message.read = True
+        with self.assertNumQueries(2):  # the UPDATE and the unread counter
+            message.save()
+        message.content = "Changed"
+        with self.assertNumQueries(2):  # history INSERT and the UPDATE
+            message.save()
+        self.assertEqual(MessageHistory.objects.get().old_content, "Original")
+
+    def test_snapshot_follows_refresh_from_db(self):
+        message = Message.objects.create(sender=self.sender, receiver=self.receiver, content="Original")
+        Message.objects.filter(pk=message.pk).update(content="Changed elsewhere")
+        message.refresh_from_db()
+        message.save()
+        self.assertEqual(MessageHistory.objects.count(), 0)
+
+    def test_update_fields_without_content_skips_history_check(self):
+        message = Message.objects.create(sender=self.sender, receiver=self.receiver, content="Original")
+        message.content = "Not saved"
+        message.read = True
+        message.save(update_fields=['read'])
+        self.assertEqual(MessageHistory.objects.count(), 0)
+
+    def test_bulk_edit_records_history_in_bulk(self):
+        """QuerySet.edit() writes history only for messages whose content changes"""
+        for content in ("First", "Second", "Same"):
+            Message.objects.create(sender=self.sender, receiver=self.receiver, content=content)
+        with self.assertNumQueries(5):  # savepoint, SELECT, bulk INSERT, UPDATE, release
+            changed = Message.objects.filter(sender=self.sender).edit("Same", edited_by=self.receiver)
+        self.assertEqual(changed, 2)
+        self.assertEqual(
+            sorted(MessageHistory.objects.values_list('old_content', flat=True)), ["First", "Second"]
+        )
+        self.assertTrue(all(h.edited_by == self.receiver for h in MessageHistory.objects.all()))
+        self.assertEqual(Message.objects.filter(content="Same", edited=True).count(), 2)
+
+class NotificationPipelineTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username='sender', password='testpass123')
+        self.receiver = User.objects.create_user(username='receiver', password='testpass123')
+
+    def send(self, count, **kwargs):
+        for i in range(count):
+            Message.objects.create(sender=self.sender, receiver=self.receiver, content=f"Message {i}", **kwargs)
+
+    def test_notifications_written_in_one_insert_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.send(5)
+        self.assertEqual(Notification.objects.count(), 0)
+        # The notification batch, then the cache invalidation after commit
+        self.assertEqual(len(callbacks), 2)
+        with self.assertNumQueries(1):
+            callbacks[0]()
+        self.assertEqual(Notification.objects.filter(user=self.receiver).count(), 5)
+
+    def test_rolled_back_savepoint_drops_its_notifications(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.send(1)
+            try:
+                with transaction.atomic():
+                    self.send(2)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            self.send(1)
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(Notification.objects.count(), Message.objects.count())
+
+    def test_rolled_back_batch_is_released(self):
+        try:
+            with transaction.atomic():
+                self.send(1)
+                batch = weakref.ref(notifications._Batch.pending(connection.alias))
+                self.assertIsNotNone(batch())
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # Dropped with its on_commit hook; nothing keeps it alive
+        self.assertIsNone(batch())
+
+    def test_no_notification_without_receiver(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=self.sender, receiver=None, content="Nobody")
+        self.assertEqual(Notification.objects.count(), 0)
+
+    def test_send_many(self):
+        root = Message.objects.create(sender=self.sender, receiver=self.receiver, content="Root")
+        with self.captureOnCommitCallbacks(execute=True):
+            created = Message.objects.send_many([
+                Message(sender=self.receiver, receiver=self.sender, content="Reply", parent_message=root),
+                Message(sender=self.sender, receiver=self.receiver, content="New thread"),
+            ])
+        reply, new_root = Message.objects.filter(pk__in=[m.pk for m in created]).order_by('pk')
+        self.assertEqual((reply.thread_root_id, reply.depth), (root.pk, 1))
+        self.assertEqual(reply.path, thread_path(root.path, reply.pk))
+        self.assertEqual((new_root.thread_root_id, new_root.depth), (new_root.pk, 0))
+        self.assertEqual(Notification.objects.filter(message__in=created).count(), 2)
+
+    @override_settings(MESSAGING_NOTIFICATIONS_IN_BACKGROUND=True)
+    def test_background_delivery(self):
+        with patch('messaging.notifications.enqueue') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.send(3)
+        func, notifications, using = enqueue.call_args.args
+        self.assertEqual(len(notifications), 3)
+        func(notifications, using)
+        self.assertEqual(Notification.objects.count(), 3)
+
+
 class ModelTests(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='user1', password='test123')
@@ -236,8 +367,9 @@ class UserDeletionTests(TestCase):
         total_messages_before = Message.objects.count()
         self.assertEqual(total_messages_before, 2)
         
-        # Delete user1
-        self.user1.delete()
+        # Delete user1; the cleanup runs once the deletion commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user1.delete()
         
         # Check that orphaned messages (with null sender/receiver) are cleaned up
         total_messages_after = Message.objects.count()
@@ -293,7 +425,8 @@ class UserDeletionTests(TestCase):
         self.assertEqual(history_count_before, 1)
         
         # Delete the user
-        self.user1.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user1.delete()
         
         # Check that message history with null editor is cleaned up
         history_count_after = MessageHistory.objects.count()
@@ -318,6 +451,79 @@ class UserDeletionTests(TestCase):
         user2_messages_after = Message.objects.filter(sender_id=self.user2_id, receiver_id=self.user2_id).count()
         self.assertEqual(user2_messages_after, 1)
 
+    def test_cleanup_scoped_to_deleted_user(self):
+        """Rows orphaned by an earlier deletion are not touched by a later one"""
+        user3 = User.objects.create_user(username='user3', password='testpass123')
+        Message.objects.create(sender=self.user1, receiver=self.user2, content="user1 to user2")
+        Message.objects.create(sender=user3, receiver=self.user2, content="user3 to user2")
+        MessageHistory.objects.create(
+            message=Message.objects.create(sender=user3, receiver=self.user2, content="edited"),
+            old_content="before", edited_by=user3
+        )
+        # An earlier deletion whose orphaned rows were kept
+        Message.objects.filter(sender=user3).update(sender=None)
+        MessageHistory.objects.update(edited_by=None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user1.delete()
+
+        self.assertEqual(Message.objects.filter(sender__isnull=True).count(), 2)
+        self.assertEqual(MessageHistory.objects.count(), 1)
+
+    def test_cleanup_waits_for_commit(self):
+        Message.objects.create(sender=self.user1, receiver=self.user2, content="Test")
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user1.delete()
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(len(callbacks), 1)
+        with self.settings(MESSAGING_CLEANUP_CHUNK_SIZE=1):
+            callbacks[0]()
+        self.assertEqual(Message.objects.count(), 0)
+
+    @override_settings(MESSAGING_CLEANUP_IN_BACKGROUND=True)
+    def test_cleanup_in_background(self):
+        for i in range(3):
+            Message.objects.create(sender=self.user1, receiver=self.user2, content=f"Test {i}")
+        with patch('messaging.signals.enqueue') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user1.delete()
+        func, *args = enqueue.call_args.args
+        self.assertEqual(Message.objects.count(), 3)
+        func(*args)
+        self.assertEqual(Message.objects.count(), 0)
+
+    def test_cleanup_applies_side_effects_once_per_chunk(self):
+        user3 = User.objects.create_user(username='user3', password='testpass123')
+        root = Message.objects.create(sender=user3, receiver=self.user2, content="root")
+        reply = Message.objects.create(sender=self.user2, receiver=user3, content="reply", parent_message=root)
+        Message.objects.create(sender=self.user1, receiver=user3, content="reply 2", parent_message=reply)
+        for i in range(5):
+            Message.objects.create(sender=self.user1, receiver=self.user2, content=f"unread {i}")
+        own = Message.objects.create(sender=self.user1, receiver=self.user2, content="own thread")
+        Message.objects.create(sender=self.user2, receiver=self.user1, content="reply", parent_message=own)
+        self.assertEqual(Message.unread.unread_count_for_user(self.user2), 7)
+        root.refresh_from_db()
+        self.assertEqual(root.thread_reply_count, 2)
+
+        with patch('messaging.signals.refresh_thread_activity', wraps=refresh_thread_activity) as refresh:
+            with patch('messaging.signals.adjust_unread_counts', wraps=adjust_unread_counts) as adjust:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.user1.delete()
+
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(adjust.call_count, 1)
+        self.assertEqual(Message.unread.unread_count_for_user(self.user2), 1)
+        self.assertEqual(Message.unread.unread_count_for_user(user3), 1)
+        self.assertEqual(set(Message.objects.values_list('content', flat=True)), {"root", "reply"})
+        root.refresh_from_db()
+        self.assertEqual(root.thread_reply_count, 1)
+
+    def test_background_worker_runs_tasks(self):
+        results = []
+        enqueue(results.append, 'done')
+        wait_for_tasks()
+        self.assertEqual(results, ['done'])
+
 class ThreadedConversationTests(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='user1', password='test123')
@@ -408,6 +614,142 @@ class ThreadedConversationTests(TestCase):
         self.assertIsNotNone(conversation.last_activity)
 
 
+
+class ThreadPathTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='test123')
+        self.user2 = User.objects.create_user(username='user2', password='test123')
+        self.root = Message.objects.create(sender=self.user1, receiver=self.user2, content="Root")
+        self.first = Message.objects.create(
+            sender=self.user2, receiver=self.user1, content="First", parent_message=self.root
+        )
+        self.nested = Message.objects.create(
+            sender=self.user1, receiver=self.user2, content="Nested", parent_message=self.first
+        )
+        self.second = Message.objects.create(
+            sender=self.user2, receiver=self.user1, content="Second", parent_message=self.root
+        )
+
+    def test_position_set_on_create(self):
+        for message in (self.root, self.first, self.nested, self.second):
+            message.refresh_from_db()
+            self.assertEqual(message.thread_root_id, self.root.id)
+        self.assertEqual(self.root.path, thread_path('', self.root.id))
+        self.assertEqual(self.nested.path, thread_path(thread_path(self.root.path, self.first.id), self.nested.id))
+        self.assertEqual([self.root.depth, self.first.depth, self.nested.depth], [0, 1, 2])
+
+    def test_depth_and_root_without_walking_parents(self):
+        nested = Message.objects.get(pk=self.nested.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(nested.get_thread_depth(), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(nested.thread_root, self.root)
+
+    def test_thread_in_tree_order(self):
+        with self.assertNumQueries(1):
+            thread = list(self.second.get_thread())
+        self.assertEqual(thread, [self.root, self.first, self.nested, self.second])
+
+    def test_migration_backfills_existing_rows(self):
+        migration = import_module('messaging.migrations.0006_message_thread_path')
+        # A reply older than its parent, as rows moved between threads can be
+        moved = Message.objects.create(sender=self.user1, receiver=self.user2, content="Moved")
+        later = Message.objects.create(sender=self.user1, receiver=self.user2, content="Later", parent_message=self.second)
+        Message.objects.filter(pk=moved.pk).update(
+            parent_message=later, thread_root=self.root, depth=3, path=thread_path(later.path, moved.pk)
+        )
+        expected = list(Message.objects.order_by('id').values_list('id', 'thread_root', 'depth', 'path'))
+        Message.objects.update(thread_root=None, depth=0, path='')
+        with patch.object(migration, 'BATCH_SIZE', 2):
+            migration.backfill_thread_paths(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('id', 'thread_root', 'depth', 'path')), expected
+        )
+
+    def test_save_is_atomic_and_complete_before_post_save(self):
+        seen = []
+        def receiver(sender, instance, created, **kwargs):
+            if created:
+                seen.append((instance.thread_root_id, instance.path))
+        post_save.connect(receiver, sender=Message)
+        self.addCleanup(post_save.disconnect, receiver, sender=Message)
+        reply = Message.objects.create(sender=self.user1, receiver=self.user2, content="Seen", parent_message=self.root)
+        self.assertEqual(seen, [(self.root.pk, reply.path)])
+
+        count = Message.objects.count()
+        with patch('messaging.models.record_replies', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Message.objects.create(sender=self.user1, receiver=self.user2, content="Lost", parent_message=self.root)
+        self.assertEqual(Message.objects.count(), count)
+
+
+class ThreadLoadingTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='test123')
+        self.user2 = User.objects.create_user(username='user2', password='test123')
+        self.root = Message.objects.create(sender=self.user1, receiver=self.user2, content="Root")
+
+    def make_chain(self, parent, length):
+        chain = []
+        for i in range(length):
+            parent = Message.objects.create(
+                sender=self.user2 if i % 2 == 0 else self.user1,
+                receiver=self.user1 if i % 2 == 0 else self.user2,
+                content=f"Reply {i}",
+                parent_message=parent
+            )
+            chain.append(parent)
+        return chain
+
+    def test_loads_whole_thread_from_any_message(self):
+        """Starting from a deep reply still returns the root and every branch"""
+        chain = self.make_chain(self.root, 5)
+        branch = self.make_chain(chain[1], 2)
+        thread = load_thread(chain[-1].id)
+        self.assertEqual(thread.root, self.root)
+        self.assertEqual(len(thread), 8)
+        self.assertFalse(thread.truncated)
+        # Depth-first: each reply comes right after its parent's earlier replies
+        self.assertEqual(
+            [m.id for m in thread],
+            [self.root.id] + [m.id for m in chain[:2]] + [m.id for m in chain[2:]] + [m.id for m in branch]
+        )
+        self.assertEqual([m.thread_depth for m in thread], [0, 1, 2, 3, 4, 5, 3, 4])
+
+    def test_constant_query_count(self):
+        """Thread depth does not change the number of queries"""
+        shallow = self.make_chain(self.root, 3)
+        deep_root = Message.objects.create(sender=self.user1, receiver=self.user2, content="Deep")
+        deep = self.make_chain(deep_root, 30)
+        with self.assertNumQueries(1):
+            thread = load_thread(shallow[-1].id)
+            [m.sender.username for m in thread]
+        with self.assertNumQueries(1):
+            thread = load_thread(deep[-1].id)
+            [m.sender.username for m in thread]
+        self.assertEqual(len(thread), 31)
+
+    def test_size_cap_keeps_messages_nearest_root(self):
+        chain = self.make_chain(self.root, 10)
+        thread = load_thread(chain[-1].id, max_messages=4)
+        self.assertTrue(thread.truncated)
+        self.assertEqual([m.id for m in thread], [self.root.id] + [m.id for m in chain[:3]])
+
+    def test_depth_cap(self):
+        chain = self.make_chain(self.root, 10)
+        thread = load_thread(self.root.id, max_depth=3)
+        self.assertEqual([m.id for m in thread], [self.root.id] + [m.id for m in chain[:3]])
+
+    def test_view_renders_nested_thread(self):
+        chain = self.make_chain(self.root, 3)
+        self.client.login(username='user1', password='test123')
+        response = self.client.get(reverse('threaded_conversation', args=[chain[-1].id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['root_message'], self.root)
+        self.assertEqual(len(response.context['thread_messages']), 4)
+        self.assertContains(response, 'margin-left: 60px')
+
+
 class CustomManagerTests(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='user1', password='test123')
@@ -489,6 +831,326 @@ class CustomManagerTests(TestCase):
         self.assertTrue(len(connection.queries) > 0)
 
 
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='test123')
+        self.user2 = User.objects.create_user(username='user2', password='test123')
+
+    def send(self, count, receiver=None):
+        return [
+            Message.objects.create(sender=self.user1, receiver=receiver or self.user2, content=f"Message {i}")
+            for i in range(count)
+        ]
+
+    def counter(self, user):
+        return UnreadCounter.objects.get(user=user).count
+
+    def test_count_is_single_lookup(self):
+        self.send(3)
+        with self.assertNumQueries(1):
+            self.assertEqual(Message.unread.unread_count_for_user(self.user2), 3)
+
+    def test_maintained_on_create_read_and_delete(self):
+        first, second, third = self.send(3)
+        self.assertEqual(self.counter(self.user2), 3)
+        first.read = True
+        first.save()
+        self.assertEqual(self.counter(self.user2), 2)
+        first.save()  # no change in read state
+        self.assertEqual(self.counter(self.user2), 2)
+        second.delete()
+        first.delete()
+        self.assertEqual(self.counter(self.user2), 1)
+        third.receiver = self.user1
+        third.save()
+        self.assertEqual((self.counter(self.user1), self.counter(self.user2)), (1, 0))
+
+    def test_mark_as_read_uses_row_count(self):
+        messages = self.send(4)
+        with self.assertNumQueries(5):  # sender ids, UPDATE messages, UPDATE counter (plus the savepoint)
+            marked = Message.unread.mark_as_read(self.user2, [messages[0].id, messages[1].id])
+        self.assertEqual(marked, 2)
+        self.assertEqual(Message.unread.unread_count_for_user(self.user2), 2)
+
+    def test_mark_as_read_and_count_reads_counter(self):
+        messages = self.send(5)
+        UnreadCounter.objects.filter(user=self.user2).update(count=F('count') + 10)  # drifted, not recounted
+        # sender ids, UPDATE messages, UPDATE counter, SELECT counter (plus two savepoints)
+        with self.assertNumQueries(8):
+            unread = Message.unread.mark_as_read_and_count(self.user2, [messages[0].id, messages[1].id])
+        self.assertEqual(unread, 13)
+        self.assertEqual(Message.unread.mark_as_read_and_count(self.user2, [messages[0].id]), 13)
+
+    def test_save_without_read_in_update_fields_keeps_counter(self):
+        message = self.send(1)[0]
+        message.read = True
+        message.content = 'Edited'
+        message.save(update_fields=['content'])
+        self.assertEqual(self.counter(self.user2), 1)
+        message.save()
+        self.assertEqual(self.counter(self.user2), 0)
+
+    def test_send_many(self):
+        Message.objects.send_many([
+            Message(sender=self.user1, receiver=self.user2, content="one"),
+            Message(sender=self.user1, receiver=self.user2, content="two"),
+            Message(sender=self.user2, receiver=self.user1, content="three", read=True),
+        ])
+        self.assertEqual(Message.unread.unread_count_for_user(self.user2), 2)
+        self.assertEqual(Message.unread.unread_count_for_user(self.user1), 0)
+
+    def test_reconcile_corrects_drift(self):
+        self.send(3)
+        Message.objects.filter(receiver=self.user2).update(read=True)  # bypasses the counters
+        UnreadCounter.objects.filter(user=self.user1).delete()
+        out = StringIO()
+        call_command('reconcile_unread_counts', stdout=out)
+        self.assertIn("Corrected 2 unread counters", out.getvalue())
+        self.assertEqual((self.counter(self.user1), self.counter(self.user2)), (0, 0))
+        self.assertEqual(reconcile_unread_counts(), 0)
+
+
+class InboxSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='test123')
+        self.user2 = User.objects.create_user(username='user2', password='test123')
+        self.user3 = User.objects.create_user(username='user3', password='test123')
+        start = timezone.now() - timezone.timedelta(hours=1)
+        self.messages = []
+        for i, (sender, receiver, read) in enumerate([
+            (self.user1, self.user2, False),
+            (self.user2, self.user1, False),
+            (self.user2, self.user1, True),
+            (self.user1, self.user1, False),  # note to self
+            (self.user3, self.user1, False),
+            (self.user3, self.user2, False),  # not user1's
+        ]):
+            self.messages.append(Message.objects.create(
+                sender=sender, receiver=receiver, content=f"Message {i}", read=read,
+                timestamp=start + timezone.timedelta(minutes=i)
+            ))
+
+    def test_counts_match_naive_queries(self):
+        either = Q(sender=self.user1) | Q(receiver=self.user1)
+        with self.assertNumQueries(1):
+            counts = summary.message_counts(self.user1)
+        self.assertEqual(counts['total_count'], Message.objects.filter(either).count())
+        self.assertEqual(counts['unread_count'], Message.objects.filter(receiver=self.user1, read=False).count())
+
+    def test_unread_count_without_counter(self):
+        UnreadCounter.objects.all().delete()
+        self.assertEqual(summary.message_counts(self.user1)['unread_count'], 3)
+
+    def test_recent_messages_merges_both_sides(self):
+        recent = summary.recent_messages(self.user1, limit=4)
+        self.assertEqual([m.content for m in recent], ["Message 4", "Message 3", "Message 2", "Message 1"])
+        with self.assertNumQueries(0):
+            [(m.sender.username, m.receiver.username) for m in recent]
+
+    def test_summary_in_three_queries(self):
+        with self.assertNumQueries(3):
+            result = summary.inbox_summary(self.user1)
+        self.assertEqual(len(result['recent_messages']), 5)
+        self.assertEqual([m.content for m in result['unread_messages']], ["Message 4", "Message 3", "Message 1"])
+
+    def test_view(self):
+        self.client.login(username='user1', password='test123')
+        response = self.client.get(reverse('inbox_summary'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_count'], 5)
+        self.assertContains(response, "To user2:")
+
+
+class ConversationListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='test123')
+        self.user2 = User.objects.create_user(username='user2', password='test123')
+        self.user3 = User.objects.create_user(username='user3', password='test123')
+        self.start = timezone.now() - timezone.timedelta(hours=1)
+        self.roots = [
+            Message.objects.create(
+                sender=sender, receiver=receiver, content=f"Thread {i}",
+                timestamp=self.start + timezone.timedelta(minutes=i)
+            )
+            for i, (sender, receiver) in enumerate([
+                (self.user1, self.user2),
+                (self.user2, self.user1),
+                (self.user1, self.user1),
+                (self.user3, self.user1),
+                (self.user2, self.user3),  # not user1's
+            ])
+        ]
+
+    def reply(self, parent, minutes, content="Reply"):
+        return Message.objects.create(
+            sender=parent.receiver, receiver=parent.sender, content=content, parent_message=parent,
+            timestamp=self.start + timezone.timedelta(minutes=minutes)
+        )
+
+    def test_reply_updates_root_activity(self):
+        reply = self.reply(self.roots[0], 10)
+        self.reply(reply, 5)
+        self.roots[0].refresh_from_db()
+        self.assertEqual(self.roots[0].thread_reply_count, 2)
+        self.assertEqual(self.roots[0].last_activity_at, reply.timestamp)
+        self.assertEqual(self.roots[1].last_activity_at, self.roots[1].timestamp)
+
+    def test_deleting_reply_recounts_activity(self):
+        self.reply(self.roots[0], 5)
+        latest = self.reply(self.roots[0], 10)
+        latest.delete()
+        self.roots[0].refresh_from_db()
+        self.assertEqual(self.roots[0].thread_reply_count, 1)
+        self.assertEqual(self.roots[0].last_activity_at, self.start + timezone.timedelta(minutes=5))
+
+    def test_send_many_updates_root_activity(self):
+        Message.objects.send_many([
+            Message(sender=self.user2, receiver=self.user1, content="Bulk", parent_message=self.roots[0],
+                    timestamp=self.start + timezone.timedelta(minutes=m))
+            for m in (7, 9)
+        ] + [Message(sender=self.user1, receiver=self.user2, content="New thread")])
+        self.roots[0].refresh_from_db()
+        self.assertEqual(self.roots[0].thread_reply_count, 2)
+        self.assertEqual(self.roots[0].last_activity_at, self.start + timezone.timedelta(minutes=9))
+        new_root = Message.objects.get(content="New thread")
+        self.assertEqual(new_root.last_activity_at, new_root.timestamp)
+
+    def test_ordered_by_activity_with_latest_replies(self):
+        self.reply(self.roots[0], 10, "Old")
+        self.reply(self.roots[0], 11, "Newer")
+        self.reply(self.roots[0], 12, "Newest")
+        with self.assertNumQueries(2):
+            page = get_user_conversations(self.user1, latest_replies=2)
+            replies = [[reply.content for reply in message.latest_replies] for message in page]
+        self.assertEqual([m.content for m in page], ["Thread 0", "Thread 3", "Thread 2", "Thread 1"])
+        self.assertEqual(replies, [["Newest", "Newer"], [], [], []])
+        self.assertIsNone(page.next_cursor)
+
+    def test_keyset_paging_visits_every_thread_once(self):
+        for i in range(3):
+            self.reply(self.roots[1], 20)  # ties on last_activity_at are broken by id
+        tied = Message.objects.create(sender=self.user1, receiver=self.user3, content="Tied",
+                                      timestamp=self.start + timezone.timedelta(minutes=20))
+        expected = list(
+            Message.objects.filter(Q(sender=self.user1) | Q(receiver=self.user1), parent_message__isnull=True)
+            .order_by('-last_activity_at', '-id').values_list('id', flat=True)
+        )
+        self.assertIn(tied.id, expected)
+        seen, cursor = [], None
+        while True:
+            page = get_user_conversations(self.user1, cursor=cursor, page_size=2)
+            seen.extend(m.id for m in page)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_bulk_created_root_is_listed_and_paged(self):
+        root, = Message.objects.bulk_create([Message(
+            sender=self.user1, receiver=self.user2, content="Bulk thread",
+            timestamp=self.start + timezone.timedelta(minutes=30),
+        )])
+        self.assertEqual(root.last_activity_at, root.timestamp)
+        self.client.login(username='user1', password='test123')
+        first = self.client.get(reverse('conversations')).json()
+        self.assertEqual(first['conversations'][0]['content'], "Bulk thread")
+        cursor = encode_cursor(root)
+        with patch.object(user_cache, 'get_or_build', wraps=user_cache.get_or_build) as get_or_build:
+            response = self.client.get(reverse('conversations'), {'cursor': cursor})
+        self.assertEqual(len(response.json()['conversations']), 4)
+        # The cache key holds the decoded position, not the client's string
+        self.assertNotIn(cursor, get_or_build.call_args.args)
+
+    def test_view(self):
+        self.client.login(username='user1', password='test123')
+        response = self.client.get(reverse('conversations'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['conversations']), 4)
+        response = self.client.get(reverse('conversations'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user_cache.reset_stats()
+        self.user1 = User.objects.create_user(username='user1', password='test123')
+        self.user2 = User.objects.create_user(username='user2', password='test123')
+        Message.objects.create(sender=self.user2, receiver=self.user1, content="First message")
+        self.client.login(username='user1', password='test123')
+
+    def inbox_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('inbox'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_second_request_served_from_cache(self):
+        _, first = self.inbox_queries()
+        _, second = self.inbox_queries()
+        self.assertEqual(first - second, 4)  # received, sent, notifications and unread count
+        self.assertEqual(user_cache.cache_stats()['hits'], 1)
+
+    def test_new_message_shows_immediately(self):
+        self.inbox_queries()
+        Message.objects.create(sender=self.user2, receiver=self.user1, content="Second message")
+        response, _ = self.inbox_queries()
+        self.assertContains(response, "Second message")
+
+    def test_other_users_cache_untouched(self):
+        user3 = User.objects.create_user(username='user3', password='test123')
+        generation = user_cache.get_generation(self.user1.pk)
+        Message.objects.create(sender=user3, receiver=self.user2, content="Not for user1")
+        self.assertEqual(user_cache.get_generation(self.user1.pk), generation)
+        self.assertNotEqual(user_cache.get_generation(user3.pk), None)
+
+    def test_entry_cached_before_commit_is_expired_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            Message.objects.create(sender=self.user2, receiver=self.user1, content="Second message")
+            # Another request caching the rows as they were before the commit
+            user_cache.get_or_build(self.user1, 'inbox', lambda: 'before commit')
+        self.assertEqual(user_cache.get_or_build(self.user1, 'inbox', lambda: 'after commit'), 'after commit')
+
+    def test_mark_as_read_expires_unread_page(self):
+        self.client.get(reverse('unread_inbox'))
+        response = self.client.get(reverse('unread_inbox'))
+        self.assertContains(response, "First message")
+        Message.unread.mark_as_read(self.user1)
+        response = self.client.get(reverse('unread_inbox'))
+        self.assertNotContains(response, "First message")
+        self.assertEqual(response.context['unread_count'], 0)
+
+    def test_edit_expires_thread(self):
+        message = Message.objects.get()
+        self.client.get(reverse('threaded_conversation', args=[message.id]))
+        Message.objects.filter(pk=message.pk).edit("Edited message")
+        response = self.client.get(reverse('threaded_conversation', args=[message.id]))
+        self.assertContains(response, "Edited message")
+
+    @override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+            'inbox': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'inbox'},
+        },
+        MESSAGING_CACHE_ALIAS='inbox',
+    )
+    def test_cache_alias(self):
+        self.inbox_queries()
+        self.assertIsNone(caches['default'].get(user_cache.generation_key(self.user1.pk)))
+        self.assertIsNotNone(caches['inbox'].get(user_cache.generation_key(self.user1.pk)))
+
+    def test_stats_view(self):
+        self.inbox_queries()
+        self.inbox_queries()
+        Message.objects.create(sender=self.user2, receiver=self.user1, content="Another")
+        stats = self.client.get(reverse('cache_stats')).json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertGreaterEqual(stats['invalidations'], 2)
+
+
 class CacheTests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='test123')
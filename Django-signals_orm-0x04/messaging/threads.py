@@ -0,0 +1,85 @@
+from collections import deque
+
+from django.db.models import Subquery
+
+from .models import Message
+
+THREAD_MAX_DEPTH = 50
+THREAD_MAX_MESSAGES = 500
+
+
+class Thread:
+    """A loaded thread: its root and its messages in display order"""
+
+    def __init__(self, root, messages, truncated):
+        self.root = root
+        self.messages = messages
+        self.truncated = truncated
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+
+def build_thread(messages, max_messages=THREAD_MAX_MESSAGES):
+    """
+    Assemble a tree from a flat list of thread messages in O(n).
+
+    Each message gets thread_replies (children by timestamp) and
+    thread_depth. Returns a Thread whose messages are in depth-first display
+    order, cut to the max_messages nearest the root.
+    """
+    by_id = {message.id: message for message in messages}
+    root = None
+    for message in messages:
+        message.thread_replies = []
+    for message in sorted(messages, key=lambda m: (m.timestamp, m.id)):
+        parent = by_id.get(message.parent_message_id)
+        if parent is None:
+            root = message
+        else:
+            parent.thread_replies.append(message)
+    if root is None:
+        return Thread(None, [], False)
+
+    # Breadth-first to apply the size cap by distance from the root
+    kept = set()
+    root.thread_depth = 0
+    queue = deque([root])
+    while queue and len(kept) < max_messages:
+        message = queue.popleft()
+        kept.add(message.id)
+        for reply in message.thread_replies:
+            reply.thread_depth = message.thread_depth + 1
+            queue.append(reply)
+    truncated = len(kept) < len(messages)
+    if truncated:
+        for message in messages:
+            message.thread_replies = [reply for reply in message.thread_replies if reply.id in kept]
+
+    # Depth-first display order
+    ordered = []
+    stack = [root]
+    while stack:
+        message = stack.pop()
+        ordered.append(message)
+        stack.extend(reversed(message.thread_replies))
+    return Thread(root, ordered, truncated)
+
+
+def load_thread(message_id, max_depth=THREAD_MAX_DEPTH, max_messages=THREAD_MAX_MESSAGES):
+    """
+    Load the whole thread containing message_id (ancestors and all replies)
+    with one query on the thread_root/path index, sender and receiver included.
+    Messages deeper than max_depth below the root are left out, and only the
+    max_messages nearest the root are kept.
+    """
+    root_id = Message.objects.filter(pk=message_id).values('thread_root_id')
+    messages = list(
+        Message.objects.filter(thread_root_id=Subquery(root_id), depth__lte=max_depth)
+        .select_related('sender', 'receiver')
+        .order_by('depth', 'path')[:max_messages + 1]
+    )
+    return build_thread(messages, max_messages)
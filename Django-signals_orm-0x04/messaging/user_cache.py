@@ -0,0 +1,132 @@
+"""
+Per-user caching of inbox data.
+
+Every user has a generation counter that is part of all their cache keys.
+Any change to a message or notification involving the user bumps the
+counter, which orphans everything cached for them at once; orphaned
+entries simply expire. Changes made in a transaction bump the counter
+again once it commits, so whatever another request cached from the
+pre-commit rows in between is orphaned too. Entries can therefore live
+long (an idle user's inbox stays cached) without ever being stale.
+
+MESSAGING_CACHE_ALIAS picks the cache from CACHES (use a shared backend
+such as Redis or Memcached when running several workers) and
+MESSAGING_CACHE_TIMEOUT the lifetime of cached data.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .commit_batches import CommitBatch
+
+DEFAULT_CACHE_TIMEOUT = 60 * 60
+
+# Per-process counters: hits, misses and invalidations
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def get_cache():
+    return caches[getattr(settings, 'MESSAGING_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'MESSAGING_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT)
+
+
+def generation_key(user_id):
+    return f"messaging:generation:{user_id}"
+
+
+def get_generation(user_id):
+    cache = get_cache()
+    key = generation_key(user_id)
+    generation = cache.get(key)
+    if generation is None:
+        # Seeded from the clock, so an evicted counter never comes back at a
+        # value whose keys might still be cached
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def _bump_generations(user_ids):
+    cache = get_cache()
+    for user_id in user_ids:
+        try:
+            cache.incr(generation_key(user_id))
+        except ValueError:
+            # No generation yet, so nothing is cached for this user
+            pass
+        _count('invalidations')
+
+
+class _PendingInvalidation(CommitBatch):
+    """Users whose generations are bumped again once a transaction commits"""
+
+    def __init__(self, using):
+        super().__init__(using)
+        self.user_ids = set()
+
+    def run(self):
+        _bump_generations(self.user_ids)
+
+
+def invalidate_users(*user_ids, using=DEFAULT_DB_ALIAS):
+    """
+    Bump the generation of every given user (None ids are ignored), now and,
+    inside a transaction on the using database, again once it commits
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    _bump_generations(user_ids)
+    if transaction.get_connection(using).in_atomic_block:
+        _PendingInvalidation.pending(using).user_ids.update(user_ids)
+
+
+def cache_key(user_id, name, *parts):
+    return ':'.join(['messaging', name, str(user_id), str(get_generation(user_id)), *map(str, parts)])
+
+
+def get_or_build(user, name, build, *parts):
+    """
+    Return the cached value for (user, name, *parts) in the user's current
+    generation, calling build() and caching its result on a miss
+    """
+    cache = get_cache()
+    key = cache_key(user.pk, name, *parts)
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+    value = build()
+    cache.set(key, value, get_timeout())
+    return value
+
+
+def cache_stats():
+    with _stats_lock:
+        hits, misses, invalidations = _stats['hits'], _stats['misses'], _stats['invalidations']
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'invalidations': invalidations,
+        'hit_rate': hits / lookups if lookups else 0.0,
+    }
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
@@ -4,11 +4,14 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib import messages
-from django.db.models import Prefetch, Q, Count, Max, Case, When
-from django.db import models
-from django.views.decorators.cache import cache_page
+from django.db.models import Q
 from django.core.cache import cache
+from django.http import JsonResponse
+from django.views.decorators.cache import never_cache
+from . import summary, user_cache
+from .conversations import decode_cursor, get_user_conversations
 from .models import Message, Notification, MessageHistory
+from .threads import load_thread
 
 def user_login(request):
     if request.method == 'POST':
@@ -47,18 +50,18 @@ def temp_inbox(request):
         })
 
 @login_required
-@cache_page(60)
+@never_cache
 def inbox(request):
     """Proper inbox view that requires login"""
-    received_messages = Message.objects.filter(receiver=request.user)
-    sent_messages = Message.objects.filter(sender=request.user)
-    notifications = Notification.objects.filter(user=request.user)
+    def build():
+        return {
+            'received_messages': list(Message.objects.filter(receiver=request.user).select_related('sender')),
+            'sent_messages': list(Message.objects.filter(sender=request.user).select_related('receiver')),
+            'notifications': list(Notification.objects.filter(user=request.user).select_related('message')),
+            'unread_count': Message.unread.unread_count_for_user(request.user),
+        }
     
-    return render(request, 'messaging/inbox.html', {
-        'received_messages': received_messages,
-        'sent_messages': sent_messages,
-        'notifications': notifications
-    })
+    return render(request, 'messaging/inbox.html', user_cache.get_or_build(request.user, 'inbox', build))
 
 @login_required
 def send_message(request):
@@ -120,7 +123,7 @@ def delete_user(request):
     return render(request, 'messaging/delete_account.html')
 
 @login_required
-@cache_page(60)
+@never_cache
 def threaded_conversation(request, message_id=None):
     """Display a threaded conversation starting from a specific message"""
     if message_id:
@@ -138,20 +141,15 @@ def threaded_conversation(request, message_id=None):
             })
         root_message = latest_message
     
-    current = root_message
-    while current.parent_message:
-        current = current.parent_message
-    root_message = current
-    
-    thread_messages = Message.objects.filter(
-        Q(parent_message=root_message) | Q(id=root_message.id)
-    ).select_related('sender', 'receiver', 'parent_message').prefetch_related(
-        Prefetch('replies', queryset=Message.objects.select_related('sender', 'receiver').order_by('timestamp'))
-    ).order_by('timestamp')
+    # Ancestors and every reply below the root in one indexed query
+    thread = user_cache.get_or_build(
+        request.user, 'thread', lambda: load_thread(root_message.id), root_message.thread_root_id
+    )
     
     return render(request, 'messaging/threaded_conversation.html', {
-        'root_message': root_message,
-        'thread_messages': thread_messages,
+        'root_message': thread.root,
+        'thread_messages': thread.messages,
+        'truncated': thread.truncated,
     })
 
 @login_required
@@ -177,42 +175,57 @@ def reply_to_message(request, message_id):
         'parent_message': parent_message,
     })
 
-def get_user_conversations(user):
-    """Custom ORM method to get all conversations for a user with optimized queries"""
-    conversations = Message.objects.filter(
-        Q(sender=user) | Q(receiver=user),
-        parent_message__isnull=True
-    ).select_related('sender', 'receiver').prefetch_related(
-        Prefetch('replies', queryset=Message.objects.select_related('sender', 'receiver'))
-    ).annotate(
-        reply_count=Count('replies'),
-        last_activity=Max(
-            Case(
-                When(replies__isnull=False, then=models.F('replies__timestamp')),
-                default=models.F('timestamp'),
-                output_field=models.DateTimeField()
-            )
-        )
-    ).order_by('-last_activity')
+@login_required
+@never_cache
+def conversations(request):
+    """A page of the user's conversations as JSON, most recently active first"""
+    cursor = request.GET.get('cursor') or None
     
-    return conversations
+    def build():
+        page = get_user_conversations(request.user, cursor=cursor)
+        return {
+            'conversations': [{
+                'id': message.id,
+                'sender': message.sender.username if message.sender else None,
+                'receiver': message.receiver.username if message.receiver else None,
+                'content': message.content,
+                'reply_count': message.thread_reply_count,
+                'last_activity': message.last_activity_at.isoformat(),
+                'latest_replies': [{
+                    'id': reply.id,
+                    'sender': reply.sender.username if reply.sender else None,
+                    'content': reply.content,
+                    'timestamp': reply.timestamp.isoformat(),
+                } for reply in message.latest_replies],
+            } for message in page],
+            'next_cursor': page.next_cursor,
+        }
+    
+    try:
+        position = decode_cursor(cursor) if cursor is not None else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    # Keyed by the decoded position, never by the raw client-supplied string
+    parts = () if position is None else (position[0].isoformat(), position[1])
+    return JsonResponse(user_cache.get_or_build(request.user, 'conversations', build, *parts))
 
 @login_required
-@cache_page(60)
+@never_cache
 def unread_inbox(request):
     """Display only unread messages using the custom manager"""
-    unread_messages = Message.unread.unread_for_user(request.user)
-    
-    unread_messages = unread_messages.select_related('sender').only(
-        'id', 'content', 'timestamp', 'sender__username', 'edited'
-    ).order_by('-timestamp')
-    
-    unread_count = Message.unread.unread_count_for_user(request.user)
+    def build():
+        unread_messages = list(Message.unread.unread_for_user(request.user).select_related('sender').only(
+            'id', 'content', 'timestamp', 'sender__username', 'edited'
+        ).order_by('-timestamp'))
+        return {
+            'unread_messages': unread_messages,
+            'unread_count': len(unread_messages),
+        }
     
-    return render(request, 'messaging/unread_inbox.html', {
-        'unread_messages': unread_messages,
-        'unread_count': unread_count,
-    })
+    context = dict(user_cache.get_or_build(request.user, 'unread', build))
+    context['cache_generation'] = user_cache.get_generation(request.user.pk)
+    context['cache_timeout'] = user_cache.get_timeout()
+    return render(request, 'messaging/unread_inbox.html', context)
 
 @login_required
 def mark_as_read(request, message_id=None):
@@ -227,30 +240,12 @@ def mark_as_read(request, message_id=None):
     return redirect('unread_inbox')
 
 @login_required
-@cache_page(60)
+@never_cache
 def inbox_summary(request):
     """Display inbox summary with optimized queries"""
-    unread_messages = Message.unread.unread_for_user(request.user).select_related(
-        'sender'
-    ).only('id', 'content', 'timestamp', 'sender__username').order_by('-timestamp')[:5]
-    
-    recent_messages = Message.objects.filter(
-        Q(sender=request.user) | Q(receiver=request.user)
-    ).select_related('sender', 'receiver').only(
-        'id', 'content', 'timestamp', 'sender__username', 'receiver__username', 'read'
-    ).order_by('-timestamp')[:10]
-    
-    unread_count = Message.unread.unread_count_for_user(request.user)
-    total_count = Message.objects.filter(
-        Q(sender=request.user) | Q(receiver=request.user)
-    ).count()
-    
-    return render(request, 'messaging/inbox_summary.html', {
-        'unread_messages': unread_messages,
-        'recent_messages': recent_messages,
-        'unread_count': unread_count,
-        'total_count': total_count,
-    })
+    return render(request, 'messaging/inbox_summary.html', user_cache.get_or_build(
+        request.user, 'summary', lambda: summary.inbox_summary(request.user)
+    ))
 
 @login_required
 def cache_test(request):
@@ -277,6 +272,11 @@ def cache_test(request):
         'cache_key': cache_key,
     })
 
+@login_required
+def cache_stats(request):
+    """Hit rate and invalidation counts of the per-user inbox cache (this process)"""
+    return JsonResponse(user_cache.cache_stats())
+
 def clear_cache_test(request):
     """Clear the cache for testing"""
     cache_key = f'user_{request.user.id}_message_count'
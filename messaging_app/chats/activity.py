@@ -0,0 +1,59 @@
+from collections import defaultdict
+
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Substr
+
+from .models import PREVIEW_LENGTH, Conversation, Message
+
+
+def preview(body):
+    return (body or '')[:PREVIEW_LENGTH]
+
+
+def record_messages(messages):
+    """
+    Fold newly inserted messages into their conversations' activity fields:
+    one UPDATE per conversation that bumps message_count and moves
+    last_message_at/preview forward only if a message is newer
+    """
+    by_conversation = defaultdict(list)
+    for message in messages:
+        by_conversation[message.conversation_id].append(message)
+    for conversation_id, batch in by_conversation.items():
+        latest = max(batch, key=lambda message: message.sent_at)
+        is_newer = Q(last_message_at__lte=latest.sent_at)
+        Conversation.objects.filter(pk=conversation_id).update(
+            message_count=F('message_count') + len(batch),
+            last_message_at=Case(When(is_newer, then=Value(latest.sent_at)), default=F('last_message_at')),
+            last_message_preview=Case(
+                When(is_newer, then=Value(preview(latest.message_body))),
+                default=F('last_message_preview'),
+            ),
+        )
+
+
+def record_edit(message):
+    # Only the latest message's preview is shown
+    Conversation.objects.filter(pk=message.conversation_id, last_message_at=message.sent_at).update(
+        last_message_preview=preview(message.message_body),
+    )
+
+
+def refresh_activity(conversations):
+    """
+    Recompute activity fields from the messages table for a Conversation
+    queryset, in a single UPDATE. Used after deletes and for backfills.
+    A conversation without messages goes back to its creation time.
+    """
+    messages = Message.objects.filter(conversation=OuterRef('pk')).order_by()
+    latest = messages.order_by('-sent_at', '-message_id')
+    return conversations.update(
+        message_count=Coalesce(
+            Subquery(messages.values('conversation').annotate(count=Count('*')).values('count')), 0,
+        ),
+        last_message_at=Coalesce(Subquery(latest.values('sent_at')[:1]), F('created_at')),
+        last_message_preview=Coalesce(
+            Subquery(latest.annotate(preview=Substr('message_body', 1, PREVIEW_LENGTH)).values('preview')[:1]),
+            Value(''),
+        ),
+    )
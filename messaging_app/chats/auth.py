@@ -1,26 +1,139 @@
-﻿from django.contrib.auth import get_user_model
+﻿from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import router
+from django.utils.crypto import constant_time_compare, salted_hmac
 
 User = get_user_model()
 
-class CustomUserBackend(object):
-    def authenticate(self, request, username=None, password=None):
+DEFAULT_USER_CACHE_TIMEOUT = 60
+DEFAULT_CREDENTIAL_CACHE_TIMEOUT = 60
+
+
+def user_cache_key(user_id):
+    return f"chats:auth_user:{user_id}"
+
+
+def credential_cache_key(username, password):
+    # Keyed with SECRET_KEY, so the cache never holds anything that can be
+    # checked against a guessed password without the key
+    digest = salted_hmac('chats.auth.credentials', f"{username}\0{password}", algorithm='sha256').hexdigest()
+    return f"chats:auth_credentials:{digest}"
+
+
+def password_fingerprint(user):
+    # Changes whenever the password hash does, so a cached login dies with it
+    fingerprint = getattr(user, '_password_fingerprint', None)
+    if fingerprint is not None:
+        return fingerprint
+    return salted_hmac('chats.auth.password', user.password, algorithm='sha256').hexdigest()
+
+
+def user_snapshot(user):
+    """
+    What get_user() caches: every field except the password hash, plus the
+    session hash and password fingerprint derived from it
+    """
+    fields = {
+        field.attname: getattr(user, field.attname)
+        for field in User._meta.concrete_fields if field.attname != 'password'
+    }
+    return fields, user.get_session_auth_hash(), password_fingerprint(user)
+
+
+def user_from_snapshot(snapshot):
+    fields, session_hash, fingerprint = snapshot
+    # The password stays a deferred field: loaded from the database only if
+    # something reads it, and left alone by save()
+    user = User.from_db(router.db_for_read(User), list(fields), list(fields.values()))
+    user.get_session_auth_hash = lambda: session_hash
+    user._password_fingerprint = fingerprint
+    return user
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def is_basic_auth(request):
+    header = getattr(request, 'META', {}).get('HTTP_AUTHORIZATION', '')
+    return header[:6].lower() == 'basic '
+
+
+class CustomUserBackend(ModelBackend):
+    """
+    Username/password backend with two short-lived caches:
+
+    * get_user() results, so session-authenticated requests skip the user
+      query. Only a snapshot without the password hash is cached. It is
+      invalidated when the user is saved or deleted; writes through
+      QuerySet.update() send no signal and show up once the entry expires
+      (CHATS_USER_CACHE_TIMEOUT, 60 s) unless invalidate_cached_user() is
+      called.
+    * successful Basic-auth verifications, keyed by an HMAC of the
+      credentials, so scripts repeating the same credentials skip the
+      password hasher until the entry expires or the password changes
+
+    Permissions come from ModelBackend, so it is the only backend needed: a
+    failed login runs the password hasher once, not once per backend.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        cache_credentials = is_basic_auth(request)
+        if cache_credentials:
+            key = credential_cache_key(username, password)
+            cached = cache.get(key)
+            if cached is not None:
+                user_id, fingerprint = cached
+                user = self.get_user(user_id)
+                if (
+                    user is not None
+                    and user.get_username() == username
+                    and constant_time_compare(password_fingerprint(user), fingerprint)
+                    and self.user_can_authenticate(user)
+                ):
+                    return user
+                cache.delete(key)
+
         try:
-            user = User.objects.get(username=username)
+            user = User._default_manager.get_by_natural_key(username)
         except User.DoesNotExist:
+            # Hash anyway, so unknown usernames take as long as wrong passwords
+            User().set_password(password)
             return None
 
         if user.check_password(password) and self.user_can_authenticate(user):
+            if cache_credentials:
+                timeout = getattr(settings, 'CHATS_CREDENTIAL_CACHE_TIMEOUT', DEFAULT_CREDENTIAL_CACHE_TIMEOUT)
+                cache.set(key, (user.pk, password_fingerprint(user)), timeout)
             return user
         return None
 
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
-        
+        """
+        The user for a session, or None if they no longer exist or may not
+        authenticate (e.g. deactivated), cached or not
+        """
+        key = user_cache_key(user_id)
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            user = user_from_snapshot(snapshot)
+        else:
+            try:
+                user = User._default_manager.get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            cache.set(key, user_snapshot(user), getattr(settings, 'CHATS_USER_CACHE_TIMEOUT', DEFAULT_USER_CACHE_TIMEOUT))
+        return user if self.user_can_authenticate(user) else None
+
     def user_can_authenticate(self, user):
         """
         Reject users with is_active=False. Custom checks can be added here.
         """
-        return user.is_active
\ No newline at end of file
+        return user.is_active
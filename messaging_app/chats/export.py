@@ -0,0 +1,167 @@
+"""
+Streaming export of a user's messages as JSON Lines or CSV.
+
+Rows are fetched in keyset chunks: each query reads the next chunk_size
+rows after the last (conversation_id, sent_at, message_id) seen, from the
+index on those three columns. Only one chunk of rows is ever in memory, on
+every backend. QuerySet.iterator() would not give that everywhere: only
+PostgreSQL and Oracle stream its rows through a server-side cursor, while
+mysqlclient buffers the whole result on the client. Every chunk is encoded
+into a single bytes object, so memory use depends on the chunk size, not on
+how many messages the user has.
+"""
+import csv
+import io
+import json
+import uuid
+import zlib
+
+from django.db.models import CharField, Q, Subquery
+from django.db.models.functions import Cast
+
+from .models import Conversation, Message
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ('message_id', 'conversation_id', 'sender_id', 'sender_username', 'message_body', 'sent_at')
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# One encoder for every row: json.dumps() builds a new one per call when
+# given options
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def export_queryset(user, conversation_id=None):
+    """
+    Rows of every message in the user's conversations, in the order of the
+    (conversation, sent_at) index. The sender is joined in the same query.
+    Ids are read as text: building a UUID object per value costs more than
+    the rest of the export.
+    """
+    conversations = Conversation.participants.through.objects.filter(user_id=user.pk).values('conversation_id')
+    queryset = Message.objects.filter(conversation_id__in=Subquery(conversations))
+    if conversation_id is not None:
+        queryset = queryset.filter(conversation_id=conversation_id)
+    return queryset.order_by('conversation_id', 'sent_at', 'message_id').values_list(
+        Cast('message_id', CharField()), Cast('conversation_id', CharField()), Cast('sender_id', CharField()),
+        'sender__username', 'message_body', 'sent_at',
+    )
+
+
+def uuid_text(value):
+    """Canonical form of a UUID read as text: hex on SQLite and MySQL, already dashed on PostgreSQL"""
+    if len(value) == 36:
+        return value
+    return f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
+
+
+def _jsonl_chunk(rows):
+    encode = _json_encoder.encode
+    lines = [
+        encode({
+            'message_id': uuid_text(message_id),
+            'conversation_id': uuid_text(conversation_id),
+            'sender_id': uuid_text(sender_id),
+            'sender_username': username,
+            'message_body': body,
+            'sent_at': sent_at.isoformat(),
+        })
+        for message_id, conversation_id, sender_id, username, body, sent_at in rows
+    ]
+    lines.append('')
+    return '\n'.join(lines).encode()
+
+
+def _csv_encoder():
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(rows):
+        writer.writerows(
+            (uuid_text(message_id), uuid_text(conversation_id), uuid_text(sender_id), username, body, sent_at.isoformat())
+            for message_id, conversation_id, sender_id, username, body, sent_at in rows
+        )
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    return encode
+
+
+def _csv_header():
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_FIELDS)
+    return buffer.getvalue().encode()
+
+
+def iter_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Rows of queryset (from export_queryset) as lists of up to chunk_size
+    rows. The rows after the last (conversation_id, sent_at, message_id)
+    seen are read as three index ranges, in order and only while the chunk
+    is not full: the same conversation and sent_at, the rest of the
+    conversation, then the following conversations. Unlike one OR of the
+    three, every query starts right at the last key, however many messages
+    share a sent_at.
+    """
+    rows = list(queryset[:chunk_size])
+    while rows:
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        message_id, conversation_id, _, _, _, sent_at = rows[-1]
+        message_id, conversation_id = uuid.UUID(message_id), uuid.UUID(conversation_id)
+        rows = []
+        for after in (
+            Q(conversation_id=conversation_id, sent_at=sent_at, message_id__gt=message_id),
+            Q(conversation_id=conversation_id, sent_at__gt=sent_at),
+            Q(conversation_id__gt=conversation_id),
+        ):
+            rows += queryset.filter(after)[:chunk_size - len(rows)]
+            if len(rows) == chunk_size:
+                break
+
+
+def _encode_chunks(chunks, encode, header):
+    if header:
+        yield header
+    for chunk in chunks:
+        yield encode(chunk)
+
+
+def iter_export(queryset, export_format='jsonl', chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    The export of queryset (from export_queryset) as an iterator of bytes,
+    one chunk of rows each. Raises ValueError for an unknown format.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == 'csv':
+        encode, header = _csv_encoder(), _csv_header()
+    else:
+        encode, header = _jsonl_chunk, b''
+    return _encode_chunks(iter_chunks(queryset, chunk_size), encode, header)
+
+
+def gzip_stream(chunks, level=6):
+    """Compress a stream of bytes into one gzip member, without buffering it"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_messages(user, export_format='jsonl', compress=False, conversation_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """The user's messages as a stream of bytes, gzip-compressed if compress is set"""
+    chunks = iter_export(export_queryset(user, conversation_id), export_format, chunk_size)
+    return gzip_stream(chunks) if compress else chunks
+
+
+def export_filename(export_format, compress=False):
+    return f"messages.{export_format}" + ('.gz' if compress else '')
@@ -1,4 +1,6 @@
-﻿import django_filters
+﻿from datetime import timedelta
+
+import django_filters
 from django.utils import timezone
 from .models import Message, Conversation
 
@@ -55,8 +57,13 @@ class MessageFilter(django_filters.FilterSet):
     def filter_today(self, queryset, name, value):
         """
         Custom filter for today's messages
+
+        Uses a [midnight, next midnight) range rather than sent_at__date so
+        the database can use the sent_at indexes instead of evaluating a
+        date cast on every row
         """
         if value:
-            today = timezone.now().date()
-            return queryset.filter(sent_at__date=today)
+            start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+            end = start + timedelta(days=1)
+            return queryset.filter(sent_at__gte=start, sent_at__lt=end)
         return queryset
\ No newline at end of file
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chats.activity import refresh_activity
+from chats.models import Conversation
+
+
+class Command(BaseCommand):
+    help = "Recompute last_message_at, last_message_preview and message_count for existing conversations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        total = 0
+        last_pk = None
+        while True:
+            # Walk conversations by primary key so each batch is an index range
+            batch = Conversation.objects.order_by('pk')
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            pks = list(batch.values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            # One short transaction per batch keeps row locks brief
+            with transaction.atomic():
+                refresh_activity(Conversation.objects.filter(pk__in=pks))
+            total += len(pks)
+            last_pk = pks[-1]
+            self.stdout.write(f"{total} conversations updated")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {total} conversations in {time.perf_counter() - start:.1f} s"))
@@ -0,0 +1,56 @@
+import base64
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from chats.models import User
+
+
+MODEL_BACKEND = ['django.contrib.auth.backends.ModelBackend']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Requests/sec on an authenticated endpoint with Basic and session auth, with and without the cached backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--path', default='/api/conversations/activity/')
+
+    def handle(self, *args, **options):
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        password = 'bench-pass-123'
+        User.objects.create_user(username='auth-bench', email='auth-bench@example.com', password=password)
+        token = base64.b64encode(f'auth-bench:{password}'.encode()).decode()
+
+        for label, backends in (('ModelBackend', MODEL_BACKEND), ('CustomUserBackend', None)):
+            overrides = {'AUTHENTICATION_BACKENDS': backends} if backends else {}
+            with override_settings(**overrides):
+                cache.clear()
+                basic = APIClient(HTTP_AUTHORIZATION=f'Basic {token}')
+                session = APIClient()
+                session.login(username='auth-bench', password=password)
+                for scheme, client in (('basic', basic), ('session', session)):
+                    rate = self.requests_per_second(client, options)
+                    self.stdout.write(f"{label:<18} {scheme:<8} {rate:8.0f} req/s")
+
+    def requests_per_second(self, client, options):
+        start = time.perf_counter()
+        for _ in range(options['requests']):
+            response = client.get(options['path'])
+            assert response.status_code == 200, response.status_code
+        return options['requests'] / (time.perf_counter() - start)
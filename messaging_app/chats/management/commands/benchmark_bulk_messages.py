@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from chats.models import Conversation, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare message creation throughput: single POSTs against the bulk endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--conversations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            # Requests go through the full middleware, auth and permission stack
+            with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        user = User.objects.create_user(username='bulk-bench', email='bulk-bench@example.com', password='bench-pass')
+        conversations = Conversation.objects.bulk_create([Conversation() for _ in range(options['conversations'])])
+        for conversation in conversations:
+            conversation.participants.add(user)
+        client = APIClient()
+        client.force_authenticate(user)
+        payload = [
+            {'conversation': str(conversations[i % len(conversations)].pk), 'message_body': f'Benchmark message {i}'}
+            for i in range(options['messages'])
+        ]
+
+        start = time.perf_counter()
+        for item in payload:
+            response = client.post('/api/messages/', item, format='json')
+            assert response.status_code == 201, response.content
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for offset in range(0, len(payload), options['batch_size']):
+            response = client.post('/api/messages/bulk/', payload[offset:offset + options['batch_size']], format='json')
+            assert response.status_code == 201, response.content
+        bulk = time.perf_counter() - start
+
+        count = len(payload)
+        self.stdout.write(f"single POST: {count / single:8.0f} messages/s ({single * 1000 / count:.2f} ms each)")
+        self.stdout.write(
+            f"bulk POST:   {count / bulk:8.0f} messages/s (batches of {options['batch_size']}, "
+            f"{bulk * 1000 / count:.3f} ms per message)"
+        )
+        self.stdout.write(f"speed-up:    {single / bulk:.1f}x")
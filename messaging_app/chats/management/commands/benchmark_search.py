@@ -0,0 +1,112 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from chats.models import Conversation, Message, User
+from chats.search import InvertedIndexBackend, get_search_backend, tokenize
+
+
+SEED_PREFIX = 'search-bench-'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare message search latency: LIKE '%term%' against the full-text backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--words', type=int, default=20, help='Words per message')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-like', action='store_true', help="Don't time the LIKE scan")
+        parser.add_argument(
+            '--commit', action='store_true',
+            help='Commit the seeded rows (MySQL only indexes committed rows for FULLTEXT); '
+                 'they are rolled back by default',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                if not options['commit']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Seeded rows rolled back')
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        vocabulary = self.seed(rng, options)
+        # Common, mid-frequency and rare words, plus a prefix and a two-word query
+        ranked = sorted(vocabulary, key=vocabulary.get, reverse=True)
+        queries = [ranked[0], ranked[len(ranked) // 10], ranked[-1], ranked[len(ranked) // 2][:3],
+                   f'{ranked[1]} {ranked[len(ranked) // 5]}']
+
+        def like(queryset, terms):
+            for term in terms:
+                queryset = queryset.filter(Q(message_body__icontains=term) | Q(sender__username__icontains=term))
+            return queryset.order_by('-sent_at')
+
+        backend = get_search_backend()
+        strategies = [(type(backend).__name__, lambda qs, terms: backend.search(qs, terms).order_by(*backend.rank_ordering))]
+        if not isinstance(backend, InvertedIndexBackend):
+            inverted = InvertedIndexBackend()
+            start = time.perf_counter()
+            inverted.build()
+            self.stdout.write(f"InvertedIndexBackend build: {(time.perf_counter() - start) * 1000:.0f} ms")
+            strategies.append(('InvertedIndexBackend', lambda qs, terms: inverted.search(qs, terms).order_by('-search_rank')))
+        if not options['skip_like']:
+            strategies.append(('LIKE', like))
+
+        for query in queries:
+            terms = tokenize(query)
+            for name, strategy in strategies:
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    queryset = strategy(Message.objects.all(), terms)
+                    page = list(queryset[:20])
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f"{query!r:>24} {name:<22} first page ({len(page):>2} rows): "
+                    f"p50 {statistics.median(timings):8.2f} ms  max {max(timings):8.2f} ms"
+                )
+
+    def seed(self, rng, options):
+        # Zipf-like word frequencies so queries cover common and rare terms
+        words = sorted({''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(3, 9))) for _ in range(20000)})
+        weights = [1 / (rank + 1) for rank in range(len(words))]
+        users = User.objects.bulk_create([
+            User(username=f'{SEED_PREFIX}{i}', email=f'{SEED_PREFIX}{i}@example.com')
+            for i in range(options['users'])
+        ])
+        conversations = Conversation.objects.bulk_create([Conversation() for _ in range(options['users'] // 2)])
+        counts = {}
+        start = time.perf_counter()
+        batch = []
+        for i in range(options['messages']):
+            body = rng.choices(words, weights=weights, k=options['words'])
+            for word in body:
+                counts[word] = counts.get(word, 0) + 1
+            batch.append(Message(
+                sender=rng.choice(users),
+                conversation=rng.choice(conversations),
+                message_body=' '.join(body),
+            ))
+            if len(batch) == 5000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+        self.stdout.write(
+            f"Seeded {options['messages']} messages on {connection.vendor} "
+            f"in {time.perf_counter() - start:.1f} s"
+        )
+        return counts
@@ -0,0 +1,161 @@
+import json
+import random
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from chats.export import export_queryset
+from chats.models import Conversation, Message, User
+from chats.pagination import MessageCursorPagination
+from chats.views import ConversationViewSet, MessageViewSet
+
+
+SEED_PREFIX = 'explain-seed-'
+
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def full_scans(queryset):
+    """
+    Return (plan, tables read with a full table scan) for queryset
+    """
+    vendor = connection.vendor
+    if vendor == 'mysql':
+        plan = queryset.explain(format='json')
+        return plan, sorted(set(_mysql_full_scans(json.loads(plan))))
+    plan = queryset.explain()
+    if vendor == 'sqlite':
+        return plan, sorted(set(SQLITE_FULL_SCAN.findall(plan)))
+    if vendor == 'postgresql':
+        return plan, sorted(set(POSTGRES_FULL_SCAN.findall(plan)))
+    raise CommandError(f"Don't know how to read {vendor} query plans")
+
+
+def _mysql_full_scans(node):
+    if isinstance(node, dict):
+        if node.get('access_type') == 'ALL':
+            yield node.get('table_name')
+        for value in node.values():
+            yield from _mysql_full_scans(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _mysql_full_scans(item)
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the main queries of the chats views and fail if any does a full table scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--conversations', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=5000)
+        parser.add_argument('--no-seed', action='store_true', help='Explain against the existing data only')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only failures')
+
+    def handle(self, *args, **options):
+        try:
+            if not options['no_seed']:
+                self.seed(options)
+            user = User.objects.filter(conversations__isnull=False).first()
+            if user is None:
+                raise CommandError("No conversations to explain; run without --no-seed")
+            failures = []
+            for name, queryset in self.view_queries(user):
+                plan, scans = full_scans(queryset)
+                status = self.style.ERROR('FULL SCAN ' + ', '.join(scans)) if scans else self.style.SUCCESS('ok')
+                self.stdout.write(f"{name}: {status}")
+                if scans or options['verbose_plans']:
+                    self.stdout.write(plan + '\n')
+                if scans:
+                    failures.append(name)
+        finally:
+            if not options['no_seed']:
+                self.cleanup()
+        if failures:
+            raise CommandError(f"Full table scans in: {', '.join(failures)}")
+
+    def view_queries(self, user):
+        factory = APIRequestFactory()
+        conversation = user.conversations.first()
+        last = Message.objects.filter(conversation__participants=user).order_by('-sent_at', '-message_id').first()
+        now = timezone.now()
+
+        def view_queryset(viewset_class, query=None, **kwargs):
+            request = Request(factory.get('/', query or {}))
+            request.user = user
+            view = viewset_class(request=request, args=(), kwargs=kwargs, action='list', format_kwarg=None)
+            return view.filter_queryset(view.get_queryset())
+
+        yield 'conversation list', view_queryset(ConversationViewSet)
+        yield 'conversation activity', Conversation.objects.filter(participants=user).order_by(
+            '-last_message_at', '-created_at',
+        )
+        yield 'message list', view_queryset(MessageViewSet)
+        yield 'conversation messages', view_queryset(MessageViewSet, conversation_pk=conversation.pk)
+        yield 'messages today', view_queryset(MessageViewSet, {'today': 'true'})
+        yield 'messages in range', view_queryset(
+            MessageViewSet, {'after': (now - timedelta(days=7)).isoformat(), 'before': now.isoformat()}
+        )
+        yield 'message export', export_queryset(user)
+        if last is not None:
+            position = MessageCursorPagination.after_position((last.sent_at, last.message_id), descending=True)
+            yield 'message cursor page', view_queryset(MessageViewSet).filter(position).order_by('-sent_at', '-message_id')
+            yield 'sender history', Message.objects.filter(sender=last.sender, sent_at__gte=now - timedelta(days=7))
+
+    # -----------------------------
+    # Seed data
+    # -----------------------------
+    def seed(self, options):
+        rng = random.Random(0)
+        users = User.objects.bulk_create([
+            User(username=f'{SEED_PREFIX}{i}', email=f'{SEED_PREFIX}{i}@example.com')
+            for i in range(options['users'])
+        ])
+        conversations = Conversation.objects.bulk_create([Conversation() for _ in range(options['conversations'])])
+        Through = Conversation.participants.through
+        memberships = {}
+        for conversation in conversations:
+            memberships[conversation.pk] = rng.sample(users, 2)
+        Through.objects.bulk_create([
+            Through(conversation=conversation, user=user)
+            for conversation in conversations
+            for user in memberships[conversation.pk]
+        ])
+        messages = []
+        for i in range(options['messages']):
+            conversation = rng.choice(conversations)
+            messages.append(Message(
+                conversation=conversation,
+                sender=rng.choice(memberships[conversation.pk]),
+                message_body=f'Seed message {i}',
+            ))
+        Message.objects.bulk_create(messages, batch_size=1000)
+        # sent_at is auto_now_add, so spread the timestamps over 30 days afterwards
+        now = timezone.now()
+        for message in messages:
+            message.sent_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        Message.objects.bulk_update(messages, ['sent_at'], batch_size=500)
+        self.analyze()
+        self.stdout.write(f"Seeded {len(users)} users, {len(conversations)} conversations, {len(messages)} messages")
+
+    def analyze(self):
+        tables = [Message._meta.db_table, Conversation._meta.db_table, Conversation.participants.through._meta.db_table]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+            elif connection.vendor == 'mysql':
+                cursor.execute('ANALYZE TABLE ' + ', '.join(connection.ops.quote_name(t) for t in tables))
+            elif connection.vendor == 'postgresql':
+                for table in tables:
+                    cursor.execute('ANALYZE ' + connection.ops.quote_name(table))
+
+    def cleanup(self):
+        seed_users = User.objects.filter(username__startswith=SEED_PREFIX)
+        Conversation.objects.filter(participants__in=seed_users).delete()
+        seed_users.delete()
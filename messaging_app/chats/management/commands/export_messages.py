@@ -0,0 +1,76 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_queryset, gzip_stream, iter_export
+from chats.models import User
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = "Stream a user's messages to a JSON Lines or CSV file (or stdout) and report the throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--output', help='File to write, stdout by default')
+        parser.add_argument('--conversation', help='Only export this conversation')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='Rows per fetch and write')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist")
+
+        stats = {'raw': 0}
+
+        def counted(chunks):
+            for chunk in chunks:
+                stats['raw'] += len(chunk)
+                yield chunk
+
+        chunks = counted(iter_export(
+            export_queryset(user, options['conversation']), options['format'], options['chunk_size']
+        ))
+        if options['gzip']:
+            chunks = gzip_stream(chunks)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        start = time.perf_counter()
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+        elapsed = time.perf_counter() - start
+
+        # The report goes to stderr so that it never mixes with an export on stdout
+        report = (
+            f"Exported {stats['raw'] / 1e6:.1f} MB of {options['format']} in {elapsed:.2f} s: "
+            f"{stats['raw'] / 1e6 / elapsed if elapsed else 0:.1f} MB/s"
+        )
+        if options['gzip']:
+            report += f", {written / 1e6:.1f} MB gzipped"
+        peak = peak_memory_mb()
+        if peak is not None:
+            report += f", peak RSS {peak:.0f} MB"
+        self.stderr.write(report, style_func=self.style.SUCCESS)
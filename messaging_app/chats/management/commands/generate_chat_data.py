@@ -0,0 +1,308 @@
+import hashlib
+import itertools
+import math
+import multiprocessing
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from chats.models import ACTIVITY_FIELDS, PREVIEW_LENGTH, Conversation, Message, User
+
+
+VOCABULARY_SIZE = 5000
+
+
+def stable_uuid(prefix, seed, kind, *index):
+    """
+    UUID derived from (prefix, seed, kind, index) only, so every worker and
+    every run with the same prefix and seed produces the same primary keys,
+    and data sets with different prefixes never share one
+    """
+    key = ':'.join(str(part) for part in (prefix, seed, kind) + index).encode()
+    return uuid.UUID(bytes=hashlib.blake2b(key, digest_size=16).digest(), version=4)
+
+
+def chunk_rng(seed, kind, chunk):
+    return random.Random(f'{seed}:{kind}:{chunk}')
+
+
+def zipf_counts(total, buckets, exponent, rng):
+    """
+    Split total into buckets with Zipfian sizes, assigned to buckets in a
+    seeded random order
+    """
+    weights = [1 / (rank + 1) ** exponent for rank in range(buckets)]
+    scale = total / sum(weights)
+    by_rank = [int(weight * scale) for weight in weights]
+    for rank in range(total - sum(by_rank)):
+        by_rank[rank % buckets] += 1
+    order = list(range(buckets))
+    rng.shuffle(order)
+    counts = [0] * buckets
+    for rank, bucket in enumerate(order):
+        counts[bucket] = by_rank[rank]
+    return counts
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """
+    Let bulk_create keep the generated created_at/sent_at values instead of
+    auto_now_add stamping every row with the current time
+    """
+    previous = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, previous):
+            field.auto_now_add = value
+
+
+class Generator:
+    """
+    Deterministic data for one seed. Every chunk is generated from its own
+    RNG, so chunks can be produced in any order or in parallel.
+    """
+
+    def __init__(self, options, message_counts):
+        self.seed = options['seed']
+        self.users = options['users']
+        self.prefix = options['prefix']
+        self.chunk_size = options['chunk_size']
+        self.end = options['end']
+        self.start = self.end - timedelta(days=options['days'])
+        self.message_counts = message_counts
+        self.password = options['password_hash']
+        rng = random.Random(f'{self.seed}:vocabulary')
+        self.words = [
+            ''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(2, 10))) for _ in range(VOCABULARY_SIZE)
+        ]
+        # Zipfian word frequencies
+        self.word_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(VOCABULARY_SIZE)))
+
+    def user_id(self, index):
+        return stable_uuid(self.prefix, self.seed, 'user', index)
+
+    def random_time(self, rng):
+        return self.start + (self.end - self.start) * rng.random()
+
+    def pick_user(self, rng):
+        # Skewed towards low indexes: a minority of users is in most chats
+        return int(self.users * rng.random() ** 2)
+
+    def body(self, rng):
+        # Log-normal word counts: mostly short messages, a long tail of long ones
+        length = max(1, min(300, int(rng.lognormvariate(2.0, 0.9))))
+        return ' '.join(rng.choices(self.words, cum_weights=self.word_weights, k=length)).capitalize()
+
+    def user_chunk(self, chunk):
+        rng = chunk_rng(self.seed, 'users', chunk)
+        first = chunk * self.chunk_size
+        return [
+            User(
+                user_id=self.user_id(index),
+                username=f'{self.prefix}{index}',
+                email=f'{self.prefix}{index}@example.com',
+                first_name=f'Load{index}',
+                last_name='User',
+                password=self.password,
+                created_at=self.random_time(rng),
+            )
+            for index in range(first, min(first + self.chunk_size, self.users))
+        ]
+
+    def conversation_chunk(self, chunk, conversations_per_chunk):
+        """
+        Yield (conversations, memberships, messages, activity_updates) batches
+        for one range of conversations. Batches hold at most about chunk_size
+        messages; a conversation flushed before its last message was generated
+        comes back in activity_updates once its counters are known.
+        """
+        rng = chunk_rng(self.seed, 'conversations', chunk)
+        first = chunk * conversations_per_chunk
+        last = min(first + conversations_per_chunk, len(self.message_counts))
+        conversations, memberships, messages = [], [], []
+        Membership = Conversation.participants.through
+        for index in range(first, last):
+            size = 2 if rng.random() < 0.85 else rng.randint(3, 12)
+            participants = sorted({self.pick_user(rng) for _ in range(size)})
+            if len(participants) == 1:
+                participants.append((participants[0] + 1) % self.users)
+            created_at = self.random_time(rng)
+            conversation = Conversation(
+                conversation_id=stable_uuid(self.prefix, self.seed, 'conversation', index),
+                created_at=created_at,
+                last_message_at=created_at,
+            )
+            conversations.append(conversation)
+            memberships.extend(
+                Membership(conversation_id=conversation.pk, user_id=self.user_id(user)) for user in participants
+            )
+            flushed = False
+            last_message = None
+            # Bursty arrivals: mostly quick replies, occasionally hours or days apart
+            sent_at = conversation.created_at
+            count = self.message_counts[index]
+            for position in range(count):
+                if rng.random() < 0.8:
+                    sent_at += timedelta(seconds=rng.expovariate(1 / 40))
+                else:
+                    sent_at += timedelta(hours=rng.expovariate(1 / 18))
+                sent_at = min(sent_at, self.end)
+                last_message = Message(
+                    message_id=stable_uuid(self.prefix, self.seed, 'message', index, position),
+                    conversation_id=conversation.pk,
+                    sender_id=self.user_id(rng.choice(participants)),
+                    message_body=self.body(rng),
+                    sent_at=sent_at,
+                )
+                messages.append(last_message)
+                if len(messages) >= self.chunk_size:
+                    yield conversations, memberships, messages, []
+                    conversations, memberships, messages = [], [], []
+                    flushed = True
+            if last_message is not None:
+                conversation.message_count = count
+                conversation.last_message_at = last_message.sent_at
+                conversation.last_message_preview = last_message.message_body[:PREVIEW_LENGTH]
+                if flushed:
+                    yield [], [], messages, [conversation]
+                    messages = []
+        if conversations or messages:
+            yield conversations, memberships, messages, []
+
+
+def insert_users(generator, chunk):
+    users = generator.user_chunk(chunk)
+    with explicit_timestamps(User._meta.get_field('created_at')), transaction.atomic():
+        User.objects.bulk_create(users, batch_size=generator.chunk_size)
+    return len(users), 0
+
+
+def insert_conversations(generator, chunk, conversations_per_chunk):
+    fields = (Conversation._meta.get_field('created_at'), Message._meta.get_field('sent_at'))
+    conversation_total = message_total = 0
+    with explicit_timestamps(*fields):
+        batches = generator.conversation_chunk(chunk, conversations_per_chunk)
+        for conversations, memberships, messages, activity_updates in batches:
+            with transaction.atomic():
+                Conversation.objects.bulk_create(conversations, batch_size=generator.chunk_size)
+                Conversation.participants.through.objects.bulk_create(memberships, batch_size=generator.chunk_size)
+                Message.objects.bulk_create(messages, batch_size=generator.chunk_size)
+                if activity_updates:
+                    Conversation.objects.bulk_update(activity_updates, ACTIVITY_FIELDS)
+            conversation_total += len(conversations)
+            message_total += len(messages)
+    return conversation_total, message_total
+
+
+# Worker state for multiprocessing; set once per process by the pool initializer
+_worker_generator = None
+
+
+def _init_worker(generator):
+    global _worker_generator
+    _worker_generator = generator
+    # Never share the parent's connection across processes
+    connections.close_all()
+
+
+def _run_task(task):
+    name, args = task
+    if name == 'users':
+        return insert_users(_worker_generator, *args)
+    return insert_conversations(_worker_generator, *args)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a large deterministic chats dataset with bulk_create: Zipfian conversation sizes, "
+        "bursty timestamps and varied message lengths"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--conversations', type=int, default=10000)
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per INSERT batch')
+        parser.add_argument('--workers', type=int, default=1, help='Parallel processes (ignored on SQLite)')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exponent of the conversation size distribution')
+        parser.add_argument('--days', type=int, default=365, help='Length of the time window')
+        parser.add_argument(
+            '--end', type=lambda value: datetime.fromisoformat(value).replace(tzinfo=dt_timezone.utc),
+            default=datetime(2025, 1, 1, tzinfo=dt_timezone.utc),
+            help='End of the time window (ISO date, UTC); fixed by default so output depends only on the seed',
+        )
+        parser.add_argument('--prefix', default='load', help='Username prefix')
+        parser.add_argument('--password', default='loadtest123', help='Password shared by all generated users')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError("At least 2 users are needed to form conversations")
+        if User.objects.filter(username=f"{options['prefix']}0").exists():
+            raise CommandError(f"Users with prefix '{options['prefix']}' already exist; pick another --prefix")
+
+        workers = options['workers']
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stdout.write(self.style.WARNING("SQLite serialises writers; using a single process"))
+            workers = 1
+
+        # Hash once: every generated user shares the same password
+        options['password_hash'] = make_password(options['password'])
+        counts = zipf_counts(
+            options['messages'], options['conversations'], options['zipf'], random.Random(f"{options['seed']}:sizes"),
+        )
+        generator = Generator(options, counts)
+        chunk_size = options['chunk_size']
+        # Size conversation chunks so each carries roughly chunk_size messages
+        conversations_per_chunk = max(1, min(
+            options['conversations'],
+            math.ceil(chunk_size * options['conversations'] / max(options['messages'], 1)),
+        ))
+
+        user_tasks = [('users', (chunk,)) for chunk in range(math.ceil(options['users'] / chunk_size))]
+        conversation_tasks = [
+            ('conversations', (chunk, conversations_per_chunk))
+            for chunk in range(math.ceil(options['conversations'] / conversations_per_chunk))
+        ]
+
+        start = time.perf_counter()
+        self.run_phase('users', user_tasks, generator, workers)
+        self.run_phase('conversations/messages', conversation_tasks, generator, workers)
+        largest = max(counts) if counts else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['users']} users, {options['conversations']} conversations and "
+            f"{options['messages']} messages in {time.perf_counter() - start:.1f} s "
+            f"(largest conversation: {largest} messages)"
+        ))
+
+    def run_phase(self, name, tasks, generator, workers):
+        start = time.perf_counter()
+        done = [0, 0]
+
+        def report(result):
+            done[0] += result[0]
+            done[1] += result[1]
+            elapsed = time.perf_counter() - start
+            rate = sum(done) / elapsed if elapsed else 0
+            self.stdout.write(f"  {name}: {done[0]} / {done[1]} rows ({rate:,.0f} rows/s)")
+
+        if workers <= 1:
+            _init_worker(generator)
+            for task in tasks:
+                report(_run_task(task))
+            return
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=_init_worker, initargs=(generator,)) as pool:
+            for result in pool.imap_unordered(_run_task, tasks):
+                report(result)
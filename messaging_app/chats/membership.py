@@ -0,0 +1,72 @@
+import time
+
+from django.core.cache import cache
+
+from .models import Conversation
+
+
+MEMBERSHIP_CACHE_TIMEOUT = 600
+
+
+def version_key(user_pk):
+    return f"chats:membership_version:{user_pk}"
+
+
+def membership_key(user_pk, version):
+    return f"chats:membership:{user_pk}:{version}"
+
+
+def get_version(user_pk):
+    """
+    Current membership version for a user. A missing version is seeded from
+    the clock rather than 1, so an evicted counter can never come back to a
+    version whose cached set is stale.
+    """
+    key = version_key(user_pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_conversation_ids(user):
+    """
+    Return the frozenset of conversation ids the user participates in,
+    cached under the user's current membership version
+    """
+    key = membership_key(user.pk, get_version(user.pk))
+    conversation_ids = cache.get(key)
+    if conversation_ids is None:
+        conversation_ids = frozenset(
+            Conversation.participants.through.objects.filter(user_id=user.pk).values_list('conversation_id', flat=True)
+        )
+        cache.set(key, conversation_ids, MEMBERSHIP_CACHE_TIMEOUT)
+    return conversation_ids
+
+
+def is_participant(user, conversation_id):
+    return conversation_id in get_conversation_ids(user)
+
+
+def check_participation(user, conversation_ids):
+    """
+    Bulk check for list views: map each conversation id to whether the user
+    participates, from a single cache lookup
+    """
+    member_of = get_conversation_ids(user)
+    return {conversation_id: conversation_id in member_of for conversation_id in conversation_ids}
+
+
+def invalidate_memberships(user_pks):
+    """
+    Bump the version of each user; readers move to a fresh key, so a set
+    computed concurrently from old data can't overwrite the new one
+    """
+    for user_pk in user_pks:
+        key = version_key(user_pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Nothing cached for this user yet
+            cache.add(key, time.time_ns(), None)
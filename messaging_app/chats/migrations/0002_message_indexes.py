@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sent_at'], name='message_conv_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'sent_at'], name='message_sender_sent_idx'),
+        ),
+    ]
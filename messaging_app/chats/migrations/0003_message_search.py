@@ -0,0 +1,70 @@
+from django.db import migrations, transaction
+from django.db.utils import OperationalError
+
+
+FTS_TABLE = 'chats_message_fts'
+
+
+def sqlite_statements(message, user):
+    return [
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(message_body, username, tokenize='unicode61')",
+        f"""CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {message} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, message_body, username)
+            VALUES (new.rowid, new.message_body, (SELECT username FROM {user} WHERE user_id = new.sender_id));
+        END""",
+        f"""CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF message_body, sender_id ON {message} BEGIN
+            UPDATE {FTS_TABLE}
+            SET message_body = new.message_body,
+                username = (SELECT username FROM {user} WHERE user_id = new.sender_id)
+            WHERE rowid = new.rowid;
+        END""",
+        f"""CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {message} BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+        END""",
+        f"""CREATE TRIGGER {FTS_TABLE}_rename AFTER UPDATE OF username ON {user} BEGIN
+            UPDATE {FTS_TABLE} SET username = new.username
+            WHERE rowid IN (SELECT rowid FROM {message} WHERE sender_id = new.user_id);
+        END""",
+        f"""INSERT INTO {FTS_TABLE}(rowid, message_body, username)
+            SELECT m.rowid, m.message_body, u.username FROM {message} m JOIN {user} u ON u.user_id = m.sender_id""",
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    message = apps.get_model('chats', 'Message')._meta.db_table
+    user = apps.get_model('chats', 'User')._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            try:
+                with transaction.atomic(using=connection.alias):
+                    for statement in sqlite_statements(message, user):
+                        cursor.execute(statement)
+            except OperationalError:
+                # SQLite built without FTS5: search falls back to the in-process index
+                pass
+        elif connection.vendor == 'mysql':
+            cursor.execute(f'CREATE FULLTEXT INDEX message_body_fulltext ON {message} (message_body)')
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    message = apps.get_model('chats', 'Message')._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for trigger in ('insert', 'update', 'delete', 'rename'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        elif connection.vendor == 'mysql':
+            cursor.execute(f'DROP INDEX message_body_fulltext ON {message}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_message_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:25
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_last_message_at(apps, schema_editor):
+    """Conversations without messages count as active since their creation"""
+    Conversation = apps.get_model('chats', 'Conversation')
+    Conversation.objects.using(schema_editor.connection.alias).filter(last_message_at__isnull=True).update(
+        last_message_at=F('created_at'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_conversation_activity'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_last_message_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
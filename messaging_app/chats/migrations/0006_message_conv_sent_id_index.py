@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_conversation_activity_not_null'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sent_at', 'message_id'], name='message_conv_sent_id_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_conv_sent_idx',
+        ),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 
@@ -37,11 +38,38 @@ class User(AbstractUser):
 # -----------------------------
 # Conversation Model
 # -----------------------------
+PREVIEW_LENGTH = 100
+
+# Maintained by chats.activity with atomic UPDATEs, never by save()
+ACTIVITY_FIELDS = ('last_message_at', 'last_message_preview', 'message_count')
+
+
 class Conversation(models.Model):
     conversation_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     participants = models.ManyToManyField(User, related_name="conversations")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized from messages for activity ordering and previews. Never
+    # NULL, so the index serves the ordering on every backend: a conversation
+    # without messages counts as active since its creation.
+    last_message_at = models.DateTimeField(default=timezone.now, editable=False)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='', editable=False)
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-last_message_at'], name='conversation_activity_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # A full save from a stale instance must not overwrite the counters
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ACTIVITY_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Conversation {self.conversation_id}"
 
@@ -56,5 +84,13 @@ class Message(models.Model):
     message_body = models.TextField()
     sent_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Conversation history, the sent_at range/ordering filters and the
+            # export's (conversation, sent_at, message_id) keyset order
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='message_conv_sent_id_idx'),
+            models.Index(fields=['sender', 'sent_at'], name='message_sender_sent_idx'),
+        ]
+
     def __str__(self):
         return f"From {self.sender.username} in {self.conversation.conversation_id}"
@@ -1,18 +1,179 @@
-﻿from rest_framework.pagination import PageNumberPagination
+﻿import base64
+import binascii
+import datetime
+import uuid
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over (sent_at, message_id).
+
+    Each page is fetched with a WHERE on the last seen (sent_at, message_id)
+    pair instead of an OFFSET, and no COUNT(*) is run unless the client asks
+    for one, so page 500 costs the same as page 1.
+
+    ?count=estimate returns a count capped at count_cap (count_capped tells
+    whether there are more), ?count=exact runs the full COUNT(*).
+
+    Only orderings by sent_at can be paged this way; any other effective
+    ordering (?ordering=sender, search rank) is rejected with a 400 rather
+    than silently replaced.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    count_cap = 10000
+    invalid_cursor_message = 'Invalid cursor'
+    invalid_ordering_message = 'Cursor pagination only supports ordering by sent_at'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.descending = self.is_descending(queryset)
+        self.count, self.count_capped = self.get_count(queryset, request)
+
+        position, self.reverse = self.decode_cursor(request)
+        self.has_cursor = position is not None
+
+        # Walking backwards flips the ordering; the page is re-reversed below
+        descending = self.descending != self.reverse
+        if position is not None:
+            queryset = queryset.filter(self.after_position(position, descending))
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}sent_at', f'{prefix}message_id')
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def is_descending(self, queryset):
+        # Follow the effective ordering if it is by sent_at, newest first by default
+        order_by = queryset.query.order_by
+        if not order_by:
+            return True
+        if order_by[0] not in ('sent_at', '-sent_at'):
+            raise ValidationError({'ordering': [self.invalid_ordering_message]})
+        return order_by[0] == '-sent_at'
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count(), False
+        if mode == 'estimate':
+            # COUNT over a LIMITed subquery stops scanning at the cap
+            count = queryset.order_by()[:self.count_cap + 1].count()
+            return min(count, self.count_cap), count > self.count_cap
+        return None, False
+
+    @staticmethod
+    def after_position(position, descending):
+        sent_at, message_id = position
+        lookup = 'lt' if descending else 'gt'
+        return Q(**{f'sent_at__{lookup}': sent_at}) | Q(sent_at=sent_at, **{f'message_id__{lookup}': message_id})
+
+    # -----------------------------
+    # Cursor encoding
+    # -----------------------------
+    def encode_cursor(self, message, reverse):
+        raw = f"{'p' if reverse else 'n'}|{message.sent_at.isoformat()}|{message.message_id.hex}"
+        cursor = base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            direction, sent_at, message_id = raw.split('|')
+            if direction not in ('n', 'p'):
+                raise ValueError(direction)
+            return (datetime.datetime.fromisoformat(sent_at), uuid.UUID(message_id)), direction == 'p'
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.page:
+            return None
+        # Going forwards there is a next page only if we over-fetched; coming
+        # back from a previous link there always is
+        if self.reverse or self.has_more:
+            return self.encode_cursor(self.page[-1], reverse=False)
+        return None
+
+    def get_previous_link(self):
+        if not self.page:
+            return None
+        if (self.has_more if self.reverse else self.has_cursor):
+            return self.encode_cursor(self.page[0], reverse=True)
+        return None
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+            'page_size': self.page_size,
+        }
+        if self.count is not None:
+            response['count'] = self.count
+            response['count_capped'] = self.count_capped
+        return Response(response)
+
 
 class MessagePagination(PageNumberPagination):
     """
     Custom pagination for messages - 20 messages per page
+
+    Clients opt in to cursor pagination with ?pagination=cursor (or by
+    following a cursor link); page numbers stay the default.
     """
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 100
-    
+    mode_query_param = 'pagination'
+    cursor_class = MessageCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_class.cursor_query_param in request.query_params
+        )
+
     def get_paginated_response(self, data):
         """
         Custom paginated response that includes page.paginator.count
         """
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
         return Response({
             'count': self.page.paginator.count,
             'next': self.get_next_link(),
@@ -21,4 +182,4 @@ class MessagePagination(PageNumberPagination):
             'page_size': self.page_size,
             'total_pages': self.page.paginator.num_pages,
             'current_page': self.page.number,
-        })
\ No newline at end of file
+        })
@@ -1,4 +1,5 @@
 ﻿from rest_framework import permissions
+from chats.membership import check_participation, is_participant
 from chats.models import Conversation
 
 class IsParticipantOfConversation(permissions.BasePermission):
@@ -21,13 +22,24 @@ class IsParticipantOfConversation(permissions.BasePermission):
         return request.user and request.user.is_authenticated
     
     def _is_participant(self, user, obj):
-        if isinstance(obj, Conversation):
-            conversation = obj
-        elif hasattr(obj, 'conversation'):
-            # If obj is a Message, get its related conversation
-            conversation = obj.conversation
-        else:
+        conversation_id = self._conversation_id(obj)
+        if conversation_id is None:
             return False
         
-        # Check if the user is in the participants list of the conversation
-        return conversation.participants.filter(pk=user.pk).exists()
\ No newline at end of file
+        # Check the user's cached conversation ids (no query when warm)
+        return is_participant(user, conversation_id)
+
+    def _conversation_id(self, obj):
+        if isinstance(obj, Conversation):
+            return obj.pk
+        # If obj is a Message, use its conversation id without loading the conversation
+        return getattr(obj, 'conversation_id', None)
+
+    def filter_permitted(self, request, objs):
+        """
+        Bulk variant of has_object_permission for list views: keep the
+        conversations/messages the user participates in, with one cache lookup
+        """
+        objs = list(objs)
+        allowed = check_participation(request.user, {self._conversation_id(obj) for obj in objs})
+        return [obj for obj in objs if allowed[self._conversation_id(obj)]]
@@ -0,0 +1,325 @@
+import bisect
+import re
+import threading
+import uuid
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+from .membership import get_conversation_ids
+from .models import Message, User
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+FTS_TABLE = 'chats_message_fts'
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+def matching_sender_ids(terms):
+    """
+    {term: [sender pk hex]} of the senders whose username starts with each
+    term, in one query. The user table is small next to messages, so this is
+    resolved up front and ORed into each term's condition by sender_id.
+    """
+    query = Q()
+    for term in terms:
+        query |= Q(username__istartswith=term)
+    senders = list(User.objects.filter(query).values_list('pk', 'username'))
+    return {
+        term: [pk.hex for pk, username in senders if username.lower().startswith(term)]
+        for term in terms
+    }
+
+
+# -----------------------------
+# Backends
+# -----------------------------
+class SearchBackend:
+    """
+    Filters a Message queryset down to messages matching every term, as a
+    prefix of a word in message_body or of the sender's username. Results
+    carry a search_rank annotation that orders best matches first.
+
+    conversation_ids, when given, are the conversations the results may
+    come from; backends that rank outside the database apply it before
+    limiting, the database backends get it from the queryset.
+    """
+    rank_ordering = ['-search_rank']
+
+    def search(self, queryset, terms, conversation_ids=None):
+        raise NotImplementedError
+
+    def index_message(self, message):
+        """Called after a message is saved; only needed without triggers"""
+
+    def remove_message(self, message):
+        """Called after a message is deleted; only needed without triggers"""
+
+    def invalidate(self):
+        """Called when data the index depends on changed in bulk"""
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    SQLite FTS5 table kept in sync by triggers (see migration
+    0003_message_search). Matches are joined back on rowid and ranked by
+    bm25, where lower is better.
+    """
+    rank_ordering = ['search_rank']
+
+    @staticmethod
+    def match_expression(terms):
+        # Quote every term so user input can't inject FTS5 query syntax
+        return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+    def search(self, queryset, terms, conversation_ids=None):
+        table = Message._meta.db_table
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {table}.rowid', f'{FTS_TABLE} MATCH %s'],
+            params=[self.match_expression(terms)],
+            select={'search_rank': f'bm25({FTS_TABLE})'},
+        )
+
+
+class MySQLFullTextBackend(SearchBackend):
+    """
+    InnoDB FULLTEXT index on message_body, queried in boolean mode so every
+    term is required and may be a prefix. InnoDB keeps the index in sync.
+
+    Like the FTS5 table, a term may also match the sender's username. Terms
+    that match no username are required together in one MATCH; each other
+    term gets its own (MATCH OR sender_id IN ...) condition, so every term
+    still has to match.
+    """
+
+    @staticmethod
+    def match_expression(terms):
+        return ' '.join(f'+{term}*' for term in terms)
+
+    def search(self, queryset, terms, conversation_ids=None):
+        table = connection.ops.quote_name(Message._meta.db_table)
+        match = f'MATCH ({table}.message_body) AGAINST (%s IN BOOLEAN MODE)'
+        senders = matching_sender_ids(terms)
+        body_only = [term for term in terms if not senders[term]]
+        where, params = [], []
+        if body_only:
+            where.append(match)
+            params.append(self.match_expression(body_only))
+        for term in terms:
+            if senders[term]:
+                placeholders = ', '.join(['%s'] * len(senders[term]))
+                where.append(f'({match} OR {table}.sender_id IN ({placeholders}))')
+                params += [self.match_expression([term])] + senders[term]
+        return queryset.extra(
+            where=where,
+            params=params,
+            select={'search_rank': match},
+            select_params=[' '.join(f'{term}*' for term in terms)],
+        )
+
+
+class InvertedIndexBackend(SearchBackend):
+    """
+    In-process inverted index for databases without a full-text engine.
+
+    Built lazily from the database on first search and updated from model
+    signals. Each process holds its own copy, so writes made by other
+    processes only show up after invalidate(); use a database backend in
+    multi-process deployments. Matches are restricted to conversation_ids
+    before the max_results best are kept, so other users' messages never
+    crowd out the caller's.
+    """
+    max_results = 1000
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings = None
+        self.documents = {}
+        self.conversations = {}
+        self.vocabulary = []
+
+    def build(self):
+        postings = defaultdict(dict)
+        documents, conversations = {}, {}
+        rows = Message.objects.values_list(
+            'pk', 'conversation_id', 'message_body', 'sender__username'
+        ).iterator(chunk_size=2000)
+        for pk, conversation_id, body, username in rows:
+            documents[pk] = self._add(postings, pk, body, username)
+            conversations[pk] = conversation_id
+        self.postings = postings
+        self.documents = documents
+        self.conversations = conversations
+        self.vocabulary = sorted(postings)
+
+    @staticmethod
+    def _add(postings, pk, body, username):
+        counts = Counter(tokenize(body))
+        counts.update(tokenize(username))
+        for token, count in counts.items():
+            postings[token][pk] = count
+        return tuple(counts)
+
+    def _discard(self, pk):
+        self.conversations.pop(pk, None)
+        for token in self.documents.pop(pk, ()):
+            entries = self.postings.get(token)
+            if entries is not None:
+                entries.pop(pk, None)
+                if not entries:
+                    del self.postings[token]
+                    index = bisect.bisect_left(self.vocabulary, token)
+                    if index < len(self.vocabulary) and self.vocabulary[index] == token:
+                        del self.vocabulary[index]
+
+    def index_message(self, message):
+        with self.lock:
+            if self.postings is None:
+                return
+            self._discard(message.pk)
+            tokens = self._add(self.postings, message.pk, message.message_body, message.sender.username)
+            self.documents[message.pk] = tokens
+            self.conversations[message.pk] = message.conversation_id
+            for token in tokens:
+                index = bisect.bisect_left(self.vocabulary, token)
+                if index == len(self.vocabulary) or self.vocabulary[index] != token:
+                    self.vocabulary.insert(index, token)
+
+    def remove_message(self, message):
+        with self.lock:
+            if self.postings is not None:
+                self._discard(message.pk)
+
+    def invalidate(self):
+        with self.lock:
+            self.postings = None
+            self.documents = {}
+            self.conversations = {}
+            self.vocabulary = []
+
+    def scores(self, terms, conversation_ids=None):
+        """
+        Return {pk: score} for documents matching every term as a prefix,
+        in conversation_ids if given; the score is the summed frequency of
+        the matched tokens
+        """
+        with self.lock:
+            if self.postings is None:
+                self.build()
+            result = None
+            for term in terms:
+                term_scores = Counter()
+                index = bisect.bisect_left(self.vocabulary, term)
+                while index < len(self.vocabulary) and self.vocabulary[index].startswith(term):
+                    term_scores.update(self.postings[self.vocabulary[index]])
+                    index += 1
+                if result is None:
+                    if conversation_ids is not None:
+                        term_scores = Counter({
+                            pk: score for pk, score in term_scores.items()
+                            if self.conversations.get(pk) in conversation_ids
+                        })
+                    result = term_scores
+                else:
+                    result = Counter({pk: result[pk] + score for pk, score in term_scores.items() if pk in result})
+                if not result:
+                    break
+            return result or {}
+
+    def search(self, queryset, terms, conversation_ids=None):
+        ranked = Counter(self.scores(terms, conversation_ids)).most_common(self.max_results)
+        if not ranked:
+            return queryset.none().annotate(search_rank=Value(0, output_field=IntegerField()))
+        return queryset.filter(pk__in=[pk for pk, _ in ranked]).annotate(
+            search_rank=Case(
+                *[When(pk=pk, then=score) for pk, score in ranked],
+                default=0,
+                output_field=IntegerField(),
+            )
+        )
+
+
+_backend_lock = threading.Lock()
+_backend = None
+
+
+def sqlite_fts_available():
+    return FTS_TABLE in connection.introspection.table_names()
+
+
+def get_search_backend():
+    """
+    Return the configured backend. CHATS_SEARCH_BACKEND may be a dotted path;
+    by default the database's own full-text engine is used when available.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            path = getattr(settings, 'CHATS_SEARCH_BACKEND', None)
+            if path:
+                _backend = import_string(path)()
+            elif connection.vendor == 'sqlite' and sqlite_fts_available():
+                _backend = SQLiteFTSBackend()
+            elif connection.vendor == 'mysql':
+                _backend = MySQLFullTextBackend()
+            else:
+                _backend = InvertedIndexBackend()
+    return _backend
+
+
+def reset_search_backend():
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+@receiver(setting_changed)
+def reset_on_setting_change(setting, **kwargs):
+    if setting == 'CHATS_SEARCH_BACKEND':
+        reset_search_backend()
+
+
+# -----------------------------
+# DRF filter backend
+# -----------------------------
+class MessageSearchFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on messages (same ?search= param)
+    that goes through the full-text backend instead of LIKE '%term%'.
+
+    Without an explicit ?ordering= the best matches come first; it must be
+    listed after OrderingFilter for that to take effect.
+    """
+    max_terms = 10
+
+    def get_conversation_ids(self, request, view):
+        """Conversations the results may come from: the user's, or the nested one if the user takes part"""
+        conversation_ids = get_conversation_ids(request.user)
+        conversation_pk = view.kwargs.get('conversation_pk')
+        if conversation_pk is not None:
+            try:
+                conversation_ids = conversation_ids & {uuid.UUID(str(conversation_pk))}
+            except ValueError:
+                conversation_ids = frozenset()
+        return conversation_ids
+
+    def filter_queryset(self, request, queryset, view):
+        terms = tokenize(' '.join(self.get_search_terms(request)))[:self.max_terms]
+        if not terms:
+            return queryset
+        backend = get_search_backend()
+        queryset = backend.search(queryset, terms, self.get_conversation_ids(request, view))
+        if filters.OrderingFilter.ordering_param not in request.query_params:
+            queryset = queryset.order_by(*backend.rank_ordering, '-sent_at')
+        return queryset
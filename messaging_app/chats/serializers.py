@@ -1,6 +1,12 @@
+import uuid
+
 from rest_framework import serializers
 from .models import User, Conversation, Message
 
+# Conversations embed only their most recent messages; the full history is
+# paginated under /conversations/<id>/messages/
+LATEST_MESSAGES_LIMIT = 20
+
 
 class UserSerializer(serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
@@ -22,7 +28,27 @@ class UserSerializer(serializers.ModelSerializer):
         return f"{obj.first_name} {obj.last_name}"
 
 
+class ConversationField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves conversations from context['conversations'] (pk -> Conversation)
+    when the view preloaded them, so bulk validation doesn't run one query
+    per item
+    """
+
+    def to_internal_value(self, data):
+        conversations = self.context.get('conversations')
+        if conversations is not None:
+            try:
+                conversation = conversations.get(uuid.UUID(str(data)))
+            except ValueError:
+                conversation = None
+            if conversation is not None:
+                return conversation
+        return super().to_internal_value(data)
+
+
 class MessageSerializer(serializers.ModelSerializer):
+    conversation = ConversationField(queryset=Conversation.objects.all())
     short_preview = serializers.CharField(source="message_body", read_only=True)
     sender_username = serializers.CharField(source='sender.username', read_only=True)
 
@@ -47,7 +73,7 @@ class MessageSerializer(serializers.ModelSerializer):
 
 class ConversationSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
-    messages = MessageSerializer(many=True, read_only=True)
+    messages = serializers.SerializerMethodField()
 
     class Meta:
         model = Conversation
@@ -55,10 +81,23 @@ class ConversationSerializer(serializers.ModelSerializer):
             "conversation_id",
             "participants",
             "created_at",
+            "last_message_at",
+            "last_message_preview",
+            "message_count",
             "messages",
         ]
         read_only_fields = ["participants", "created_at"]
 
+    def get_messages(self, obj):
+        """
+        Latest messages, newest first. Uses the bounded prefetch from
+        ConversationViewSet when present.
+        """
+        messages = getattr(obj, 'latest_messages', None)
+        if messages is None:
+            messages = obj.messages.select_related('sender').order_by('-sent_at', '-message_id')[:LATEST_MESSAGES_LIMIT]
+        return MessageSerializer(messages, many=True, context=self.context).data
+
     def create(self, validated_data):
         """
         Handle conversation creation - automatically add creator as participant
@@ -69,4 +108,23 @@ class ConversationSerializer(serializers.ModelSerializer):
         current_user = self.context['request'].user
         conversation.participants.add(current_user)
                 
-        return conversation
\ No newline at end of file
+        return conversation
+
+
+class ConversationActivitySerializer(serializers.ModelSerializer):
+    """
+    Conversation list entry built from the denormalized activity fields only
+    """
+    participants = UserSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = [
+            "conversation_id",
+            "participants",
+            "created_at",
+            "last_message_at",
+            "last_message_preview",
+            "message_count",
+        ]
+        read_only_fields = fields
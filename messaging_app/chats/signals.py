@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .activity import record_edit, record_messages, refresh_activity
+from .auth import invalidate_cached_user
+from .membership import invalidate_memberships
+from .models import Conversation, Message, User
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, **kwargs):
+    get_search_backend().index_message(instance)
+
+
+@receiver(post_delete, sender=Message)
+def unindex_message(sender, instance, **kwargs):
+    get_search_backend().remove_message(instance)
+
+
+@receiver(post_save, sender=Message)
+def update_conversation_activity(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_messages([instance])
+    else:
+        record_edit(instance)
+
+
+@receiver(post_delete, sender=Message)
+def refresh_conversation_activity(sender, instance, origin=None, using=None, **kwargs):
+    # Nothing to keep up to date when the conversation itself is being deleted
+    if isinstance(origin, Conversation) or getattr(origin, 'model', None) is Conversation:
+        return
+    if origin is None or isinstance(origin, Message):
+        refresh_activity(Conversation.objects.filter(pk=instance.conversation_id))
+        return
+    # Bulk deletes (a queryset, or a user's messages going with the user):
+    # collect the conversations and refresh them with one UPDATE afterwards,
+    # instead of one per deleted message
+    pending = getattr(origin, '_activity_conversation_ids', None)
+    if pending is None:
+        pending = origin._activity_conversation_ids = set()
+        transaction.on_commit(
+            lambda: refresh_activity(Conversation.objects.filter(pk__in=pending)), using=using,
+        )
+    pending.add(instance.conversation_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_auth_cache(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def reindex_on_username_change(sender, instance, created, update_fields=None, **kwargs):
+    # Logins save last_login only; skip anything that can't rename the user
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    get_search_backend().invalidate()
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_membership_on_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Bump cached membership when participants change, from either side of the
+    relation (conversation.participants or user.conversations)
+    """
+    if action == 'pre_clear' and not reverse:
+        # pk_set is not provided for clear(); capture participants before they go
+        instance._cleared_user_pks = list(instance.participants.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        invalidate_memberships([instance.pk])
+    elif action == 'post_clear':
+        invalidate_memberships(getattr(instance, '_cleared_user_pks', []))
+    else:
+        invalidate_memberships(pk_set or [])
+
+
+@receiver(pre_delete, sender=Conversation)
+def capture_conversation_participants(sender, instance, **kwargs):
+    instance._deleted_user_pks = list(instance.participants.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Conversation)
+def invalidate_membership_on_delete(sender, instance, **kwargs):
+    invalidate_memberships(getattr(instance, '_deleted_user_pks', []))
@@ -1,3 +1,594 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count, F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .auth import CustomUserBackend, invalidate_cached_user, user_cache_key
+from .export import EXPORT_FIELDS, export_messages
+from .management.commands.explain_queries import full_scans
+from .management.commands.generate_chat_data import stable_uuid
+from .membership import check_participation, is_participant
+from .models import PREVIEW_LENGTH, Conversation, Message, User
+from .pagination import MessageCursorPagination
+from .permissions import IsParticipantOfConversation
+from .search import InvertedIndexBackend, SQLiteFTSBackend, get_search_backend, reset_search_backend
+from .serializers import LATEST_MESSAGES_LIMIT
+from .views import MessageViewSet
+
+
+class ChatsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        self.other = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_conversation(self, messages=3, participants=None):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*(participants or [self.user, self.other]))
+        for i in range(messages):
+            Message.objects.create(
+                conversation=conversation,
+                sender=[self.user, self.other][i % 2],
+                message_body=f"Message {i}",
+            )
+        return conversation
+
+
+class ConversationListQueryTests(ChatsTestCase):
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_is_constant_in_conversation_count(self):
+        self.make_conversation()
+        self.make_conversation()
+        baseline = self.count_list_queries()
+        for _ in range(5):
+            extra = User.objects.create_user(username=f'user{_}', email=f'u{_}@example.com', password='pass12345')
+            self.make_conversation(messages=6, participants=[self.user, self.other, extra])
+        self.assertEqual(self.count_list_queries(), baseline)
+
+    def test_embeds_only_latest_messages(self):
+        conversation = self.make_conversation(messages=LATEST_MESSAGES_LIMIT + 5)
+        response = self.client.get(f'/api/conversations/{conversation.pk}/')
+        self.assertEqual(response.status_code, 200)
+        bodies = [message['message_body'] for message in response.data['messages']]
+        expected = conversation.messages.order_by('-sent_at', '-message_id').values_list('message_body', flat=True)
+        self.assertEqual(bodies, list(expected[:LATEST_MESSAGES_LIMIT]))
+
+
+class MessageCursorPaginationTests(ChatsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = self.make_conversation(messages=45)
+        self.expected = [
+            str(pk) for pk in Message.objects.order_by('-sent_at', '-message_id').values_list('message_id', flat=True)
+        ]
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_page_numbers_remain_the_default(self):
+        data = self.get('/api/messages/')
+        self.assertEqual(data['count'], 45)
+        self.assertEqual(data['current_page'], 1)
+
+    def test_walks_forwards_and_back_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get('/api/messages/', pagination='cursor')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+        self.assertNotIn('count', data)
+
+        seen, pages = [], []
+        while True:
+            pages.append(data)
+            seen += [message['message_id'] for message in data['results']]
+            if not data['next']:
+                break
+            data = self.get(data['next'])
+        self.assertEqual(seen, self.expected)
+        self.assertEqual([len(page['results']) for page in pages], [20, 20, 5])
+
+        previous = self.get(pages[-1]['previous'])
+        self.assertEqual(previous['results'], pages[1]['results'])
+        first = self.get(previous['previous'])
+        self.assertEqual(first['results'], pages[0]['results'])
+        self.assertIsNone(first['previous'])
+
+    def test_ascending_ordering(self):
+        data = self.get('/api/messages/', pagination='cursor', ordering='sent_at', page_size=30)
+        data = self.get(data['next'])
+        ids = [message['message_id'] for message in data['results']]
+        self.assertEqual(ids, self.expected[::-1][30:])
+
+    def test_estimated_count_is_capped(self):
+        with mock.patch.object(MessageCursorPagination, 'count_cap', 10):
+            data = self.get('/api/messages/', pagination='cursor', count='estimate')
+        self.assertEqual((data['count'], data['count_capped']), (10, True))
+        data = self.get('/api/messages/', pagination='cursor', count='estimate')
+        self.assertEqual((data['count'], data['count_capped']), (45, False))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/messages/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unsupported_ordering_is_rejected(self):
+        response = self.client.get('/api/messages/', {'pagination': 'cursor', 'ordering': 'sender'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/messages/', {'pagination': 'cursor', 'search': 'message'})
+        self.assertEqual(response.status_code, 400)
+        data = self.get('/api/messages/', pagination='cursor', ordering='-sent_at')
+        self.assertEqual([message['message_id'] for message in data['results']], self.expected[:20])
+
+
+class ExplainQueriesCommandTests(TestCase):
+    def test_view_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_queries', users=10, conversations=20, messages=300, stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+        self.assertFalse(User.objects.exists())
+
+    def test_detects_full_scan(self):
+        plan, scans = full_scans(Message.objects.filter(message_body='hello'))
+        self.assertEqual(scans, [Message._meta.db_table])
+
+
+class MessageSearchTests(ChatsTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_search_backend()
+        self.addCleanup(reset_search_backend)
+        self.conversation = self.make_conversation(messages=0)
+        self.send('Deploying the release tonight')
+        self.send('Release notes are ready, release party later')
+        self.send('Lunch?', sender=self.other)
+        outsider = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        hidden = self.make_conversation(messages=0, participants=[outsider])
+        Message.objects.create(conversation=hidden, sender=outsider, message_body='release secrets')
+
+    def send(self, body, sender=None):
+        return Message.objects.create(conversation=self.conversation, sender=sender or self.user, message_body=body)
+
+    def search(self, term, **params):
+        response = self.client.get('/api/messages/', {'search': term, **params})
+        self.assertEqual(response.status_code, 200)
+        return [message['message_body'] for message in response.data['results']]
+
+    def check_backend(self):
+        # Prefix match, best match first, scoped to the user's conversations
+        self.assertEqual(self.search('rele'), ['Release notes are ready, release party later', 'Deploying the release tonight'])
+        self.assertEqual(self.search('release tonight'), ['Deploying the release tonight'])
+        self.assertEqual(self.search('bo'), ['Lunch?'])
+        self.assertEqual(self.search('nothing'), [])
+
+        message = Message.objects.get(message_body='Lunch?')
+        message.message_body = 'Dinner?'
+        message.save()
+        self.assertEqual(self.search('dinn'), ['Dinner?'])
+        message.delete()
+        self.assertEqual(self.search('dinn'), [])
+
+    def test_sqlite_fts(self):
+        self.assertIsInstance(get_search_backend(), SQLiteFTSBackend)
+        self.check_backend()
+
+    @override_settings(CHATS_SEARCH_BACKEND='chats.search.InvertedIndexBackend')
+    def test_inverted_index(self):
+        self.assertIsInstance(get_search_backend(), InvertedIndexBackend)
+        self.check_backend()
+
+    @override_settings(CHATS_SEARCH_BACKEND='chats.search.InvertedIndexBackend')
+    def test_inverted_index_limits_within_the_users_conversations(self):
+        hidden = Message.objects.get(message_body='release secrets').conversation
+        for _ in range(3):
+            Message.objects.create(conversation=hidden, sender=hidden.participants.get(), message_body='release release')
+        with mock.patch.object(InvertedIndexBackend, 'max_results', 2):
+            self.assertEqual(len(self.search('release')), 2)
+            response = self.client.get(f'/api/conversations/{hidden.pk}/messages/', {'search': 'release'})
+            self.assertEqual(response.data['results'], [])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(len(self.search('rele*"(')), 2)
+        self.assertEqual(self.search('party OR lunch'), [])
+
+
+class MembershipCacheTests(ChatsTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.conversation = self.make_conversation(messages=1)
+        self.message = self.conversation.messages.get()
+
+    def test_warm_checks_run_no_queries(self):
+        self.assertTrue(is_participant(self.user, self.conversation.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_participant(self.user, self.conversation.pk))
+            self.assertFalse(is_participant(self.user, uuid.uuid4()))
+
+    def test_invalidated_from_both_sides(self):
+        outsider = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        self.assertFalse(is_participant(outsider, self.conversation.pk))
+        self.conversation.participants.add(outsider)
+        self.assertTrue(is_participant(outsider, self.conversation.pk))
+        outsider.conversations.remove(self.conversation)
+        self.assertFalse(is_participant(outsider, self.conversation.pk))
+
+        self.assertTrue(is_participant(self.other, self.conversation.pk))
+        self.conversation.participants.clear()
+        self.assertFalse(is_participant(self.user, self.conversation.pk))
+        self.assertFalse(is_participant(self.other, self.conversation.pk))
+
+    def test_conversation_delete(self):
+        self.assertTrue(is_participant(self.user, self.conversation.pk))
+        conversation_id = self.conversation.pk
+        self.conversation.delete()
+        self.assertFalse(is_participant(self.user, conversation_id))
+
+    def test_bulk_check(self):
+        other = Conversation.objects.create()
+        self.assertEqual(
+            check_participation(self.user, [self.conversation.pk, other.pk]),
+            {self.conversation.pk: True, other.pk: False},
+        )
+        outsider_message = Message(conversation=other, sender=self.other, message_body='hi')
+        request = mock.Mock(user=self.user)
+        permitted = IsParticipantOfConversation().filter_permitted(request, [self.message, outsider_message, other, self.conversation])
+        self.assertEqual(permitted, [self.message, self.conversation])
+
+    def test_message_detail_and_create_use_cache(self):
+        self.client.get(f'/api/messages/{self.message.pk}/')
+        response = self.client.post(
+            f'/api/conversations/{self.conversation.pk}/messages/',
+            {'conversation': str(self.conversation.pk), 'message_body': 'Hello again'},
+        )
+        self.assertEqual(response.status_code, 201)
+        outsider = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        self.client.force_authenticate(outsider)
+        response = self.client.post(
+            '/api/messages/', {'conversation': str(self.conversation.pk), 'message_body': 'Let me in'},
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class BulkMessageCreateTests(ChatsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = self.make_conversation(messages=0)
+        self.second = self.make_conversation(messages=0)
+        outsider = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        self.foreign = self.make_conversation(messages=0, participants=[outsider])
+
+    def post(self, url, payload):
+        return self.client.post(url, payload, format='json')
+
+    def test_creates_across_conversations_in_constant_queries(self):
+        payload = [
+            {'conversation': str(conversation.pk), 'message_body': f'Imported {i}'}
+            for i in range(30)
+            for conversation in (self.conversation, self.second)
+        ]
+        self.post('/api/messages/bulk/', payload[:2])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post('/api/messages/bulk/', payload)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 60)
+        self.assertLess(len(queries), 10)
+        self.assertEqual(self.conversation.messages.count(), 31)
+        self.assertEqual(
+            [result['message']['message_body'] for result in response.data['results']],
+            [item['message_body'] for item in payload],
+        )
+        self.assertTrue(all(m['message']['sender'] == self.user.pk for m in response.data['results']))
+
+    def test_per_item_results(self):
+        response = self.post('/api/messages/bulk/', {'messages': [
+            {'conversation': str(self.conversation.pk), 'message_body': 'Valid'},
+            {'conversation': str(self.conversation.pk), 'message_body': 'x'},
+            {'conversation': str(self.foreign.pk), 'message_body': 'Not mine'},
+            {'conversation': 'not-a-uuid', 'message_body': 'Broken'},
+        ]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 400, 403, 400])
+        self.assertIn('message_body', response.data['results'][1]['errors'])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_nested_route_and_limits(self):
+        response = self.post(f'/api/conversations/{self.conversation.pk}/messages/bulk/', [{'message_body': 'Hi there'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.conversation.messages.get().message_body, 'Hi there')
+
+        response = self.post(f'/api/conversations/{self.foreign.pk}/messages/bulk/', [{'message_body': 'Hi there'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][0]['status'], 403)
+
+        with mock.patch.object(MessageViewSet, 'bulk_create_limit', 2):
+            response = self.post('/api/messages/bulk/', [{'message_body': 'Hi'}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post('/api/messages/bulk/', []).status_code, 400)
+
+
+class ConversationActivityTests(ChatsTestCase):
+    def activity(self):
+        response = self.client.get('/api/conversations/activity/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_counters_follow_inserts_edits_and_deletes(self):
+        conversation = self.make_conversation(messages=3)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 3)
+        self.assertEqual(conversation.last_message_preview, 'Message 2')
+
+        latest = conversation.messages.order_by('-sent_at').first()
+        latest.message_body = 'Edited ' + 'x' * 200
+        latest.save()
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_preview, ('Edited ' + 'x' * 200)[:PREVIEW_LENGTH])
+
+        latest.delete()
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.message_count, conversation.last_message_preview), (2, 'Message 1'))
+
+        # A stale instance saving must not roll the counters back
+        stale = Conversation.objects.get(pk=conversation.pk)
+        Message.objects.create(conversation=conversation, sender=self.user, message_body='Newest')
+        stale.save()
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.message_count, conversation.last_message_preview), (3, 'Newest'))
+
+    def test_bulk_create_updates_counters(self):
+        conversation = self.make_conversation(messages=1)
+        self.client.post('/api/messages/bulk/', [
+            {'conversation': str(conversation.pk), 'message_body': f'Bulk {i}'} for i in range(4)
+        ], format='json')
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 5)
+        self.assertEqual(conversation.last_message_preview, 'Bulk 3')
+
+    def test_activity_order_and_constant_queries(self):
+        # A conversation without messages is ordered by its creation time
+        empty = self.make_conversation(messages=0)
+        older = self.make_conversation(messages=2)
+        newer = self.make_conversation(messages=1)
+        self.assertEqual([c['conversation_id'] for c in self.activity()], [str(newer.pk), str(older.pk), str(empty.pk)])
+
+        Message.objects.create(conversation=older, sender=self.other, message_body='Bump')
+        self.assertEqual(self.activity()[0]['last_message_preview'], 'Bump')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.activity()
+        for _ in range(3):
+            self.make_conversation(messages=10)
+        with CaptureQueriesContext(connection) as more_queries:
+            self.activity()
+        self.assertEqual(len(more_queries), len(queries))
+        self.assertFalse(any(Message._meta.db_table in query['sql'] for query in more_queries))
+
+    def test_deleting_a_users_messages_refreshes_each_conversation_once(self):
+        first, second = self.make_conversation(messages=4), self.make_conversation(messages=3)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+        refreshes = [q for q in queries if q['sql'].startswith(f'UPDATE "{Conversation._meta.db_table}"')]
+        self.assertEqual(len(refreshes), 1)
+        for conversation in (first, second):
+            conversation.refresh_from_db()
+            self.assertEqual(conversation.message_count, conversation.messages.count())
+            self.assertEqual(conversation.last_message_at, conversation.messages.latest('sent_at').sent_at)
+
+    def test_backfill(self):
+        conversation = self.make_conversation(messages=3)
+        empty = self.make_conversation(messages=0)
+        Conversation.objects.update(message_count=0, last_message_at=F('created_at'), last_message_preview='')
+        call_command('backfill_conversation_activity', batch_size=1, stdout=StringIO())
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.message_count, conversation.last_message_preview), (3, 'Message 2'))
+        self.assertEqual(conversation.last_message_at, conversation.messages.latest('sent_at').sent_at)
+        empty.refresh_from_db()
+        self.assertEqual(empty.last_message_at, empty.created_at)
+
+
+class CachedAuthBackendTests(ChatsTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.backend = CustomUserBackend()
+        self.client = APIClient()
+
+    def basic(self, password='pass12345', username='alice'):
+        token = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        return self.client.get('/api/conversations/', HTTP_AUTHORIZATION=f'Basic {token}')
+
+    def test_get_user_is_cached_until_saved(self):
+        self.backend.get_user(str(self.user.pk))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_user(str(self.user.pk)).username, 'alice')
+        self.user.first_name = 'Alice'
+        self.user.save()
+        self.assertEqual(self.backend.get_user(str(self.user.pk)).first_name, 'Alice')
+        user_id = str(self.user.pk)
+        self.user.delete()
+        self.assertIsNone(self.backend.get_user(user_id))
+
+    def test_basic_auth_skips_hasher_when_cached(self):
+        with mock.patch.object(User, 'check_password', autospec=True, side_effect=User.check_password) as check:
+            self.assertEqual(self.basic().status_code, 200)
+            self.assertEqual(self.basic().status_code, 200)
+            self.assertEqual(check.call_count, 1)
+            # Failures are never cached
+            self.assertEqual(self.basic(password='wrong').status_code, 401)
+            failed_once = check.call_count
+            self.assertEqual(self.basic(password='wrong').status_code, 401)
+            self.assertGreater(check.call_count, failed_once)
+
+    def test_password_change_drops_cached_login(self):
+        self.assertEqual(self.basic().status_code, 200)
+        self.user.set_password('new-pass-123')
+        self.user.save()
+        self.assertEqual(self.basic().status_code, 401)
+        self.assertEqual(self.basic(password='new-pass-123').status_code, 200)
+
+    def test_inactive_user_rejected_from_cache(self):
+        self.assertEqual(self.basic().status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_cached_user(self.user.pk)
+        self.assertEqual(self.basic().status_code, 401)
+
+    def test_cached_user_has_no_password_hash(self):
+        self.backend.get_user(str(self.user.pk))
+        self.assertNotIn(self.user.password, repr(cache.get(user_cache_key(str(self.user.pk)))))
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(str(self.user.pk))
+            self.assertEqual(user.get_session_auth_hash(), self.user.get_session_auth_hash())
+        # Session logins go through the cached snapshot
+        self.assertTrue(self.client.login(username='alice', password='pass12345'))
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 200)
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 200)
+
+    def test_inactive_user_has_no_session_user(self):
+        self.assertTrue(self.client.login(username='alice', password='pass12345'))
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.backend.get_user(str(self.user.pk)))
+        # The snapshot cached by that lookup is rejected the same way
+        self.assertIsNotNone(cache.get(user_cache_key(str(self.user.pk))))
+        self.assertIsNone(self.backend.get_user(str(self.user.pk)))
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 401)
+
+    def test_failed_login_hashes_once(self):
+        with mock.patch.object(User, 'check_password', autospec=True, side_effect=User.check_password) as check:
+            self.assertEqual(self.basic(password='wrong').status_code, 401)
+        self.assertEqual(check.call_count, 1)
+        with mock.patch.object(User, 'set_password', autospec=True, side_effect=User.set_password) as hashed:
+            self.assertEqual(self.basic(username='nobody').status_code, 401)
+        self.assertEqual(hashed.call_count, 1)
+
+    def test_only_basic_auth_is_cached(self):
+        with mock.patch.object(User, 'check_password', autospec=True, side_effect=User.check_password) as check:
+            self.backend.authenticate(None, username='alice', password='pass12345')
+            self.backend.authenticate(None, username='alice', password='pass12345')
+        self.assertEqual(check.call_count, 2)
+
+
+class MessageExportTests(ChatsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = self.make_conversation(messages=3)
+        self.second = self.make_conversation(messages=2)
+        self.make_conversation(messages=4, participants=[self.other])  # not alice's
+
+    def stream(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_jsonl_exports_only_the_users_conversations(self):
+        response = self.client.get('/api/messages/export/')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="messages.jsonl"')
+        rows = [json.loads(line) for line in self.stream(response).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(
+            {row['conversation_id'] for row in rows}, {str(self.first.pk), str(self.second.pk)},
+        )
+        message = Message.objects.select_related('sender').get(pk=rows[0]['message_id'])
+        self.assertEqual(rows[0]['sender_username'], message.sender.username)
+        self.assertEqual(rows[0]['message_body'], message.message_body)
+
+    def test_csv_and_gzip(self):
+        response = self.client.get('/api/messages/export/', {'output': 'csv', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = list(csv.reader(io.StringIO(gzip.decompress(self.stream(response)).decode())))
+        self.assertEqual(tuple(rows[0]), EXPORT_FIELDS)
+        self.assertEqual(len(rows), 6)
+
+    def test_nested_conversation(self):
+        response = self.client.get(f'/api/conversations/{self.second.pk}/messages/export/')
+        self.assertEqual(len(self.stream(response).splitlines()), 2)
+        hidden = Conversation.objects.exclude(participants=self.user).get()
+        response = self.client.get(f'/api/conversations/{hidden.pk}/messages/export/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_streams_in_chunks(self):
+        chunks = list(export_messages(self.user, chunk_size=2))
+        self.assertEqual([len(chunk.splitlines()) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(b''.join(chunks), b''.join(export_messages(self.user)))
+        # The first chunk, then up to three keyset ranges for each chunk after a full one
+        with self.assertNumQueries(7):
+            list(export_messages(self.user, 'csv', chunk_size=2))
+        with self.assertNumQueries(4):
+            list(export_messages(self.user, 'csv', chunk_size=5))
+
+    def test_chunks_resume_after_messages_sent_at_the_same_time(self):
+        Message.objects.filter(conversation=self.first).update(sent_at=datetime(2026, 1, 1, tzinfo=dt_timezone.utc))
+        expected = b''.join(export_messages(self.user))
+        for chunk_size in (1, 2, 3):
+            self.assertEqual(b''.join(export_messages(self.user, chunk_size=chunk_size)), expected)
+        self.assertEqual(len(expected.splitlines()), 5)
+
+    def test_unknown_format(self):
+        response = self.client.get('/api/messages/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.jsonl.gz')
+            err = StringIO()
+            call_command('export_messages', 'alice', gzip=True, output=path, stdout=StringIO(), stderr=err)
+            with gzip.open(path, 'rt') as export:
+                self.assertEqual(len(export.readlines()), 5)
+        self.assertIn('MB/s', err.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('export_messages', 'nobody', stdout=StringIO(), stderr=StringIO())
+
+
+class GenerateChatDataTests(TestCase):
+    def test_generates_consistent_deterministic_data(self):
+        call_command(
+            'generate_chat_data', users=20, conversations=50, messages=600, chunk_size=100, seed=7, stdout=StringIO(),
+        )
+        self.assertEqual(
+            (User.objects.count(), Conversation.objects.count(), Message.objects.count()), (20, 50, 600),
+        )
+        # Keys depend only on the prefix and the seed
+        self.assertEqual(
+            set(Conversation.objects.values_list('pk', flat=True)),
+            {stable_uuid('load', 7, 'conversation', index) for index in range(50)},
+        )
+        # Activity counters match the inserted messages
+        mismatched = Conversation.objects.annotate(count=Count('messages')).exclude(count=F('message_count'))
+        self.assertFalse(mismatched.exists())
+        self.assertFalse(Message.objects.filter(sent_at__gt=datetime(2025, 1, 1, tzinfo=dt_timezone.utc)).exists())
+        # Zipfian sizes: the largest conversation dwarfs the median
+        sizes = sorted(Conversation.objects.values_list('message_count', flat=True))
+        self.assertGreater(sizes[-1], 5 * sizes[len(sizes) // 2])
+        self.assertTrue(User.objects.get(username='load0').check_password('loadtest123'))
+
+        with self.assertRaises(CommandError):
+            call_command('generate_chat_data', users=20, stdout=StringIO())
+        # Another prefix with the same seed gets its own keys
+        call_command(
+            'generate_chat_data', users=20, conversations=50, messages=600, chunk_size=100, seed=7, prefix='x',
+            stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.filter(username__startswith='x').count(), 20)
+        self.assertEqual(Message.objects.count(), 1200)
@@ -1,12 +1,24 @@
-from rest_framework import viewsets, permissions, filters, serializers, status
+import uuid
+
+from rest_framework import viewsets, permissions, filters, serializers, status, exceptions
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import add_never_cache_headers
+from django.db.models import Prefetch
 from .models import Conversation, Message, User
-from .serializers import ConversationSerializer, MessageSerializer, UserSerializer
+from .serializers import (
+    ConversationActivitySerializer, ConversationSerializer, MessageSerializer, UserSerializer, LATEST_MESSAGES_LIMIT,
+)
 from .permissions import IsParticipantOfConversation
+from .membership import is_participant
 from .pagination import MessagePagination  # NEW
 from .filters import MessageFilter  # NEW
+from .search import MessageSearchFilter, get_search_backend
+from .activity import record_messages
+from .export import CONTENT_TYPES, EXPORT_FORMATS, export_filename, export_messages
 
 
 # -----------------------------
@@ -18,9 +30,15 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """
-        Return only conversations where the current user is a participant
+        Return only conversations where the current user is a participant,
+        with participants and the latest messages prefetched in one query each
         """
-        return Conversation.objects.filter(participants=self.request.user)
+        latest_messages = Message.objects.select_related('sender').order_by('-sent_at', '-message_id')
+        return Conversation.objects.filter(participants=self.request.user).prefetch_related(
+            'participants',
+            # Sliced prefetch: Django limits per conversation with a window function
+            Prefetch('messages', queryset=latest_messages[:LATEST_MESSAGES_LIMIT], to_attr='latest_messages'),
+        ).order_by('-created_at')
     
     def perform_create(self, serializer):
         """
@@ -29,6 +47,22 @@ class ConversationViewSet(viewsets.ModelViewSet):
         conversation = serializer.save()
         conversation.participants.add(self.request.user)
 
+    @action(detail=False, methods=['get'])
+    def activity(self, request):
+        """
+        Conversations by most recent message, from the denormalized activity
+        fields: no message rows are read, whatever the history size
+        """
+        queryset = Conversation.objects.filter(participants=request.user).prefetch_related('participants').order_by(
+            '-last_message_at', '-created_at',
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = ConversationActivitySerializer(page, many=True, context=self.get_serializer_context())
+            return self.get_paginated_response(serializer.data)
+        serializer = ConversationActivitySerializer(queryset, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+
     # Optional: Custom action to add participants
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsParticipantOfConversation])
     def add_participant(self, request, pk=None):
@@ -51,11 +85,13 @@ class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated, IsParticipantOfConversation]
     pagination_class = MessagePagination  # NEW: Custom pagination
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]  # NEW
+    # Full-text search goes last so it can rank results when no ?ordering= is given
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, MessageSearchFilter]
     filterset_class = MessageFilter  # NEW: Custom filter class
-    search_fields = ['message_body', 'sender__username']  # NEW: Search fields
+    search_fields = ['message_body', 'sender__username']  # Indexed by chats.search
     ordering_fields = ['sent_at', 'sender']  # NEW: Ordering fields
     ordering = ['-sent_at']  # NEW: Default ordering (newest first)
+    bulk_create_limit = 500
     
     def get_queryset(self):
         """
@@ -81,8 +117,8 @@ class MessageViewSet(viewsets.ModelViewSet):
             try:
                 conversation = Conversation.objects.get(pk=conversation_pk)
                 # Check if user is a participant
-                if self.request.user not in conversation.participants.all():
-                    raise permissions.PermissionDenied("You are not a participant of this conversation")
+                if not is_participant(self.request.user, conversation.pk):
+                    raise exceptions.PermissionDenied("You are not a participant of this conversation")
                 serializer.save(sender=self.request.user, conversation=conversation)
             except Conversation.DoesNotExist:
                 raise serializers.ValidationError({"conversation": "Conversation not found"})
@@ -93,11 +129,119 @@ class MessageViewSet(viewsets.ModelViewSet):
                 raise serializers.ValidationError({"conversation": "This field is required"})
             
             # Check if user is a participant
-            if self.request.user not in conversation.participants.all():
-                raise permissions.PermissionDenied("You are not a participant of this conversation")
+            if not is_participant(self.request.user, conversation.pk):
+                raise exceptions.PermissionDenied("You are not a participant of this conversation")
             
             serializer.save(sender=self.request.user)
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request, conversation_pk=None):
+        """
+        Create up to bulk_create_limit messages in one request, as a list or
+        {"messages": [...]}. Valid messages in conversations the user takes
+        part in are inserted with one bulk INSERT; every item gets its own
+        result (201, 400 or 403) at its index.
+        """
+        items = request.data.get('messages') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            raise serializers.ValidationError({"messages": "Expected a non-empty list of messages"})
+        if len(items) > self.bulk_create_limit:
+            raise serializers.ValidationError({"messages": f"At most {self.bulk_create_limit} messages per request"})
+        if conversation_pk is not None:
+            # Nested URL: every message goes to that conversation
+            items = [{**item, 'conversation': conversation_pk} if isinstance(item, dict) else item for item in items]
+
+        # Load every referenced conversation in one query for validation
+        conversation_ids = set()
+        for item in items:
+            try:
+                conversation_ids.add(uuid.UUID(str(item.get('conversation'))))
+            except (AttributeError, ValueError):
+                pass
+        context = self.get_serializer_context()
+        context['conversations'] = Conversation.objects.in_bulk(conversation_ids)
+        serializer = MessageSerializer(data=items, many=True, context=context)
+
+        results = [None] * len(items)
+        if serializer.is_valid():
+            validated = list(enumerate(serializer.validated_data))
+        else:
+            validated = []
+            for index, errors in enumerate(serializer.errors):
+                if errors:
+                    results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST, "errors": errors}
+                else:
+                    validated.append((index, serializer.child.run_validation(items[index])))
+
+        # One membership lookup for the whole batch, not one per message
+        candidates = [(index, Message(sender=request.user, **data)) for index, data in validated]
+        permitted = {
+            id(message) for message in IsParticipantOfConversation().filter_permitted(
+                request, [message for _, message in candidates]
+            )
+        }
+        created = []
+        for index, message in candidates:
+            if id(message) in permitted:
+                created.append((index, message))
+            else:
+                results[index] = {
+                    "index": index,
+                    "status": status.HTTP_403_FORBIDDEN,
+                    "errors": {"conversation": ["You are not a participant of this conversation"]},
+                }
+
+        if created:
+            messages = [message for _, message in created]
+            with transaction.atomic():
+                Message.objects.bulk_create(messages)
+                # bulk_create skips post_save: update activity counters and the
+                # in-process search index here
+                record_messages(messages)
+                transaction.on_commit(lambda: [get_search_backend().index_message(m) for m in messages])
+            for index, message in created:
+                results[index] = {
+                    "index": index,
+                    "status": status.HTTP_201_CREATED,
+                    "message": MessageSerializer(message, context=context).data,
+                }
+
+        if len(created) == len(items):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"created": len(created), "results": results}, status=response_status)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, conversation_pk=None):
+        """
+        Stream every message of the user's conversations (or of the nested
+        conversation) as ?output=jsonl (default) or csv, gzip-compressed with
+        ?gzip=1. Rows are read in keyset chunks and encoded chunk by chunk,
+        never loaded at once, on every database backend.
+        """
+        export_format = request.query_params.get('output', 'jsonl')
+        if export_format not in EXPORT_FORMATS:
+            raise serializers.ValidationError({"output": f"Expected one of {', '.join(EXPORT_FORMATS)}"})
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        if conversation_pk is not None:
+            try:
+                conversation_pk = uuid.UUID(str(conversation_pk))
+            except ValueError:
+                raise exceptions.NotFound()
+            if not is_participant(request.user, conversation_pk):
+                raise exceptions.PermissionDenied("You are not a participant of this conversation")
+
+        response = StreamingHttpResponse(
+            export_messages(request.user, export_format, compress, conversation_pk),
+            content_type='application/gzip' if compress else f"{CONTENT_TYPES[export_format]}; charset=utf-8",
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(export_format, compress)}"'
+        add_never_cache_headers(response)
+        return response
+
     def update(self, request, *args, **kwargs):
         """
         Override update to ensure only participants can update messages
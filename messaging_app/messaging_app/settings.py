@@ -92,6 +92,14 @@ WSGI_APPLICATION = 'messaging_app.wsgi.application'
 
 AUTH_USER_MODEL = "chats.User"
 
+# CustomUserBackend caches user lookups and Basic-auth verifications. It
+# extends ModelBackend; listing both would hash failed passwords twice
+AUTHENTICATION_BACKENDS = [
+    "chats.auth.CustomUserBackend",
+]
+CHATS_USER_CACHE_TIMEOUT = 60
+CHATS_CREDENTIAL_CACHE_TIMEOUT = 60
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 